@@ -13,6 +13,7 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from channels.security.websocket import AllowedHostsOriginValidator
 import notifications.routing
+import orders.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Dalooneh.settings')
 
@@ -22,6 +23,7 @@ application = ProtocolTypeRouter({
         AuthMiddlewareStack(
             URLRouter(
                 notifications.routing.websocket_urlpatterns
+                + orders.routing.websocket_urlpatterns
             )
         )
     ),
@@ -0,0 +1,387 @@
+"""
+Project cache: an in-process LRU tier in front of a shared backend.
+
+``TieredCache`` is a Django cache backend. Reads are served from a small
+per-process LRU when possible and fall through to the shared backend (Redis
+or the file cache in production, the memory cache in development and tests);
+writes go through to both. Local entries live for at most LOCAL_TIMEOUT
+seconds, which bounds how stale one process can be after another process
+writes a key. The local tier and the counters are shared by every thread of
+a process, and like Django's memory cache it stores pickled values, so a
+caller that mutates what it set or got (a cached response picking up
+cookies, say) never changes the cached copy.
+
+``TieredCache.get_or_set`` adds stampede protection:
+
+- single flight: when a key is missing only one caller computes it, other
+  callers (threads or processes) wait for its result instead of computing it
+  themselves;
+- early recompute: a value is refreshed by one caller once EARLY_RECOMPUTE of
+  its timeout has passed, while every other caller keeps getting the current
+  value, so popular keys never expire under load.
+
+Cached data belongs to a ``Namespace`` (``menu``, ``tables``, ``customers``).
+Every key of a namespace carries the namespace's version, and
+``Namespace.invalidate()`` bumps it, dropping the whole namespace in every
+process at once.
+
+``request_counters()`` additionally counts the lookups made by one request
+(see Dalooneh/instrumentation.py).
+"""
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.views.decorators.cache import cache_page
+
+_MISSING = object()
+
+# Per-process state, shared by the per-thread backend instances of one cache alias
+_local_tiers = {}
+_counters = {}
+_flight_locks = {}
+_state_lock = threading.Lock()
+
+# Counters of the current request, across every tiered alias
+_request_counters = ContextVar('cache_request_counters', default=None)
+
+
+class LocalLRU:
+    """Thread-safe LRU mapping of key -> pickled value with a per-entry expiry"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=_MISSING):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+        return pickle.loads(value)
+
+    def set(self, key, value, timeout):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + timeout)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class CacheCounters:
+    """Hit/miss and stampede counters for one cache alias"""
+
+    FIELDS = ('local_hits', 'shared_hits', 'misses', 'sets', 'recomputes', 'early_recomputes', 'lock_waits')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def incr(self, field):
+        with self._lock:
+            self._values[field] += 1
+        request_values = _request_counters.get()
+        if request_values is not None:
+            request_values[field] += 1
+
+    def reset(self):
+        with self._lock:
+            self._values = dict.fromkeys(self.FIELDS, 0)
+
+    def snapshot(self):
+        with self._lock:
+            values = dict(self._values)
+        lookups = values['local_hits'] + values['shared_hits'] + values['misses']
+        values['hit_ratio'] = round((lookups - values['misses']) / lookups, 4) if lookups else None
+        return values
+
+
+@contextmanager
+def request_counters():
+    """Count the cache activity of the enclosed code (including its sync_to_async calls) into the yielded dict"""
+    values = dict.fromkeys(CacheCounters.FIELDS, 0)
+    token = _request_counters.set(values)
+    try:
+        yield values
+    finally:
+        _request_counters.reset(token)
+
+
+class TieredCache(BaseCache):
+    """
+    Django cache backend with a local LRU tier in front of another cache alias.
+
+    OPTIONS:
+        SHARED_ALIAS: the cache alias behind the local tier (default 'shared')
+        LOCAL_MAX_ENTRIES: size of the local tier (default 1000)
+        LOCAL_TIMEOUT: longest a value is served from the local tier, in seconds (default 5)
+        EARLY_RECOMPUTE: fraction of a get_or_set timeout after which the value is refreshed (default 0.8)
+        LOCK_TIMEOUT: how long a get_or_set computation may hold its key, in seconds (default 30)
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.shared_alias = options.get('SHARED_ALIAS', 'shared')
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self.early_recompute = options.get('EARLY_RECOMPUTE', 0.8)
+        self.lock_timeout = options.get('LOCK_TIMEOUT', 30)
+        name = location or self.shared_alias
+        with _state_lock:
+            self.local = _local_tiers.setdefault(name, LocalLRU(options.get('LOCAL_MAX_ENTRIES', 1000)))
+            self.counters = _counters.setdefault(name, CacheCounters())
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def _local_timeout(self, timeout):
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is None:
+            return self.local_timeout
+        return min(timeout - time.time(), self.local_timeout)
+
+    def _remember(self, local_key, value, timeout=DEFAULT_TIMEOUT):
+        local_timeout = self._local_timeout(timeout)
+        if local_timeout > 0:
+            self.local.set(local_key, value, local_timeout)
+        else:
+            self.local.delete(local_key)
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        value = self.local.get(local_key)
+        if value is not _MISSING:
+            self.counters.incr('local_hits')
+            return value
+
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self.counters.incr('misses')
+            return default
+        self.counters.incr('shared_hits')
+        self._remember(local_key, value)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        self.shared.set(key, value, timeout=self._shared_timeout(timeout), version=version)
+        self.counters.incr('sets')
+        self._remember(local_key, value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        if not self.shared.add(key, value, timeout=self._shared_timeout(timeout), version=version):
+            return False
+        self.counters.incr('sets')
+        self._remember(local_key, value, timeout)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self.local.delete(self.make_and_validate_key(key, version=version))
+        return self.shared.touch(key, timeout=self._shared_timeout(timeout), version=version)
+
+    def delete(self, key, version=None):
+        self.local.delete(self.make_and_validate_key(key, version=version))
+        return self.shared.delete(key, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def incr(self, key, delta=1, version=None):
+        self.local.delete(self.make_and_validate_key(key, version=version))
+        return self.shared.incr(key, delta, version=version)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def _shared_timeout(self, timeout):
+        # Pass our own default along rather than the shared alias's
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Return the cached value of ``key``, computing it with ``default`` (a
+        callable or a value) when it is missing or due for an early recompute.
+        """
+        timeout = self._shared_timeout(timeout)
+        fresh_key = f'{key}:fresh'
+        lock_key = f'{key}:lock'
+
+        value = self.get(key, _MISSING, version=version)
+        if value is not _MISSING:
+            if timeout is None or self.get(fresh_key, version=version):
+                return value
+            # Past its early recompute point: one caller refreshes it, the rest keep the current value
+            if not self.shared.add(lock_key, 1, self.lock_timeout, version=version):
+                return value
+            self.counters.incr('early_recomputes')
+            return self._compute(key, default, timeout, version, fresh_key, lock_key)
+
+        with self._flight_lock(key, version):
+            # Another thread of this process may have computed it meanwhile
+            value = self.get(key, _MISSING, version=version)
+            if value is not _MISSING:
+                return value
+            deadline = time.monotonic() + self.lock_timeout
+            while not self.shared.add(lock_key, 1, self.lock_timeout, version=version):
+                # Another process is computing it; wait for its result
+                self.counters.incr('lock_waits')
+                time.sleep(0.05)
+                value = self.shared.get(key, _MISSING, version=version)
+                if value is not _MISSING:
+                    return value
+                if time.monotonic() > deadline:
+                    break
+            return self._compute(key, default, timeout, version, fresh_key, lock_key)
+
+    def _compute(self, key, default, timeout, version, fresh_key, lock_key):
+        try:
+            value = default() if callable(default) else default
+            self.counters.incr('recomputes')
+            self.set(key, value, timeout, version=version)
+            if timeout:
+                self.set(fresh_key, True, timeout * self.early_recompute, version=version)
+        finally:
+            self.shared.delete(lock_key, version=version)
+        return value
+
+    def _flight_lock(self, key, version):
+        flight_key = (id(self.local), self.make_key(key, version=version))
+        with _state_lock:
+            lock = _flight_locks.get(flight_key)
+            if lock is None:
+                lock = _flight_locks[flight_key] = threading.Lock()
+        return _FlightLock(flight_key, lock)
+
+    def stats(self):
+        """Counters for this process, plus the local tier's size"""
+        return {**self.counters.snapshot(), 'local_entries': len(self.local)}
+
+
+class _FlightLock:
+    """Holds a per-key lock and forgets it once no thread is waiting on it"""
+
+    def __init__(self, flight_key, lock):
+        self.flight_key = flight_key
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+        with _state_lock:
+            if not self.lock.locked():
+                _flight_locks.pop(self.flight_key, None)
+
+
+class Namespace:
+    """A group of cache keys that can be invalidated together"""
+
+    def __init__(self, name, timeout=DEFAULT_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+        self.version_key = f'namespace:{name}'
+
+    def version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            # Start from the clock so a version lost from the cache is not reused
+            cache.add(self.version_key, int(time.time()), None)
+            version = cache.get(self.version_key)
+        return version
+
+    async def aversion(self):
+        version = await cache.aget(self.version_key)
+        if version is None:
+            await cache.aadd(self.version_key, int(time.time()), None)
+            version = await cache.aget(self.version_key)
+        return version
+
+    def invalidate(self):
+        """Drop every key of the namespace, in every process"""
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            cache.set(self.version_key, int(time.time()), None)
+
+    def key(self, key):
+        return f'{self.name}:{key}'
+
+    def get(self, key, default=None):
+        return cache.get(self.key(key), default, version=self.version())
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        timeout = self.timeout if timeout is DEFAULT_TIMEOUT else timeout
+        cache.set(self.key(key), value, timeout, version=self.version())
+
+    def delete(self, key):
+        cache.delete(self.key(key), version=self.version())
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT):
+        timeout = self.timeout if timeout is DEFAULT_TIMEOUT else timeout
+        return cache.get_or_set(self.key(key), default, timeout, version=self.version())
+
+    async def aget(self, key, default=None):
+        return await cache.aget(self.key(key), default, version=await self.aversion())
+
+    async def aset(self, key, value, timeout=DEFAULT_TIMEOUT):
+        timeout = self.timeout if timeout is DEFAULT_TIMEOUT else timeout
+        await cache.aset(self.key(key), value, timeout, version=await self.aversion())
+
+    async def adelete(self, key):
+        await cache.adelete(self.key(key), version=await self.aversion())
+
+    def cache_page(self, timeout):
+        """cache_page for a view whose pages belong to this namespace"""
+        def decorator(view_func):
+            cached_views = {}
+
+            @wraps(view_func)
+            def wrapper(request, *args, **kwargs):
+                key_prefix = f'{self.name}.v{self.version()}'
+                cached_view = cached_views.get(key_prefix)
+                if cached_view is None:
+                    cached_views.clear()
+                    cached_view = cached_views[key_prefix] = cache_page(timeout, key_prefix=key_prefix)(view_func)
+                return cached_view(request, *args, **kwargs)
+            return wrapper
+        return decorator
+
+
+menu = Namespace('menu')
+tables = Namespace('tables')
+customers = Namespace('customers')
+
+
+def stats():
+    """Cache counters for this process (empty if the default cache is not tiered)"""
+    backend = caches['default']
+    return backend.stats() if isinstance(backend, TieredCache) else {}
@@ -0,0 +1,83 @@
+"""
+Write serialization for SQLite.
+
+SQLite allows one writer at a time. With WAL, IMMEDIATE transactions and a
+busy timeout (see DATABASES in settings), concurrent writers wait their turn
+instead of failing with "database is locked". During peak hours they can
+still pile up on the lock, though. With SQLITE_SINGLE_WRITER enabled, write
+transactions marked with ``write_transaction`` are handed to a single
+background thread and run one after another, while reads stay on the request
+threads and run in parallel.
+
+``write_transaction`` always runs the function in one atomic block. Without
+the single writer it runs on the calling thread. Calls made inside an open
+transaction, or from the writer thread itself, also run inline, because
+handing them to the writer would deadlock on the lock the caller already holds.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+SQLITE_SINGLE_WRITER = getattr(settings, 'SQLITE_SINGLE_WRITER', False)
+
+
+class SingleWriter:
+    """Runs write transactions one at a time on a dedicated thread"""
+
+    def __init__(self):
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _ensure_executor(self):
+        # Worker processes forked after the first write need their own thread
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+            return self._executor
+
+    def in_writer(self):
+        return getattr(self._local, 'active', False)
+
+    def run(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) in a transaction on the writer thread and return its result"""
+        if self.in_writer() or connection.in_atomic_block:
+            with transaction.atomic():
+                return func(*args, **kwargs)
+        try:
+            future = self._ensure_executor().submit(self._execute, func, args, kwargs)
+        except RuntimeError:
+            # The interpreter is shutting down (e.g. the audit log's exit flush); write inline
+            with transaction.atomic():
+                return func(*args, **kwargs)
+        return future.result()
+
+    def _execute(self, func, args, kwargs):
+        self._local.active = True
+        try:
+            with transaction.atomic():
+                return func(*args, **kwargs)
+        finally:
+            self._local.active = False
+            close_old_connections()
+
+
+writer = SingleWriter()
+
+
+def write_transaction(func):
+    """Run the decorated function as one write transaction, on the single writer when it is enabled"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if SQLITE_SINGLE_WRITER:
+            return writer.run(func, *args, **kwargs)
+        with transaction.atomic():
+            return func(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,146 @@
+"""
+Streaming CSV/XLSX exports for management data.
+
+Exports read the database through ``values_list(...)`` in chunks of
+EXPORT_CHUNK_SIZE, so only one chunk of plain tuples is in memory at a time.
+CSV responses stream an async iterator, which ASGI sends as it is produced
+(a sync iterator would be buffered whole). Its chunks are fetched in the
+database thread while the body is sent, after the view and the middleware
+have returned, so the iterator reopens the database routing the view ran
+with. XLSX is built with openpyxl's write-only workbook (when openpyxl is
+installed) and streamed from a temporary file.
+"""
+
+import csv
+import datetime
+import tempfile
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.http import FileResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.utils import timezone
+
+from .routers import reading_from_reporting, routing_scope
+
+# Try to import openpyxl but make it optional
+try:
+    from openpyxl import Workbook
+    OPENPYXL_AVAILABLE = True
+except ImportError:
+    OPENPYXL_AVAILABLE = False
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """File-like object that hands back whatever csv.writer writes to it"""
+
+    def write(self, value):
+        return value
+
+
+def _clean_cell(value):
+    """Format a single value for a spreadsheet cell"""
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@'):
+        # Keep spreadsheet applications from evaluating user-entered text as a formula
+        return f"'{value}"
+    return value
+
+
+def iter_rows(queryset, fields, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield plain tuples for the given fields without caching the queryset"""
+    for row in queryset.values_list(*fields).iterator(chunk_size=chunk_size):
+        yield [_clean_cell(value) for value in row]
+
+
+def aiter_rows(queryset, fields, chunk_size=EXPORT_CHUNK_SIZE):
+    """Async iterator of plain rows for the given fields, read from the database the caller reads from"""
+    use_reporting = reading_from_reporting()
+
+    def next_chunk(rows):
+        return list(islice(rows, chunk_size))
+
+    async def generate():
+        with routing_scope(use_reporting):
+            # values_list().aiterator() runs its query in the event loop, so the
+            # chunks of the sync iterator are fetched in the database thread instead
+            rows = iter_rows(queryset, fields, chunk_size)
+            while chunk := await sync_to_async(next_chunk)(rows):
+                for row in chunk:
+                    yield row
+
+    return generate()
+
+
+def stream_csv(header, rows, filename):
+    """Stream rows (an iterable or an async iterable) as a CSV attachment; the header is sent before any query runs"""
+    writer = csv.writer(Echo())
+
+    async def generate():
+        # UTF-8 BOM so Excel detects the encoding of non-ASCII names
+        yield '\ufeff'
+        yield writer.writerow(header)
+        if hasattr(rows, '__aiter__'):
+            async for row in rows:
+                yield writer.writerow(row)
+        else:
+            for row in rows:
+                yield writer.writerow(row)
+
+    response = StreamingHttpResponse(generate(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    return response
+
+
+def stream_xlsx(header, rows, filename, sheet_title='Export'):
+    """Build an XLSX file in write-only mode and stream it back"""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=sheet_title[:31])
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    return FileResponse(
+        output,
+        as_attachment=True,
+        filename=f"{filename}.xlsx",
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
+
+
+def export_response(request, header, rows, filename, sheet_title='Export'):
+    """Pick the export format from ?format= (csv by default); XLSX needs ``rows`` to be a plain iterable"""
+    export_format = request.GET.get('format', 'csv')
+    filename = f"{filename}_{timezone.localtime().strftime('%Y%m%d_%H%M')}"
+
+    if export_format == 'xlsx':
+        if not OPENPYXL_AVAILABLE:
+            return HttpResponseBadRequest('XLSX export requires openpyxl to be installed.')
+        return stream_xlsx(header, rows, filename, sheet_title)
+    if export_format != 'csv':
+        return HttpResponseBadRequest('Unsupported export format.')
+    return stream_csv(header, rows, filename)
+
+
+def export_queryset(request, queryset, columns, filename, sheet_title='Export'):
+    """
+    Export a queryset given ``columns`` as a list of (header, field lookup) pairs.
+    Ordering is kept from the queryset; use an indexed ordering for large tables.
+    """
+    header = [title for title, _ in columns]
+    fields = [field for _, field in columns]
+    # The workbook is built before the response is returned; CSV rows are read while it is sent
+    if request.GET.get('format', 'csv') == 'csv':
+        rows = aiter_rows(queryset, fields)
+    else:
+        rows = iter_rows(queryset, fields)
+    return export_response(request, header, rows, filename, sheet_title)
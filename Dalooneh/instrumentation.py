@@ -0,0 +1,246 @@
+"""
+Per-request performance instrumentation.
+
+``InstrumentationMiddleware`` (Dalooneh/middleware.py) measures every request
+inside ``measure()``. That records:
+
+- the number of SQL queries and the time spent in them, through an execute
+  wrapper installed on every database connection;
+- cache hits and misses, from the tiered cache's request counters;
+- the total time of the request.
+
+Each request is reported in a ``Server-Timing`` header when PERF_SERVER_TIMING
+is set (by default only with DEBUG, since the header tells any client how much
+database and cache work a page takes). Cache backends hand out copies of cached
+responses (see Dalooneh/cache.py), so the header never reaches a cached page.
+Its measurements are added to per-endpoint histograms keyed by the resolved
+view name. The histograms belong to the serving process and are exposed to
+superusers at /management/performance/.
+
+Requests slower than PERF_SLOW_REQUEST_MS, and queries slower than
+PERF_SLOW_QUERY_MS, are logged to the ``Dalooneh.performance`` logger. A slow
+query is logged with its SQL and the project code that issued it. Queries made
+outside a request, such as management commands and background threads, are
+checked against the slow query threshold too.
+"""
+
+import logging
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .cache import request_counters
+
+logger = logging.getLogger('Dalooneh.performance')
+
+PERF_INSTRUMENTATION = getattr(settings, 'PERF_INSTRUMENTATION', True)
+PERF_SERVER_TIMING = getattr(settings, 'PERF_SERVER_TIMING', settings.DEBUG)
+PERF_SLOW_REQUEST_MS = getattr(settings, 'PERF_SLOW_REQUEST_MS', 500)
+PERF_SLOW_QUERY_MS = getattr(settings, 'PERF_SLOW_QUERY_MS', 100)
+
+# Upper bounds of the latency histogram buckets, in milliseconds; the last bucket is unbounded
+HISTOGRAM_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_PROJECT_DIR = str(Path(settings.BASE_DIR).resolve())
+_THIS_FILE = str(Path(__file__).resolve())
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """What one request spent its time on"""
+
+    __slots__ = ('started', 'duration_ms', 'queries', 'db_ms', 'cache')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.duration_ms = None
+        self.queries = 0
+        self.db_ms = 0.0
+        self.cache = None
+
+    @property
+    def cache_hits(self):
+        return self.cache['local_hits'] + self.cache['shared_hits']
+
+    @property
+    def cache_misses(self):
+        return self.cache['misses']
+
+    def server_timing(self):
+        """Value of the Server-Timing header"""
+        return ', '.join([
+            f'db;dur={self.db_ms:.1f};desc="{self.queries} queries"',
+            f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses"',
+            f'total;dur={self.duration_ms:.1f}',
+        ])
+
+
+@contextmanager
+def measure():
+    """Collect RequestMetrics for the enclosed request handling"""
+    metrics = RequestMetrics()
+    token = _current.set(metrics)
+    try:
+        with request_counters() as cache_values:
+            metrics.cache = cache_values
+            yield metrics
+    finally:
+        metrics.duration_ms = (time.perf_counter() - metrics.started) * 1000
+        _current.reset(token)
+
+
+def query_origin():
+    """The innermost project frame outside this module that led to the current query"""
+    for frame in reversed(traceback.extract_stack()):
+        filename = str(Path(frame.filename).resolve())
+        if filename.startswith(_PROJECT_DIR) and filename != _THIS_FILE and 'site-packages' not in filename:
+            return f'{Path(filename).relative_to(_PROJECT_DIR)}:{frame.lineno} in {frame.name}'
+    return 'unknown'
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper that times every query"""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.queries += 1
+            metrics.db_ms += elapsed_ms
+        if elapsed_ms >= PERF_SLOW_QUERY_MS:
+            logger.warning(
+                'Slow query (%.1f ms) on %s from %s: %s',
+                elapsed_ms, context['connection'].alias, query_origin(), sql,
+            )
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class Histogram:
+    """Latency histogram and totals for one endpoint"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.queries = 0
+        self.max_queries = 0
+        self.db_ms = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.slow = 0
+
+    def add(self, metrics):
+        index = next((i for i, bound in enumerate(HISTOGRAM_BUCKETS_MS) if metrics.duration_ms <= bound),
+                     len(HISTOGRAM_BUCKETS_MS))
+        self.buckets[index] += 1
+        self.count += 1
+        self.total_ms += metrics.duration_ms
+        self.max_ms = max(self.max_ms, metrics.duration_ms)
+        self.queries += metrics.queries
+        self.max_queries = max(self.max_queries, metrics.queries)
+        self.db_ms += metrics.db_ms
+        self.cache_hits += metrics.cache_hits
+        self.cache_misses += metrics.cache_misses
+        if metrics.duration_ms >= PERF_SLOW_REQUEST_MS:
+            self.slow += 1
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of requests (max_ms for the last bucket)"""
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(HISTOGRAM_BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, round(self.max_ms, 1))
+        return round(self.max_ms, 1)
+
+    def snapshot(self):
+        labels = [f'<={bound}' for bound in HISTOGRAM_BUCKETS_MS] + [f'>{HISTOGRAM_BUCKETS_MS[-1]}']
+        return {
+            'count': self.count,
+            'slow': self.slow,
+            'avg_ms': round(self.total_ms / self.count, 1),
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': round(self.max_ms, 1),
+            'avg_queries': round(self.queries / self.count, 1),
+            'max_queries': self.max_queries,
+            'avg_db_ms': round(self.db_ms / self.count, 1),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'buckets_ms': dict(zip(labels, self.buckets)),
+        }
+
+
+class EndpointHistograms:
+    """Histograms of every endpoint served by this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def add(self, endpoint, metrics):
+        with self._lock:
+            histogram = self._histograms.get(endpoint)
+            if histogram is None:
+                histogram = self._histograms[endpoint] = Histogram()
+            histogram.add(metrics)
+
+    def snapshot(self):
+        """Per-endpoint statistics, slowest average first"""
+        with self._lock:
+            stats = {endpoint: histogram.snapshot() for endpoint, histogram in self._histograms.items()}
+        return dict(sorted(stats.items(), key=lambda item: item[1]['avg_ms'], reverse=True))
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+histograms = EndpointHistograms()
+
+
+def endpoint_name(request):
+    """The resolved view name of the request ('<unresolved>' for 404s and middleware responses)"""
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else '<unresolved>'
+
+
+def report(request, response, metrics):
+    """Record a finished request: histogram, Server-Timing header and slow request log"""
+    endpoint = endpoint_name(request)
+    histograms.add(endpoint, metrics)
+
+    if PERF_SERVER_TIMING:
+        response['Server-Timing'] = metrics.server_timing()
+
+    if metrics.duration_ms >= PERF_SLOW_REQUEST_MS:
+        logger.warning(
+            'Slow request (%.1f ms) %s %s [%s] status=%s queries=%d db=%.1fms cache_hits=%d cache_misses=%d',
+            metrics.duration_ms, request.method, request.path, endpoint, response.status_code,
+            metrics.queries, metrics.db_ms, metrics.cache_hits, metrics.cache_misses,
+        )
+    return response
+
+
+if PERF_INSTRUMENTATION:
+    connection_created.connect(install_query_recorder)
+    # Connections opened before this module was imported
+    for existing in connections.all(initialized_only=True):
+        install_query_recorder(None, existing)
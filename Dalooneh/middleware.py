@@ -1,36 +1,140 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.shortcuts import redirect
 from django.contrib import messages
 from django.urls import reverse
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
 import re
 
+from . import instrumentation
+from .routers import reporting_configured, routing_scope
+
+# Client-side pin to the primary after a request that wrote (see Dalooneh/routers.py)
+REPORTING_PIN_COOKIE = 'db_primary'
+REPORTING_PIN_SECONDS = getattr(settings, 'REPORTING_PIN_SECONDS', 10)
+REPORTING_PATHS = getattr(settings, 'REPORTING_PATHS', [r'/management/', r'^/staff/'])
+
 class ManagementAccessMiddleware:
     """
     Middleware to restrict access to management URLs to superusers only.
     This is an additional security layer besides our view decorators.
     """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
         self.management_url_pattern = re.compile(r'/management/')
         self.staff_url_pattern = re.compile(r'^/staff/$')  # Only protect main staff index
-        
-    def __call__(self, request):
-        # Check if URL contains 'management' or is main staff index and user is not a superuser
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def is_protected(self, request):
+        # Check if URL contains 'management' or is main staff index
         is_management_url = self.management_url_pattern.search(request.path)
         is_staff_index = self.staff_url_pattern.match(request.path)
+        # Skip login page itself to avoid redirect loops
+        return bool(is_management_url or is_staff_index) and request.path != '/management/login/'
+
+    def deny(self, request, user):
+        """Redirect for a user who may not see a protected page, or None"""
+        if not user.is_authenticated:
+            messages.error(request, "You must be logged in to access this section.")
+            return redirect(f'/management/login/?next={request.path}')
+
+        if not user.is_superuser:
+            messages.error(request, "Only administrators can access this section.")
+            return redirect('home')
+        return None
         
-        if is_management_url or is_staff_index:
-            # Skip login page itself to avoid redirect loops
-            if request.path == '/management/login/':
-                response = self.get_response(request)
-                return response
-                
-            if not request.user.is_authenticated:
-                messages.error(request, "You must be logged in to access this section.")
-                return redirect(f'/management/login/?next={request.path}')
-            
-            if not request.user.is_superuser:
-                messages.error(request, "Only administrators can access this section.")
-                return redirect('home')
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        if self.is_protected(request):
+            denied = self.deny(request, request.user)
+            if denied is not None:
+                return denied
         
         response = self.get_response(request)
-        return response 
\ No newline at end of file
+        return response
+
+    async def __acall__(self, request):
+        if self.is_protected(request):
+            denied = self.deny(request, await request.auser())
+            if denied is not None:
+                return denied
+        return await self.get_response(request)
+
+
+class ReportingDatabaseMiddleware:
+    """
+    Serve GET requests to the management pages from the reporting replica.
+    A request that writes pins its client to the primary for a few seconds,
+    so it reads its own writes on the next page.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.reporting_paths = [re.compile(pattern) for pattern in REPORTING_PATHS]
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def use_reporting(self, request):
+        return (
+            reporting_configured()
+            and request.method in ('GET', 'HEAD')
+            and REPORTING_PIN_COOKIE not in request.COOKIES
+            and any(pattern.search(request.path) for pattern in self.reporting_paths)
+        )
+
+    def pin_primary(self, state, response):
+        if state.wrote and reporting_configured():
+            response.set_cookie(REPORTING_PIN_COOKIE, '1', max_age=REPORTING_PIN_SECONDS, httponly=True, samesite='Lax')
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        with routing_scope(self.use_reporting(request)) as state:
+            response = self.get_response(request)
+        return self.pin_primary(state, response)
+
+    async def __acall__(self, request):
+        # sync_to_async copies the context, so writes made in worker threads still mark this scope
+        with routing_scope(self.use_reporting(request)) as state:
+            response = await self.get_response(request)
+        return self.pin_primary(state, response)
+
+
+class InstrumentationMiddleware:
+    """
+    Measure every request: query count, DB time, cache hits and misses and
+    total time, reported in a Server-Timing header, the per-endpoint
+    histograms and the slow request log (see Dalooneh/instrumentation.py).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not instrumentation.PERF_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        with instrumentation.measure() as metrics:
+            response = self.get_response(request)
+        return instrumentation.report(request, response, metrics)
+
+    async def __acall__(self, request):
+        with instrumentation.measure() as metrics:
+            response = await self.get_response(request)
+        return instrumentation.report(request, response, metrics)
@@ -0,0 +1,170 @@
+"""
+Keyset (seek) pagination for management list views.
+
+Offset pagination gets slower with every page because the database still has
+to walk all the skipped rows. Keyset pagination remembers the last
+``(created_at, id)`` pair that was shown and asks for rows strictly after it,
+which is a bounded range read on the matching composite index no matter how
+much history the table holds.
+"""
+
+import base64
+import binascii
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+DEFAULT_PER_PAGE = getattr(settings, 'MANAGEMENT_LIST_PAGE_SIZE', 50)
+DEFAULT_COUNT_CAP = getattr(settings, 'MANAGEMENT_LIST_COUNT_CAP', 1000)
+
+
+def encode_cursor(created_at, pk, direction='next'):
+    """Encode a seek position into an opaque, URL-safe cursor string"""
+    raw = f"{direction}|{created_at.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by encode_cursor.
+    Returns (direction, created_at, pk) or None if the cursor is missing or malformed.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, created_at, pk = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        created_at = parse_datetime(created_at)
+        pk = int(pk)
+    except (ValueError, TypeError, binascii.Error, UnicodeDecodeError):
+        return None
+    if created_at is None or direction not in ('next', 'prev'):
+        return None
+    return direction, created_at, pk
+
+
+def estimate_count(queryset, cap=DEFAULT_COUNT_CAP):
+    """
+    Cheap row count for list headers.
+
+    Unfiltered PostgreSQL tables use the planner statistics in pg_class.
+    Everything else counts at most ``cap + 1`` rows so the query stays bounded;
+    callers can show "cap+" when the result is larger than ``cap``.
+    Returns (count, is_exact).
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql' and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        if row and row[0] > 0:
+            return row[0], False
+
+    count = queryset.order_by()[:cap + 1].count()
+    if count > cap:
+        return cap, False
+    return count, True
+
+
+class KeysetPage:
+    """A single page of results produced by KeysetPaginator"""
+
+    def __init__(self, object_list, next_cursor, previous_cursor, per_page, count=None, count_is_exact=True):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.per_page = per_page
+        self.count = count
+        self.count_is_exact = count_is_exact
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset newest-first on ``(created_at, id)``.
+
+    The queryset may be filtered and use select_related freely, but its ordering
+    is replaced: keyset pagination only works on the index columns.
+    """
+
+    def __init__(self, queryset, per_page=DEFAULT_PER_PAGE, count=False, count_cap=DEFAULT_COUNT_CAP):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.count = count
+        self.count_cap = count_cap
+
+    def get_page(self, cursor=None):
+        """Return the page that starts after (or ends before) the given cursor"""
+        position = decode_cursor(cursor)
+        queryset = self.queryset
+
+        if position is None:
+            direction = 'next'
+            rows = list(queryset.order_by('-created_at', '-id')[:self.per_page + 1])
+        else:
+            direction, created_at, pk = position
+            if direction == 'next':
+                rows = list(
+                    queryset.filter(
+                        Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+                    ).order_by('-created_at', '-id')[:self.per_page + 1]
+                )
+            else:
+                rows = list(
+                    queryset.filter(
+                        Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+                    ).order_by('created_at', 'id')[:self.per_page + 1]
+                )
+
+        # The extra row tells us whether there is another page in the direction we walked
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if direction == 'prev':
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            first, last = rows[0], rows[-1]
+            if direction == 'next':
+                if has_more:
+                    next_cursor = encode_cursor(last.created_at, last.pk, 'next')
+                if position is not None:
+                    previous_cursor = encode_cursor(first.created_at, first.pk, 'prev')
+            else:
+                next_cursor = encode_cursor(last.created_at, last.pk, 'next')
+                if has_more:
+                    previous_cursor = encode_cursor(first.created_at, first.pk, 'prev')
+
+        count, count_is_exact = (None, True)
+        if self.count:
+            count, count_is_exact = estimate_count(queryset, self.count_cap)
+
+        return KeysetPage(rows, next_cursor, previous_cursor, self.per_page, count, count_is_exact)
+
+
+def paginate_keyset(request, queryset, per_page=DEFAULT_PER_PAGE, count=True):
+    """Shortcut used by the management list views: paginate using ?cursor= from the request"""
+    paginator = KeysetPaginator(queryset, per_page=per_page, count=count)
+    return paginator.get_page(request.GET.get('cursor'))
@@ -0,0 +1,406 @@
+"""
+Query-count budgets for every named URL.
+
+``measure_endpoints`` seeds a representative dataset and requests every named
+URL of the project's apps (the admin excepted) with the method and payload
+its page sends, as listed by ``Dataset.requests`` (a GET otherwise).
+Management pages are requested as a superuser, staff pages as a staff member
+logged in as their StaffUser, and customer pages as a diner, who is logged in
+as a customer, seated at a table with an open session and has a pending
+order. Every request is measured twice: once with SMALL_ROWS rows of each
+kind and once after the dataset has grown to LARGE_ROWS. A view whose
+query count differs between the two sizes runs queries per row.
+
+Each request starts from the same state. The cache and the per-process memos
+built on it are cleared first, so views are measured cold. Streamed bodies
+are read inside the measurement. Database changes are rolled back
+afterwards, and the client's cookies are restored.
+
+Each measurement also lists the fingerprints of queries that ran more than
+once in one request, which is usually where an N+1 is. The query counts at
+both sizes are kept as the baseline in query_budgets.json next to this
+module. ``check`` compares fresh measurements with that baseline and reports
+a view that:
+
+- answers with another status than the one in EXPECTED_STATUSES (200 if not
+  listed);
+- runs the same query more than once in one request;
+- runs more queries than its budget;
+- grows with the row count more than it did before;
+- has no budget yet.
+
+Unexpected statuses and repeated queries are never accepted into the baseline.
+Dalooneh/tests.py runs the check. When a view legitimately changes, run
+
+    UPDATE_QUERY_BUDGETS=1 python manage.py test Dalooneh
+
+and commit the updated baseline with the change.
+"""
+
+import contextlib
+import hashlib
+import json
+import logging
+import re
+from collections import Counter
+from decimal import Decimal
+from pathlib import Path
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.test import Client
+from django.test.client import MULTIPART_CONTENT
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+from django.utils import timezone
+
+BASELINE_PATH = Path(__file__).with_name('query_budgets.json')
+
+SMALL_ROWS = 2
+LARGE_ROWS = 6
+
+# URL namespaces that are not ours
+SKIPPED_NAMESPACES = {'admin'}
+
+# Requested as a superuser, the rest of the staff pages as a staff member, everything else as a diner
+MANAGER_PATHS = re.compile(
+    r'/management/|^/staff/$|^/notifications/|^/orders/kitchen/|^/tables/(generate-qr|status|complete-order)/'
+)
+STAFF_PATHS = re.compile(r'^/staff/')
+
+# Views that answer with something other than 200 when used as intended
+EXPECTED_STATUSES = {
+    # Already logged in, or logging out
+    'logout': 302,
+    'management_login': 302,
+    'management_logout': 302,
+    'management_dashboard': 302,
+    'tables:table_access': 302,
+    'test_phone_modal': 302,
+    # Actions that redirect back to the page they were started from
+    'menu:toggle_product_availability': 302,
+    'menu:toggle_product_status': 302,
+    'orders:management_order_update_status': 302,
+    'tables:management_free_all_tables': 302,
+    'tables:management_generate_all_qr': 302,
+    'tables:management_generate_qr': 302,
+    'tables:management_session_deactivate': 302,
+    'tables:management_table_delete': 302,
+    'tables:management_table_free': 302,
+    'tables:management_table_toggle_status': 302,
+    # Need a superuser who is also a staff member; staff members are not superusers
+    'staff:category_management': 302,
+    'staff:product_management': 302,
+}
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\(\?(?:, \?)*\)')
+
+
+def fingerprint(sql):
+    """The SQL with literals and IN lists blanked out, so repeats of one query compare equal"""
+    sql = _LITERALS.sub('?', sql)
+    sql = _IN_LISTS.sub('(...)', sql)
+    return ' '.join(sql.split())
+
+
+def named_urls(patterns=None, namespace=None):
+    """(name, pattern) for every named URL of the project's apps"""
+    for pattern in get_resolver().url_patterns if patterns is None else patterns:
+        if isinstance(pattern, URLResolver):
+            if pattern.namespace in SKIPPED_NAMESPACES:
+                continue
+            child_namespace = pattern.namespace or namespace
+            if namespace and pattern.namespace:
+                child_namespace = f'{namespace}:{pattern.namespace}'
+            yield from named_urls(pattern.url_patterns, child_namespace)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            yield (f'{namespace}:{pattern.name}' if namespace else pattern.name), pattern
+
+
+class Dataset:
+    """Rows of every kind, grown in place; the first row of each kind also gains children as it grows"""
+
+    def __init__(self):
+        self.rows = 0
+        self.superuser = User.objects.create_superuser('budget-admin', 'budget-admin@example.com', 'budget')
+
+    def grow(self, rows):
+        from customers.models import Customer, CustomerRating, Discount, PointsTransaction
+        from menu.models import Category, Product
+        from notifications.models import Notification
+        from orders.models import Order, OrderEvent, OrderItem, Payment
+        from staff.models import Report, StaffLog, StaffUser
+        from tables.models import Table, TableSession
+
+        now = timezone.now()
+        statuses = ['confirmed', 'preparing', 'ready', 'delivered', 'cancelled']
+        for i in range(self.rows, rows):
+            category = Category.objects.create(name=f'Category {i}')
+            if i == 0:
+                self.category = category
+            product = Product.objects.create(
+                category=self.category, name=f'Product {i}', description='Seeded', price=Decimal(10 + i),
+            )
+            if i == 0:
+                self.product = product
+
+            table = Table.objects.create(number=100 + i)
+            if i == 0:
+                self.table = table
+                self.table_session = TableSession.objects.create(table=table)
+            else:
+                TableSession.objects.create(table=self.table, is_active=False)
+                TableSession.objects.create(table=table)
+
+            user = User.objects.create_user(f'diner{i}', password='budget')
+            customer = Customer.objects.create(user=user, phone_number=f'0912{i:07d}')
+            if i == 0:
+                self.customer = customer
+
+            # Orders, items, payments and ratings all accumulate on the first customer, table and order
+            order = Order.objects.create(
+                customer=self.customer, table=self.table, status='pending' if i == 0 else statuses[i % len(statuses)],
+                total_amount=Decimal(20), final_amount=Decimal(20),
+            )
+            if i == 0:
+                self.order = order
+            item = OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+            if i == 0:
+                self.item = item
+            else:
+                OrderItem.objects.create(order=self.order, product=product, quantity=2, price=product.price)
+            payment = Payment.objects.create(order=order, amount=Decimal(20), payment_method='cash', status='completed')
+            Payment.objects.create(order=self.order, amount=Decimal(1), payment_method='card', status='completed')
+            if i == 0:
+                self.payment = payment
+            CustomerRating.objects.create(customer=self.customer, order=order, rating=4)
+            OrderEvent.objects.create(order=self.order, action='status_change', old_status='pending', new_status='pending')
+            PointsTransaction.objects.create(
+                customer=self.customer, points=10, reason='earned', idempotency_key=f'budget-{i}',
+            )
+            discount = Discount.objects.create(
+                customer=self.customer, code=f'BUDGET{i}', percentage=10,
+                valid_from=now - timezone.timedelta(days=1), valid_to=now + timezone.timedelta(days=30),
+            )
+            if i == 0:
+                self.discount = discount
+
+            staff = StaffUser.objects.create(username=f'staff{i}', role='waiter', phone_number='0', national_code=f'{i:010d}')
+            if i == 0:
+                self.staff = staff
+            StaffLog.objects.create(staff=self.staff, action='login', details='Seeded')
+            report = Report.objects.create(
+                type='daily', start_date=now.date(), end_date=now.date(), status='completed', created_by=self.staff,
+            )
+            if i == 0:
+                self.report = report
+            notification = Notification.objects.create(
+                recipient=self.superuser, notification_type='new_order', title='Seeded', message='Seeded',
+            )
+            if i == 0:
+                self.notification = notification
+        self.rows = rows
+
+    def url_kwargs(self):
+        """Values for the URL parameters used by the project's URLs"""
+        return {
+            'table_number': self.table.number,
+            'table_id': self.table.id,
+            'token': str(self.table_session.token),
+            'session_id': self.table_session.id,
+            'order_id': self.order.id,
+            'item_id': self.item.id,
+            'payment_id': self.payment.id,
+            'product_id': self.product.id,
+            'category_id': self.category.id,
+            'slug': self.category.slug,
+            'station': self.category.slug,
+            'customer_id': self.customer.id,
+            'discount_id': self.discount.id,
+            'report_id': self.report.id,
+            'notification_id': self.notification.id,
+        }
+
+    def requests(self):
+        """(method, data, content type) of the views that are not requested with a plain GET"""
+        form = MULTIPART_CONTENT
+        return {
+            'notifications:trigger_new_order': ('post', {
+                'order_id': self.order.id, 'table_number': self.table.number, 'customer_name': 'Seeded',
+                'total_price': 20, 'items_count': 1,
+            }, 'application/json'),
+            'orders:add_to_cart': ('post', {'product_id': self.product.id, 'quantity': 1}, form),
+            'orders:update_cart': ('post', {'quantity': 2}, form),
+            'orders:remove_from_cart': ('post', {}, form),
+            'orders:management_order_update_status': ('post', {'status': 'confirmed'}, form),
+            'tables:add_to_cart': ('post', {'product_id': self.product.id, 'quantity': 1}, form),
+            'tables:update_cart_item': ('post', {'quantity': 2}, form),
+            'tables:remove_cart_item': ('post', {}, form),
+            'tables:submit_order': ('post', {'order_id': self.order.id}, 'application/json'),
+        }
+
+
+def _clients(dataset):
+    manager = Client(raise_request_exception=False)
+    manager.force_login(dataset.superuser)
+
+    staff = Client(raise_request_exception=False)
+    staff.force_login(dataset.staff, backend='staff.backends.StaffBackend')
+
+    diner = Client(raise_request_exception=False)
+    diner.force_login(dataset.customer.user)
+    session = diner.session
+    session['table_token'] = str(dataset.table_session.token)
+    session['table_number'] = dataset.table.number
+    session['table_id'] = dataset.table.id
+    session['customer_id'] = dataset.customer.id
+    session.save()
+    return {'manager': manager, 'staff': staff, 'diner': diner}
+
+
+def _clear_caches():
+    from django.contrib.contenttypes.models import ContentType
+
+    from customers.discounts import rule_cache
+
+    for alias in ('default', 'shared'):
+        caches[alias].clear()
+    # A memo kept across cache clears would make a view's query count depend on the requests before it
+    rule_cache.clear()
+    ContentType.objects.clear_cache()
+
+
+async def _read_async(response):
+    async for _ in response.streaming_content:
+        pass
+
+
+def _measure(client, path, method='get', data=None, content_type=MULTIPART_CONTENT):
+    """Query count, status and duplicated query fingerprints of one request, leaving no trace behind"""
+    _clear_caches()
+    cookies = client.cookies
+    client.cookies = cookies.__class__(cookies)
+
+    with transaction.atomic():
+        with CaptureQueriesContext(connection) as captured:
+            if method == 'get':
+                response = client.get(path, data)
+            else:
+                response = getattr(client, method)(path, data, content_type=content_type)
+            if response.streaming:
+                # Exports run their queries while the body is read
+                if response.is_async:
+                    async_to_sync(_read_async)(response)
+                else:
+                    b''.join(response.streaming_content)
+        transaction.set_rollback(True)
+
+    client.cookies = cookies
+    repeated = Counter(fingerprint(query['sql']) for query in captured.captured_queries)
+    duplicates = {
+        f'{hashlib.sha1(sql.encode()).hexdigest()[:8]} {sql[:100]}': count
+        for sql, count in repeated.items() if count > 1
+    }
+    return len(captured), response.status_code, duplicates
+
+
+def _measure_all(dataset, clients):
+    kwargs = dataset.url_kwargs()
+    requests = dataset.requests()
+    results = {}
+    for name, pattern in named_urls():
+        try:
+            path = reverse(name, kwargs={key: kwargs[key] for key in pattern.pattern.converters})
+        except KeyError as e:
+            raise LookupError(f'No value for the {e} parameter of {name}; add one to Dataset.url_kwargs') from None
+        if MANAGER_PATHS.search(path):
+            role = 'manager'
+        elif STAFF_PATHS.search(path):
+            role = 'staff'
+        else:
+            role = 'diner'
+        results[name] = _measure(clients[role], path, *requests.get(name, ()))
+    return results
+
+
+def measure_endpoints():
+    """Measure every named URL at SMALL_ROWS and LARGE_ROWS rows (must run inside a test)"""
+    from staff import audit
+
+    dataset = Dataset()
+    request_logger = logging.getLogger('django.request')
+    level = request_logger.level
+    request_logger.setLevel(logging.CRITICAL)
+    try:
+        # Audit entries are written inline so they are counted and rolled back with the request
+        with _patched(audit, 'AUDIT_LOG_ASYNC', False):
+            dataset.grow(SMALL_ROWS)
+            clients = _clients(dataset)
+            small = _measure_all(dataset, clients)
+            dataset.grow(LARGE_ROWS)
+            large = _measure_all(dataset, clients)
+    finally:
+        request_logger.setLevel(level)
+
+    return {
+        name: {
+            'status': large[name][1],
+            'queries': {'small': small[name][0], 'large': large[name][0]},
+            'duplicates': large[name][2],
+        }
+        for name in sorted(small)
+    }
+
+
+@contextlib.contextmanager
+def _patched(module, name, value):
+    old = getattr(module, name)
+    setattr(module, name, value)
+    try:
+        yield
+    finally:
+        setattr(module, name, old)
+
+
+def load_baseline(path=BASELINE_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(measurements, path=BASELINE_PATH):
+    baseline = {name: {'queries': measured['queries']} for name, measured in measurements.items()}
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def check(measurements, baseline):
+    """Budget violations of ``measurements`` against ``baseline``, as readable messages"""
+    failures = []
+    for name, measured in measurements.items():
+        expected = EXPECTED_STATUSES.get(name, 200)
+        if measured['status'] != expected:
+            failures.append(f'{name}: status {measured["status"]}, expected {expected}')
+        failures.extend(f'{name}: repeated {count}x: {sql}' for sql, count in measured['duplicates'].items())
+
+        budget = baseline.get(name)
+        if budget is None:
+            failures.append(f'{name}: no query budget yet')
+            continue
+
+        small, large = measured['queries']['small'], measured['queries']['large']
+        budget_small, budget_large = budget['queries']['small'], budget['queries']['large']
+        if large > budget_large:
+            failures.append(f'{name}: {large} queries, budget {budget_large}')
+        if large - small > budget_large - budget_small:
+            failures.append(
+                f'{name}: grows with row count ({small} queries at {SMALL_ROWS} rows, {large} at {LARGE_ROWS}; '
+                f'budget {budget_small} and {budget_large})'
+            )
+    return failures
@@ -0,0 +1,84 @@
+"""
+Read/write routing between the primary database and a reporting replica.
+
+When DATABASES has a ``reporting`` alias, reads made inside ``reporting_reads()``
+go to it; everything else, and every write, stays on ``default``. The
+ReportingDatabaseMiddleware (Dalooneh/middleware.py) opens such a scope for
+GET requests to the management pages, and report generation opens one around
+its aggregates.
+
+Reads always see the request's own writes. Once a write is routed inside a
+scope, the rest of that scope reads from ``default``. The middleware also
+pins the same client to ``default`` for REPORTING_PIN_SECONDS after any
+request that wrote, so the page a form redirects to does not read a replica
+that has not caught up yet.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+REPORTING_ALIAS = 'reporting'
+
+_routing = ContextVar('db_routing', default=None)
+
+
+class RoutingState:
+    """Routing decisions for one request or reporting scope"""
+
+    __slots__ = ('use_reporting', 'wrote')
+
+    def __init__(self, use_reporting=False):
+        self.use_reporting = use_reporting
+        self.wrote = False
+
+
+def reporting_configured():
+    return REPORTING_ALIAS in settings.DATABASES
+
+
+@contextmanager
+def routing_scope(use_reporting):
+    """Track writes (and optionally send reads to the replica) for the enclosed code"""
+    state = RoutingState(use_reporting=use_reporting)
+    token = _routing.set(state)
+    try:
+        yield state
+    finally:
+        _routing.reset(token)
+
+
+def reporting_reads():
+    """Send the enclosed reads to the reporting replica, if there is one"""
+    return routing_scope(use_reporting=True)
+
+
+def reading_from_reporting():
+    """Whether reads made here would go to the reporting scope's replica (see ReportingRouter.db_for_read)"""
+    state = _routing.get()
+    return state is not None and state.use_reporting and not state.wrote
+
+
+class ReportingRouter:
+    """Routes reads to the reporting alias inside reporting scopes, and everything else to default"""
+
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        if state is not None and state.use_reporting and not state.wrote and reporting_configured():
+            return REPORTING_ALIAS
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None:
+            # Read-your-writes: the rest of this scope reads from the primary
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPORTING_ALIAS
@@ -0,0 +1,53 @@
+"""
+Session engines for the QR-ordering flow.
+
+Customer requests carry a small session (table token, table and customer ids,
+one-shot flags such as show_phone_modal) that views often re-assign to the
+values they already hold, which marks the session modified and makes Django
+write it back on every request. The engines here remember what the session
+looked like when it was loaded and skip the write when it is unchanged.
+
+- ``Dalooneh.sessions.cached_db``: sessions are read from the cache and written
+  through to the database, so a cache hit costs no query.
+- ``Dalooneh.sessions.signed_cookies``: sessions live in a signed cookie and
+  need no server-side storage at all.
+
+Select one with the SESSION_ENGINE setting.
+"""
+
+
+class SkipUnchangedMixin:
+    """Session store mixin that does not write back a session whose data is unchanged"""
+
+    _loaded_state = None
+
+    def _state(self, session_data):
+        return self.serializer().dumps(session_data)
+
+    def load(self):
+        session_data = super().load()
+        self._loaded_state = self._state(session_data)
+        return session_data
+
+    async def aload(self):
+        session_data = await super().aload()
+        self._loaded_state = self._state(session_data)
+        return session_data
+
+    def is_unchanged(self):
+        return self._loaded_state is not None and self._state(self._get_session()) == self._loaded_state
+
+    async def ais_unchanged(self):
+        return self._loaded_state is not None and self._state(await self._aget_session()) == self._loaded_state
+
+    def save(self, must_create=False):
+        if not must_create and self.session_key is not None and self.is_unchanged():
+            return
+        super().save(must_create=must_create)
+        self._loaded_state = self._state(self._get_session())
+
+    async def asave(self, must_create=False):
+        if not must_create and self.session_key is not None and await self.ais_unchanged():
+            return
+        await super().asave(must_create=must_create)
+        self._loaded_state = self._state(await self._aget_session())
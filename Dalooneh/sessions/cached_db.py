@@ -0,0 +1,7 @@
+from django.contrib.sessions.backends import cached_db
+
+from . import SkipUnchangedMixin
+
+
+class SessionStore(SkipUnchangedMixin, cached_db.SessionStore):
+    """Cache-first, database-backed sessions that are only written when they change"""
@@ -0,0 +1,32 @@
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def cursor_url(context, cursor):
+    """Build a query string for the given cursor, keeping the current filters"""
+    request = context['request']
+    params = request.GET.copy()
+    params.pop('cursor', None)
+    if cursor:
+        params['cursor'] = cursor
+    return f"?{params.urlencode()}"
+
+
+@register.simple_tag(takes_context=True)
+def export_query(context, export_format='csv'):
+    """Query string for an export link: the current filters without the cursor"""
+    params = context['request'].GET.copy()
+    params.pop('cursor', None)
+    params['format'] = export_format
+    return f"?{params.urlencode()}"
+
+
+@register.inclusion_tag('includes/keyset_pagination.html', takes_context=True)
+def keyset_pagination(context, page_obj):
+    """Render previous/next links and the (possibly estimated) row count for a KeysetPage"""
+    return {
+        'request': context['request'],
+        'page_obj': page_obj,
+    }
@@ -0,0 +1,291 @@
+import datetime
+import os
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.utils import timezone
+
+from tables.models import Table
+
+from . import cache as tiered_cache, exports, instrumentation, query_budgets
+from .middleware import REPORTING_PIN_COOKIE, InstrumentationMiddleware, ReportingDatabaseMiddleware
+from .pagination import KeysetPaginator, decode_cursor, encode_cursor
+from .routers import ReportingRouter, reporting_reads
+from .sessions import cached_db, signed_cookies
+
+
+class KeysetPaginatorTests(TestCase):
+    """Cursors round-trip and pages neither skip nor repeat rows that share a created_at"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tables = [Table.objects.create(number=number) for number in range(1, 8)]
+        # Pairs of rows with identical timestamps, so the id is what orders them
+        base = timezone.now().replace(microsecond=0)
+        for index, table in enumerate(cls.tables):
+            Table.objects.filter(pk=table.pk).update(created_at=base - datetime.timedelta(minutes=index // 2))
+
+    def paginator(self):
+        return KeysetPaginator(Table.objects.all(), per_page=3)
+
+    def test_cursor_round_trip(self):
+        created_at = timezone.now()
+        self.assertEqual(decode_cursor(encode_cursor(created_at, 42)), ('next', created_at, 42))
+        self.assertEqual(decode_cursor(encode_cursor(created_at, 42, 'prev')), ('prev', created_at, 42))
+
+    def test_malformed_cursor_starts_from_the_first_page(self):
+        for cursor in (None, '', 'not-a-cursor', encode_cursor(timezone.now(), 1, 'sideways')):
+            self.assertIsNone(decode_cursor(cursor))
+        first_page = self.paginator().get_page('not-a-cursor')
+        self.assertFalse(first_page.has_previous())
+        self.assertEqual(len(first_page), 3)
+
+    def test_forward_pages_cover_every_row_once_across_ties(self):
+        paginator = self.paginator()
+        seen = []
+        page = paginator.get_page()
+        pages = [page]
+        seen.extend(table.pk for table in page)
+        while page.has_next():
+            page = paginator.get_page(page.next_cursor)
+            pages.append(page)
+            seen.extend(table.pk for table in page)
+
+        expected = list(Table.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertFalse(pages[0].has_previous())
+
+    def test_previous_cursor_returns_the_page_before(self):
+        paginator = self.paginator()
+        first = paginator.get_page()
+        second = paginator.get_page(first.next_cursor)
+        back = paginator.get_page(second.previous_cursor)
+        self.assertEqual([table.pk for table in back], [table.pk for table in first])
+        self.assertFalse(back.has_previous())
+        self.assertEqual(back.next_cursor, first.next_cursor)
+
+
+class TieredCacheTests(TestCase):
+    """Callers get copies of cached values, never the cached object itself"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_mutating_a_value_after_set_leaves_the_cached_copy_unchanged(self):
+        value = {'items': [1, 2]}
+        cache.set('key', value)
+        value['items'].append(3)
+
+        cached = cache.get('key')
+        self.assertEqual(cached, {'items': [1, 2]})
+        self.assertGreater(cache.stats()['local_hits'], 0)
+        cached['items'].append(4)
+        self.assertEqual(cache.get('key'), {'items': [1, 2]})
+
+    def test_cached_page_does_not_keep_cookies_set_after_caching(self):
+        namespace = tiered_cache.Namespace('tests')
+
+        @namespace.cache_page(60)
+        def view(request):
+            return HttpResponse('menu')
+
+        factory = RequestFactory()
+        response = view(factory.get('/menu/'))
+        response.set_cookie('sessionid', 'first-diner')
+        response['Server-Timing'] = 'db;dur=1'
+
+        cached = view(factory.get('/menu/'))
+        self.assertEqual(cached.content, b'menu')
+        self.assertNotIn('sessionid', cached.cookies)
+        self.assertFalse(cached.has_header('Server-Timing'))
+
+
+class ServerTimingTests(TestCase):
+    """Server-Timing is opt-in and is never stored with a cached page"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        namespace = tiered_cache.Namespace('tests')
+        self.view = namespace.cache_page(60)(lambda request: HttpResponse('menu'))
+        self.middleware = InstrumentationMiddleware(self.view)
+
+    def test_header_is_off_unless_enabled(self):
+        with mock.patch.object(instrumentation, 'PERF_SERVER_TIMING', False):
+            response = self.middleware(RequestFactory().get('/menu/'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_header_is_added_to_a_copy_of_the_cached_page(self):
+        with mock.patch.object(instrumentation, 'PERF_SERVER_TIMING', True):
+            for _ in range(2):
+                response = self.middleware(RequestFactory().get('/menu/'))
+                self.assertIn('db;dur=', response['Server-Timing'])
+
+        cached = self.view(RequestFactory().get('/menu/'))
+        self.assertFalse(cached.has_header('Server-Timing'))
+
+
+class SessionStoreTests(TestCase):
+    """Sessions are written back only when their data changed"""
+
+    def create_session(self):
+        session = cached_db.SessionStore()
+        session.update({'table_token': 'abc', 'table_id': 1})
+        session.save()
+        return session.session_key
+
+    def test_unchanged_session_is_not_written(self):
+        session = cached_db.SessionStore(self.create_session())
+        with self.assertNumQueries(0):
+            session['table_token'] = session['table_token']
+            session['table_id'] = 1
+            self.assertTrue(session.modified)
+            session.save()
+
+    def test_changed_session_is_written(self):
+        key = self.create_session()
+        session = cached_db.SessionStore(key)
+        session['table_id'] = 2
+        session.save()
+        self.assertEqual(Session.objects.get(pk=key).get_decoded()['table_id'], 2)
+        self.assertEqual(cached_db.SessionStore(key).load()['table_id'], 2)
+
+    async def test_unchanged_session_is_not_written_async(self):
+        key = await sync_to_async(self.create_session)()
+        session = cached_db.SessionStore(key)
+        await session.aset('table_token', 'abc')
+        with mock.patch('django.contrib.sessions.backends.cached_db.SessionStore.asave') as asave:
+            await session.asave()
+        asave.assert_not_called()
+
+    def test_unchanged_signed_cookie_is_not_re_signed(self):
+        session = signed_cookies.SessionStore()
+        session['table_token'] = 'abc'
+        session.save()
+        key = session.session_key
+
+        session = signed_cookies.SessionStore(key)
+        session['table_token'] = 'abc'
+        with mock.patch('django.contrib.sessions.backends.signed_cookies.SessionStore.save') as save:
+            session.save()
+        save.assert_not_called()
+        self.assertEqual(session.session_key, key)
+
+
+class ReportingRouterTests(SimpleTestCase):
+    """Reads go to the replica only until the request or scope writes"""
+
+    router = ReportingRouter()
+
+    def setUp(self):
+        patcher = mock.patch.dict(settings.DATABASES, {'reporting': settings.DATABASES['default']})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_stay_on_the_primary_outside_a_reporting_scope(self):
+        self.assertEqual(self.router.db_for_read(Table), 'default')
+
+    def test_scope_reads_its_own_writes(self):
+        with reporting_reads():
+            self.assertEqual(self.router.db_for_read(Table), 'reporting')
+            self.assertEqual(self.router.db_for_write(Table), 'default')
+            self.assertEqual(self.router.db_for_read(Table), 'default')
+        with reporting_reads():
+            self.assertEqual(self.router.db_for_read(Table), 'reporting')
+
+    def request(self, method='get', path='/management/orders/', cookies=None, write=False):
+        reads = []
+
+        def view(request):
+            reads.append(self.router.db_for_read(Table))
+            if write:
+                self.router.db_for_write(Table)
+                reads.append(self.router.db_for_read(Table))
+            return HttpResponse()
+
+        request = getattr(RequestFactory(), method)(path)
+        request.COOKIES.update(cookies or {})
+        return ReportingDatabaseMiddleware(view)(request), reads
+
+    def test_management_get_reads_from_the_replica(self):
+        response, reads = self.request()
+        self.assertEqual(reads, ['reporting'])
+        self.assertNotIn(REPORTING_PIN_COOKIE, response.cookies)
+
+    def test_writing_request_pins_the_client_to_the_primary(self):
+        response, reads = self.request(method='post', write=True)
+        self.assertEqual(reads, ['default', 'default'])
+        self.assertEqual(response.cookies[REPORTING_PIN_COOKIE]['max-age'], settings.REPORTING_PIN_SECONDS)
+
+        # The page the form redirects to reads from the primary while the pin lasts
+        _, reads = self.request(cookies={REPORTING_PIN_COOKIE: '1'})
+        self.assertEqual(reads, ['default'])
+
+    def test_get_that_writes_switches_to_the_primary_and_pins(self):
+        response, reads = self.request(write=True)
+        self.assertEqual(reads, ['reporting', 'default'])
+        self.assertIn(REPORTING_PIN_COOKIE, response.cookies)
+
+    def test_customer_pages_never_read_from_the_replica(self):
+        _, reads = self.request(path='/menu/')
+        self.assertEqual(reads, ['default'])
+
+    def test_streamed_export_reads_where_its_view_would(self):
+        router = self.router
+
+        class Rows:
+            """Stands in for a queryset; reports where its rows would be read from"""
+
+            def values_list(self, *fields):
+                return self
+
+            def iterator(self, chunk_size):
+                yield (router.db_for_read(Table),)
+
+        def view(request):
+            return exports.stream_csv(['Database'], exports.aiter_rows(Rows(), ['database']), 'export')
+
+        async def body(response):
+            return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        for cookies, database in (({}, 'reporting'), ({REPORTING_PIN_COOKIE: '1'}, 'default')):
+            request = RequestFactory().get('/management/orders/export/')
+            request.COOKIES.update(cookies)
+            # The body is only read once the middleware has returned, as ASGI does
+            response = ReportingDatabaseMiddleware(view)(request)
+            self.assertTrue(response.is_async)
+            self.assertEqual(async_to_sync(body)(response).splitlines()[-1], database)
+
+
+class QueryBudgetTests(TestCase):
+    """Every named URL stays within its query budget (see Dalooneh/query_budgets.py)"""
+
+    def test_query_budgets(self):
+        measurements = query_budgets.measure_endpoints()
+        if os.environ.get('UPDATE_QUERY_BUDGETS'):
+            # Unexpected statuses and repeated queries fail against any baseline, including this one
+            failures = query_budgets.check(measurements, measurements)
+            self.assertFalse(failures, 'Not written to the query budgets:\n' + '\n'.join(failures))
+            query_budgets.save_baseline(measurements)
+            self.skipTest(f'Query budgets written to {query_budgets.BASELINE_PATH}')
+
+        failures = query_budgets.check(measurements, query_budgets.load_baseline())
+        self.assertFalse(failures, 'Query budgets exceeded:\n' + '\n'.join(failures))
+
+    def test_unexpected_statuses_and_repeated_queries_fail_whatever_the_baseline(self):
+        measurement = {'status': 500, 'queries': {'small': 3, 'large': 3}, 'duplicates': {'1234abcd SELECT ...': 2}}
+        failures = query_budgets.check({'broken': measurement}, {'broken': measurement})
+        self.assertEqual(failures, ['broken: status 500, expected 200', 'broken: repeated 2x: 1234abcd SELECT ...'])
+
+        # A POST-only view answering a GET, or a redirect to the login page, is not a measurement either
+        for status in (405, 302):
+            measurement = {'status': status, 'queries': {'small': 3, 'large': 3}, 'duplicates': {}}
+            failures = query_budgets.check({'staff:reports': measurement}, {'staff:reports': measurement})
+            self.assertEqual(failures, [f'staff:reports: status {status}, expected 200'])
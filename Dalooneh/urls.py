@@ -20,7 +20,7 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.views.generic import TemplateView
 from django.contrib.auth.views import LogoutView
-from .views import home_view, test_phone_modal, management_login_view, management_logout_view, management_dashboard, custom_logout_view, manifest_view
+from .views import home_view, test_phone_modal, management_login_view, management_logout_view, management_dashboard, management_cache_stats, management_performance, custom_logout_view, manifest_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -42,6 +42,8 @@ urlpatterns = [
     path('management/login/', management_login_view, name='management_login'),
     path('management/logout/', management_logout_view, name='management_logout'),
     path('management/', management_dashboard, name='management_dashboard'),
+    path('management/cache-stats/', management_cache_stats, name='management_cache_stats'),
+    path('management/performance/', management_performance, name='management_performance'),
 ]
 
 if settings.DEBUG:
@@ -11,11 +11,18 @@ from django.views.decorators.csrf import csrf_protect, ensure_csrf_cookie
 from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
 import json
+import logging
 import os
 
+from . import cache as project_cache
+from . import instrumentation
+from .decorators import superuser_required
+
+logger = logging.getLogger(__name__)
+
 @ensure_csrf_cookie
 def home_view(request):
-    categories = Category.objects.filter(is_active=True)
+    categories = Category.objects.filter(is_active=True).annotate(product_count=Count('products'))
     
     # Get popular products based on order history (most ordered products)
     popular_products = Product.objects.filter(
@@ -29,7 +36,7 @@ def home_view(request):
     
     # Check if redirected from table_access (QR code scan)
     show_phone_modal = request.session.pop('show_phone_modal', False)
-    print(f"DEBUG: show_phone_modal = {show_phone_modal}")
+    logger.debug("show_phone_modal = %s", show_phone_modal)
     
     context = {
         'categories': categories,
@@ -42,7 +49,6 @@ def home_view(request):
 def test_phone_modal(request):
     """Test view to directly set the show_phone_modal flag and redirect to home"""
     request.session['show_phone_modal'] = True
-    print("DEBUG: Test view setting show_phone_modal = True")
     return redirect('home')
 
 @never_cache
@@ -101,6 +107,24 @@ def management_dashboard(request):
     # Redirect to the existing staff management index
     return redirect('staff:management_index')
 
+@superuser_required
+@login_required
+def management_cache_stats(request):
+    """Cache hit/miss and stampede counters of the process serving this request"""
+    return JsonResponse(project_cache.stats())
+
+@superuser_required
+@login_required
+def management_performance(request):
+    """Per-endpoint latency histograms and query/cache totals of the process serving this request"""
+    if request.method == 'POST' and request.POST.get('reset'):
+        instrumentation.histograms.reset()
+    return JsonResponse({
+        'slow_request_ms': instrumentation.PERF_SLOW_REQUEST_MS,
+        'slow_query_ms': instrumentation.PERF_SLOW_QUERY_MS,
+        'endpoints': instrumentation.histograms.snapshot(),
+    })
+
 @require_http_methods(["GET"])
 def manifest_view(request):
     """Serve the PWA manifest.json file"""
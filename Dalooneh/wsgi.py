@@ -12,5 +12,7 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Dalooneh.settings')
+# WSGI workers reuse their threads, so persistent connections are safe here (see DB_CONN_MAX_AGE)
+os.environ.setdefault('DB_CONN_MAX_AGE', '60')
 
 application = get_wsgi_application()
@@ -1,14 +1,23 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import reverse
-from django.db.models import Count, Sum
-from .models import Customer, CustomerRating, Discount
+from .models import Customer, CustomerRating, Discount, PointsTransaction
 
 class CustomerRatingInline(admin.TabularInline):
     model = CustomerRating
     extra = 0
     readonly_fields = ['created_at']
 
+class PointsTransactionInline(admin.TabularInline):
+    model = PointsTransaction
+    extra = 0
+    can_delete = False
+    fields = ['points', 'reason', 'description', 'created_at']
+    readonly_fields = ['points', 'reason', 'description', 'created_at']
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 class DiscountInline(admin.TabularInline):
     model = Discount
     extra = 0
@@ -16,15 +25,15 @@ class DiscountInline(admin.TabularInline):
 
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
-    list_display = ['id', 'user_full_name', 'phone_number', 'membership_level', 'total_points', 'orders_count', 'total_spent', 'is_active', 'created_at']
-    list_filter = ['membership_level', 'is_active', 'created_at']
+    list_display = ['id', 'user_full_name', 'phone_number', 'membership_level', 'total_points', 'orders_count', 'total_spent', 'last_order_at', 'is_active', 'created_at']
+    list_filter = ['membership_level', 'is_active', ('duplicate_of', admin.EmptyFieldListFilter), 'created_at']
     search_fields = ['phone_number', 'national_code', 'user__first_name', 'user__last_name', 'user__email']
-    readonly_fields = ['total_points', 'total_spent', 'total_orders', 'orders_link', 'created_at', 'updated_at']
+    readonly_fields = ['duplicate_of', 'total_points', 'order_count', 'lifetime_spend', 'avg_order_value', 'last_order_at', 'orders_link', 'created_at', 'updated_at']
     date_hierarchy = 'created_at'
-    inlines = [CustomerRatingInline, DiscountInline]
+    inlines = [CustomerRatingInline, PointsTransactionInline, DiscountInline]
     fieldsets = (
         ('User Information', {
-            'fields': ('user', 'phone_number', 'national_code')
+            'fields': ('user', 'phone_number', 'national_code', 'duplicate_of')
         }),
         ('Personal Information', {
             'fields': ('address', 'birth_date')
@@ -33,7 +42,7 @@ class CustomerAdmin(admin.ModelAdmin):
             'fields': ('membership_level', 'total_points', 'is_active')
         }),
         ('Statistics', {
-            'fields': ('total_orders', 'total_spent', 'orders_link')
+            'fields': ('order_count', 'lifetime_spend', 'avg_order_value', 'last_order_at', 'orders_link')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at')
@@ -45,17 +54,18 @@ class CustomerAdmin(admin.ModelAdmin):
     user_full_name.short_description = 'Customer Name'
     
     def orders_count(self, obj):
-        count = obj.orders.count()
+        count = obj.order_count
         if count:
             url = reverse('admin:orders_order_changelist') + f'?customer__id__exact={obj.id}'
             return format_html('<a href="{}">{} Orders</a>', url, count)
         return '0 Orders'
     orders_count.short_description = 'Orders Count'
+    orders_count.admin_order_field = 'order_count'
     
     def total_spent(self, obj):
-        total = obj.orders.aggregate(total=Sum('final_amount'))['total'] or 0
-        return f"${total:,.2f}"
+        return f"${obj.lifetime_spend:,.2f}"
     total_spent.short_description = 'Total Spent'
+    total_spent.admin_order_field = 'lifetime_spend'
     
     def orders_link(self, obj):
         url = reverse('admin:orders_order_changelist') + f'?customer__id__exact={obj.id}'
@@ -63,11 +73,7 @@ class CustomerAdmin(admin.ModelAdmin):
     orders_link.short_description = 'Orders'
     
     def get_queryset(self, request):
-        queryset = super().get_queryset(request)
-        queryset = queryset.annotate(
-            orders_count=Count('orders', distinct=True)
-        )
-        return queryset
+        return super().get_queryset(request).select_related('user')
 
 @admin.register(CustomerRating)
 class CustomerRatingAdmin(admin.ModelAdmin):
@@ -76,9 +82,21 @@ class CustomerRatingAdmin(admin.ModelAdmin):
     search_fields = ['customer__phone_number', 'order__order_number', 'comment']
     readonly_fields = ['created_at', 'updated_at']
 
+@admin.register(PointsTransaction)
+class PointsTransactionAdmin(admin.ModelAdmin):
+    list_display = ['id', 'customer', 'points', 'reason', 'idempotency_key', 'created_at']
+    list_filter = ['reason', 'created_at']
+    search_fields = ['customer__phone_number', 'idempotency_key', 'description']
+    readonly_fields = ['customer', 'points', 'reason', 'idempotency_key', 'description', 'created_at']
+    date_hierarchy = 'created_at'
+
+    def has_add_permission(self, request):
+        # Points change through Customer.add_points so the balance stays in step with the ledger
+        return False
+
 @admin.register(Discount)
 class DiscountAdmin(admin.ModelAdmin):
-    list_display = ['id', 'customer', 'code', 'percentage', 'is_active', 'valid_from', 'valid_to']
-    list_filter = ['is_active', 'valid_from', 'valid_to', 'percentage']
+    list_display = ['id', 'customer', 'membership_level', 'code', 'discount_type', 'percentage', 'fixed_amount', 'is_active', 'valid_from', 'valid_to']
+    list_filter = ['is_active', 'discount_type', 'membership_level', 'valid_from', 'valid_to', 'percentage']
     search_fields = ['customer__phone_number', 'code']
     readonly_fields = ['created_at', 'updated_at']
@@ -0,0 +1,170 @@
+"""
+Discount rules engine.
+
+Active discounts are compiled into a RuleSet indexed by code, by customer and
+by membership level, and eligibility is evaluated in memory. The compiled set
+is cached in its own cache namespace and memoized per process for the
+namespace's version; saving or deleting a Discount invalidates the namespace
+(see customers.signals), so every process reloads the rules on its next
+lookup. Checking that the memo is current costs one cache read and no
+database queries, and only one caller compiles the rules after a change.
+
+A discount can target one customer, every customer of a membership level, or
+(with neither set) anyone who enters its code. Customer and level discounts
+are applied automatically; open codes only when entered.
+"""
+
+import threading
+from decimal import Decimal
+
+from django.conf import settings
+from django.utils import timezone
+
+from Dalooneh.cache import Namespace
+
+from .models import Discount
+
+DISCOUNT_RULES_CACHE_TTL = getattr(settings, 'DISCOUNT_RULES_CACHE_TTL', 300)
+
+rules_namespace = Namespace('customers.discounts', timeout=DISCOUNT_RULES_CACHE_TTL)
+
+
+class DiscountRule:
+    """In-memory copy of one Discount"""
+
+    __slots__ = ('id', 'code', 'customer_id', 'membership_level', 'discount_type', 'percentage',
+                 'fixed_amount', 'min_order_amount', 'valid_from', 'valid_to')
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields[name])
+
+    @classmethod
+    def from_discount(cls, discount):
+        return cls(**{name: getattr(discount, name) for name in cls.__slots__})
+
+    def is_current(self, now):
+        return self.valid_from <= now <= self.valid_to
+
+    def applies_to(self, customer):
+        if self.customer_id is not None:
+            return customer is not None and self.customer_id == customer.pk
+        if self.membership_level:
+            return customer is not None and self.membership_level == customer.membership_level
+        return True
+
+    def amount_for(self, total):
+        """Discount amount on an order total (0 if the order is below the minimum)"""
+        total = Decimal(total)
+        if total <= 0 or total < self.min_order_amount:
+            return Decimal('0')
+        if self.discount_type == 'fixed':
+            return min(self.fixed_amount, total)
+        return (total * self.percentage / 100).quantize(Decimal('0.01'))
+
+
+class RuleSet:
+    """Compiled discount rules with lookups by code, customer and membership level"""
+
+    def __init__(self, rules):
+        self.by_code = {}
+        self.by_customer = {}
+        self.by_level = {}
+        for rule in rules:
+            self.by_code[rule.code] = rule
+            if rule.customer_id is not None:
+                self.by_customer.setdefault(rule.customer_id, []).append(rule)
+            elif rule.membership_level:
+                self.by_level.setdefault(rule.membership_level, []).append(rule)
+
+    def __len__(self):
+        return len(self.by_code)
+
+    def targeted(self, customer):
+        """Customer and membership level rules for a customer"""
+        if customer is None:
+            return []
+        return self.by_customer.get(customer.pk, []) + self.by_level.get(customer.membership_level, [])
+
+
+def load_rules(now=None):
+    """
+    Compile every active discount that has not ended yet. Rules that start
+    later are included and filtered at evaluation time, so they need no reload.
+    """
+    now = now or timezone.now()
+    discounts = Discount.objects.filter(is_active=True, valid_to__gte=now).order_by('pk')
+    return RuleSet([DiscountRule.from_discount(discount) for discount in discounts])
+
+
+class RuleCache:
+    """Per-process memo of the compiled rules for the current version"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._rules = None
+
+    def get(self):
+        version = rules_namespace.version()
+        with self._lock:
+            if version == self._version:
+                return self._rules
+
+        rules = rules_namespace.get_or_set('rules', load_rules)
+
+        with self._lock:
+            self._version, self._rules = version, rules
+        return rules
+
+    def clear(self):
+        with self._lock:
+            self._version = self._rules = None
+
+
+rule_cache = RuleCache()
+
+
+def get_rules():
+    return rule_cache.get()
+
+
+def invalidate_rules():
+    """Make every process reload the rules on its next lookup"""
+    rules_namespace.invalidate()
+    rule_cache.clear()
+
+
+def find_discount(code, customer, now=None):
+    """The current rule for a code if this customer may use it, else None"""
+    if not code:
+        return None
+    rule = get_rules().by_code.get(code.strip())
+    if rule is None or not rule.is_current(now or timezone.now()) or not rule.applies_to(customer):
+        return None
+    return rule
+
+
+def available_discounts(customer, now=None):
+    """Current discounts targeted at a customer (their own and their level's)"""
+    now = now or timezone.now()
+    return [rule for rule in get_rules().targeted(customer) if rule.is_current(now)]
+
+
+def best_discount(customer, total, code=None, now=None):
+    """
+    (rule, amount) for the largest discount on an order total, or (None, 0).
+    Considers the customer's automatic discounts and, if given, an entered code.
+    """
+    now = now or timezone.now()
+    candidates = available_discounts(customer, now)
+    entered = find_discount(code, customer, now)
+    if entered is not None:
+        candidates.append(entered)
+
+    best, best_amount = None, Decimal('0')
+    for rule in candidates:
+        amount = rule.amount_for(total)
+        if amount > best_amount:
+            best, best_amount = rule, amount
+    return best, best_amount
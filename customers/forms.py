@@ -2,6 +2,16 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from .models import Customer, CustomerRating, Discount
+from .resolver import normalize_phone
+
+class CustomerPhoneMixin:
+    """Rejects numbers that normalize to another customer's number (e.g. "0912..." vs "98912...")"""
+    def clean_phone_number(self):
+        phone_number = self.cleaned_data.get('phone_number')
+        e164 = normalize_phone(phone_number)
+        if e164 and Customer.objects.filter(phone_e164=e164).exclude(pk=self.instance.pk).exists():
+            raise forms.ValidationError('A customer with this phone number already exists.')
+        return phone_number
 
 class CustomerRegistrationForm(UserCreationForm):
     phone_number = forms.CharField(max_length=15, required=True)
@@ -12,7 +22,7 @@ class CustomerRegistrationForm(UserCreationForm):
         model = User
         fields = ('username', 'email', 'first_name', 'last_name', 'password1', 'password2')
 
-class CustomerProfileForm(forms.ModelForm):
+class CustomerProfileForm(CustomerPhoneMixin, forms.ModelForm):
     class Meta:
         model = Customer
         fields = ('phone_number', 'address', 'national_code', 'birth_date')
@@ -45,7 +55,7 @@ class CustomerRatingForm(forms.ModelForm):
         return rating
 
 # Management Panel Forms
-class ManagementCustomerForm(forms.ModelForm):
+class ManagementCustomerForm(CustomerPhoneMixin, forms.ModelForm):
     first_name = forms.CharField(max_length=30, required=True, label='First Name')
     last_name = forms.CharField(max_length=30, required=True, label='Last Name')
     email = forms.EmailField(required=False, label='Email')
@@ -93,16 +103,44 @@ class ManagementCustomerRatingForm(forms.ModelForm):
             'rating': forms.NumberInput(attrs={'class': 'form-control', 'min': 1, 'max': 5}),
             'comment': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
         }
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Customer choices are labelled with the user's name
+        self.fields['customer'].queryset = Customer.objects.select_related('user')
 
 class ManagementDiscountForm(forms.ModelForm):
     class Meta:
         model = Discount
-        fields = ('customer', 'code', 'percentage', 'is_active', 'valid_from', 'valid_to')
+        fields = ('customer', 'membership_level', 'code', 'discount_type', 'percentage', 'fixed_amount', 'min_order_amount', 'is_active', 'valid_from', 'valid_to')
         widgets = {
             'customer': forms.Select(attrs={'class': 'form-select'}),
+            'membership_level': forms.Select(attrs={'class': 'form-select'}),
             'code': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Discount Code'}),
-            'percentage': forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Discount Percentage', 'min': 1, 'max': 100}),
+            'discount_type': forms.Select(attrs={'class': 'form-select'}),
+            'percentage': forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Discount Percentage', 'min': 0, 'max': 100}),
+            'fixed_amount': forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Fixed Amount', 'min': 0}),
+            'min_order_amount': forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Minimum Order Amount', 'min': 0}),
             'is_active': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
             'valid_from': forms.DateTimeInput(attrs={'class': 'form-control', 'type': 'datetime-local'}),
             'valid_to': forms.DateTimeInput(attrs={'class': 'form-control', 'type': 'datetime-local'}),
-        } 
\ No newline at end of file
+        } 
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Customer choices are labelled with the user's name
+        self.fields['customer'].queryset = Customer.objects.select_related('user')
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('customer') and cleaned_data.get('membership_level'):
+            raise forms.ValidationError('A discount can target a customer or a membership level, not both.')
+        if cleaned_data.get('discount_type') == 'fixed':
+            if not cleaned_data.get('fixed_amount'):
+                self.add_error('fixed_amount', 'Enter the fixed discount amount.')
+        elif not 1 <= (cleaned_data.get('percentage') or 0) <= 100:
+            self.add_error('percentage', 'Discount percentage must be between 1 and 100.')
+        valid_from, valid_to = cleaned_data.get('valid_from'), cleaned_data.get('valid_to')
+        if valid_from and valid_to and valid_to < valid_from:
+            self.add_error('valid_to', 'End date must be after the start date.')
+        return cleaned_data
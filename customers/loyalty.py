@@ -0,0 +1,199 @@
+"""
+Loyalty points and membership tiers.
+
+Every change to a customer's points is a PointsTransaction row. The balance is
+then moved with a single ``UPDATE ... SET total_points = total_points + n,
+membership_level = CASE ...`` so concurrent awards never overwrite each other
+and the tier always matches the balance it was computed from.
+
+MEMBERSHIP_TIERS is the only place the tier thresholds are defined. Points
+expire LOYALTY_POINTS_EXPIRY_DAYS after they were earned (None disables
+expiry); redemptions use up the oldest points first. The
+recalculate_membership_tiers command runs the expiry and the bulk tier
+recalculation.
+"""
+
+import datetime
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, CharField, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThanOrEqual
+from django.utils import timezone
+
+from .models import Customer, PointsTransaction
+
+LOYALTY_POINTS_EXPIRY_DAYS = getattr(settings, 'LOYALTY_POINTS_EXPIRY_DAYS', None)
+
+# Minimum points for each membership level, highest first
+MEMBERSHIP_TIERS = [
+    ('platinum', 10000),
+    ('gold', 5000),
+    ('silver', 1000),
+    ('regular', 0),
+]
+
+
+def tier_for(points):
+    """Membership level for a points balance"""
+    for level, minimum in MEMBERSHIP_TIERS:
+        if points >= minimum:
+            return level
+    return MEMBERSHIP_TIERS[-1][0]
+
+
+def tier_requirements():
+    """{level: minimum points} for every level above regular, lowest first"""
+    return {level: minimum for level, minimum in reversed(MEMBERSHIP_TIERS) if minimum}
+
+
+def next_tier(points):
+    """(next level, points still needed) for a balance, or (None, 0) at the top level"""
+    for level, minimum in tier_requirements().items():
+        if points < minimum:
+            return level, minimum - points
+    return None, 0
+
+
+def tier_case(points):
+    """SQL CASE expression giving the membership level for a points expression"""
+    return Case(
+        *[When(GreaterThanOrEqual(points, minimum), then=Value(level)) for level, minimum in MEMBERSHIP_TIERS[:-1]],
+        default=Value(MEMBERSHIP_TIERS[-1][0]),
+        output_field=CharField(),
+    )
+
+
+class InsufficientPoints(Exception):
+    pass
+
+
+def award_points(customer, points, idempotency_key=None, reason='adjustment', description=''):
+    """
+    Record a points transaction and apply it to the customer's balance.
+
+    A repeated idempotency key is a no-op. Deductions that would take the
+    balance below zero raise InsufficientPoints and record nothing.
+    Returns (transaction, created).
+    """
+    idempotency_key = idempotency_key or f'{reason}:{uuid.uuid4().hex}'
+    try:
+        with transaction.atomic():
+            entry = PointsTransaction.objects.create(
+                customer=customer,
+                points=points,
+                reason=reason,
+                idempotency_key=idempotency_key,
+                description=description,
+            )
+            balance = F('total_points') + points
+            customers = Customer.objects.filter(pk=customer.pk)
+            if points < 0:
+                customers = customers.filter(total_points__gte=-points)
+            if not customers.update(total_points=balance, membership_level=tier_case(balance)):
+                raise InsufficientPoints(f'Customer {customer.pk} has fewer than {-points} points')
+    except IntegrityError:
+        # Already applied by an earlier (or concurrent) call with the same key
+        return PointsTransaction.objects.get(idempotency_key=idempotency_key), False
+
+    customer.refresh_from_db(fields=['total_points', 'membership_level'])
+    return entry, True
+
+
+def recompute_balances(customer_ids=None):
+    """
+    Rebuild customers' balances and levels from the ledger with one UPDATE
+    (every customer unless ``customer_ids`` is given). Returns the number of customers updated.
+    """
+    customers = Customer.objects.all() if customer_ids is None else Customer.objects.filter(pk__in=customer_ids)
+    ledger_total = Coalesce(
+        Subquery(
+            PointsTransaction.objects.filter(customer=OuterRef('pk'))
+            .values('customer')
+            .annotate(total=Sum('points'))
+            .values('total')[:1],
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+    return customers.update(total_points=ledger_total, membership_level=tier_case(ledger_total))
+
+
+def recalculate_tiers(batch_size=10000):
+    """
+    Bring every customer's membership level in line with their balance.
+    Runs one ``UPDATE ... SET membership_level = CASE ...`` per pk range, touching
+    only rows whose level is wrong, so each statement holds its locks briefly.
+    Returns the number of customers whose level changed.
+    """
+    bounds = Customer.objects.order_by('pk').values_list('pk', flat=True)
+    first, last = bounds.first(), bounds.last()
+    if first is None:
+        return 0
+
+    tier = tier_case(F('total_points'))
+    changed = 0
+    for start in range(first, last + 1, batch_size):
+        changed += (
+            Customer.objects.filter(pk__gte=start, pk__lt=start + batch_size)
+            .exclude(membership_level=tier)
+            .update(membership_level=tier)
+        )
+    return changed
+
+
+def expire_points(expiry_days=LOYALTY_POINTS_EXPIRY_DAYS, now=None, batch_size=1000):
+    """
+    Expire points earned more than ``expiry_days`` ago that have not been spent.
+
+    Spending uses the oldest points first, so a customer's expiring amount is
+    their points earned before the cutoff plus all their deductions so far
+    (redemptions and earlier expiries are negative). Each customer gets at most
+    one expiry transaction per cutoff date, so re-running the job is harmless.
+    Returns (customers, points) expired.
+    """
+    if not expiry_days:
+        return 0, 0
+
+    cutoff = (now or timezone.now()) - datetime.timedelta(days=expiry_days)
+    expiring = (
+        PointsTransaction.objects.values('customer_id')
+        .annotate(
+            expiring=Coalesce(Sum('points', filter=Q(points__gt=0, created_at__lt=cutoff)), 0)
+            + Coalesce(Sum('points', filter=Q(points__lt=0)), 0)
+        )
+        .filter(expiring__gt=0)
+        .order_by('customer_id')
+        .values_list('customer_id', 'expiring')
+    )
+
+    customers = points = 0
+    batch = []
+    for row in expiring.iterator(chunk_size=batch_size):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            points += _record_expiry(batch, cutoff)
+            customers += len(batch)
+            batch = []
+    if batch:
+        points += _record_expiry(batch, cutoff)
+        customers += len(batch)
+    return customers, points
+
+
+def _record_expiry(rows, cutoff):
+    with transaction.atomic():
+        PointsTransaction.objects.bulk_create([
+            PointsTransaction(
+                customer_id=customer_id,
+                points=-amount,
+                reason='expiry',
+                idempotency_key=f'expiry:{customer_id}:{cutoff.date().isoformat()}',
+                description=f'Points earned before {cutoff.date().isoformat()} expired',
+            )
+            for customer_id, amount in rows
+        ], ignore_conflicts=True)
+        recompute_balances([customer_id for customer_id, _ in rows])
+    return sum(amount for _, amount in rows)
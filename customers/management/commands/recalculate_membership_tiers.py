@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from customers.loyalty import LOYALTY_POINTS_EXPIRY_DAYS, expire_points, recalculate_tiers
+
+
+class Command(BaseCommand):
+    help = 'Expire old loyalty points and recalculate every customer\'s membership level in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help='Customers per UPDATE statement (default: 10000)',
+        )
+        parser.add_argument(
+            '--expiry-days',
+            type=int,
+            default=LOYALTY_POINTS_EXPIRY_DAYS,
+            help='Expire points earned more than this many days ago (default: LOYALTY_POINTS_EXPIRY_DAYS)',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be a positive number')
+        if options['expiry_days'] is not None and options['expiry_days'] < 1:
+            raise CommandError('--expiry-days must be a positive number')
+
+        if options['expiry_days']:
+            self.stdout.write(f"Expiring points older than {options['expiry_days']} days")
+            customers, points = expire_points(options['expiry_days'])
+            self.stdout.write(f'Expired {points} points from {customers} customers')
+
+        self.stdout.write('Recalculating membership levels')
+        changed = recalculate_tiers(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Changed the membership level of {changed} customers'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from customers.loyalty import recompute_balances
+
+
+class Command(BaseCommand):
+    help = 'Rebuild every customer\'s points balance and membership level from the points ledger'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Recomputing loyalty points from the ledger')
+        updated = recompute_balances()
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} customers'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from customers.stats import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized customer lifetime figures (order count, spend, last order) and fix any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Customers recomputed per query (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be a positive number')
+
+        self.stdout.write('Reconciling customer lifetime statistics')
+        checked, fixed = reconcile(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} customers, fixed {fixed}'))
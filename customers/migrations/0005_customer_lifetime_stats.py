@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:10
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+
+BATCH_SIZE = 500
+
+
+def backfill_lifetime_stats(apps, schema_editor):
+    Customer = apps.get_model('customers', 'Customer')
+    Order = apps.get_model('orders', 'Order')
+    completed = (Q(status='delivered') | Q(payment_status='paid')) & ~Q(status='cancelled')
+
+    last_pk = 0
+    while True:
+        customers = list(Customer.objects.filter(pk__gt=last_pk).order_by('pk').only('pk')[:BATCH_SIZE])
+        if not customers:
+            break
+        last_pk = customers[-1].pk
+
+        rows = (
+            Order.objects.filter(completed, customer_id__in=[customer.pk for customer in customers])
+            .values('customer_id')
+            .annotate(count=Count('id'), spend=Sum('final_amount'), last=Max('created_at'))
+            .order_by()
+        )
+        stats = {row['customer_id']: row for row in rows}
+
+        for customer in customers:
+            row = stats.get(customer.pk)
+            if row:
+                spend = row['spend'] or Decimal('0')
+                customer.order_count = row['count']
+                customer.lifetime_spend = spend
+                customer.last_order_at = row['last']
+                customer.avg_order_value = (spend / row['count']).quantize(Decimal('0.01'))
+            else:
+                customer.order_count = 0
+                customer.lifetime_spend = Decimal('0')
+                customer.last_order_at = None
+                customer.avg_order_value = Decimal('0')
+
+        Customer.objects.bulk_update(
+            customers, ['order_count', 'lifetime_spend', 'last_order_at', 'avg_order_value']
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0004_customer_created_id_index'),
+        ('orders', '0007_backfill_order_status_timestamps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='order_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Order Count'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='lifetime_spend',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Lifetime Spend'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='last_order_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last Order'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='avg_order_value',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Average Order Value'),
+        ),
+        migrations.RunPython(backfill_lifetime_stats, migrations.RunPython.noop),
+    ]
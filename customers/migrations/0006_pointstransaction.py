@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:05
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def seed_opening_balances(apps, schema_editor):
+    """Record each existing balance as an opening transaction so the ledger sums to total_points"""
+    Customer = apps.get_model('customers', 'Customer')
+    PointsTransaction = apps.get_model('customers', 'PointsTransaction')
+
+    last_pk = 0
+    while True:
+        customers = list(
+            Customer.objects.filter(pk__gt=last_pk).order_by('pk').values('pk', 'total_points')[:BATCH_SIZE]
+        )
+        if not customers:
+            break
+        last_pk = customers[-1]['pk']
+        PointsTransaction.objects.bulk_create([
+            PointsTransaction(
+                customer_id=customer['pk'],
+                points=customer['total_points'],
+                reason='opening',
+                idempotency_key=f"opening:{customer['pk']}",
+                description='Balance before the points ledger',
+            )
+            for customer in customers if customer['total_points']
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0005_customer_lifetime_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PointsTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('points', models.IntegerField(verbose_name='Points')),
+                ('reason', models.CharField(choices=[('opening', 'Opening Balance'), ('rating', 'Order Rating'), ('order', 'Order'), ('redemption', 'Redemption'), ('expiry', 'Expiry'), ('adjustment', 'Manual Adjustment')], max_length=20, verbose_name='Reason')),
+                ('idempotency_key', models.CharField(max_length=100, unique=True, verbose_name='Idempotency Key')),
+                ('description', models.CharField(blank=True, max_length=255, verbose_name='Description')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='points_transactions', to='customers.customer', verbose_name='Customer')),
+            ],
+            options={
+                'verbose_name': 'Points Transaction',
+                'verbose_name_plural': 'Points Transactions',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['customer', 'created_at'], name='points_customer_created_idx')],
+            },
+        ),
+        migrations.RunPython(seed_opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+PHONE_DEFAULT_COUNTRY_CODE = getattr(settings, 'PHONE_DEFAULT_COUNTRY_CODE', '98')
+
+PHONE_PUNCTUATION = str.maketrans('', '', ' -().')
+
+
+def normalize_phone(phone_number, country_code=PHONE_DEFAULT_COUNTRY_CODE):
+    """Frozen copy of customers.resolver.normalize_phone as of this migration"""
+    if not phone_number:
+        return None
+    raw = str(phone_number).strip()
+    if not raw.lstrip('+').translate(PHONE_PUNCTUATION).isdigit():
+        return None
+    digits = ''.join(filter(str.isdigit, raw))
+
+    if raw.startswith('+'):
+        number = digits
+    elif digits.startswith('00'):
+        number = digits[2:]
+    elif digits.startswith('0'):
+        number = country_code + digits[1:]
+    elif digits.startswith(country_code) and len(digits) > 10:
+        number = digits
+    else:
+        number = country_code + digits
+
+    if not 8 <= len(number) <= 15 or number.startswith('0'):
+        return None
+    return f'+{number}'
+
+
+def backfill_phone_e164(apps, schema_editor):
+    Customer = apps.get_model('customers', 'Customer')
+    seen = set()
+    last_pk = 0
+    while True:
+        customers = list(
+            Customer.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', 'phone_number')[:BATCH_SIZE]
+        )
+        if not customers:
+            break
+        last_pk = customers[-1].pk
+
+        for customer in customers:
+            e164 = normalize_phone(customer.phone_number)
+            # Legacy numbers that differ only in formatting: the oldest customer keeps the normalized number,
+            # the others are flagged as its duplicates by 0009_customer_duplicate_of
+            if e164 in seen:
+                e164 = None
+            if e164:
+                seen.add(e164)
+            customer.phone_e164 = e164
+        Customer.objects.bulk_update(customers, ['phone_e164'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0006_pointstransaction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='phone_e164',
+            field=models.CharField(blank=True, editable=False, max_length=16, null=True, unique=True, verbose_name='Phone Number (E.164)'),
+        ),
+        migrations.RunPython(backfill_phone_e164, migrations.RunPython.noop),
+    ]
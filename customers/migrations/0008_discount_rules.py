@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0007_customer_phone_e164'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='discount',
+            name='customer',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='discounts', to='customers.customer', verbose_name='Customer'),
+        ),
+        migrations.AddField(
+            model_name='discount',
+            name='membership_level',
+            field=models.CharField(blank=True, choices=[('regular', 'Regular'), ('silver', 'Silver'), ('gold', 'Gold'), ('platinum', 'Platinum')], max_length=20, verbose_name='Membership Level'),
+        ),
+        migrations.AddField(
+            model_name='discount',
+            name='discount_type',
+            field=models.CharField(choices=[('percentage', 'Percentage'), ('fixed', 'Fixed Amount')], default='percentage', max_length=20, verbose_name='Discount Type'),
+        ),
+        migrations.AlterField(
+            model_name='discount',
+            name='percentage',
+            field=models.PositiveIntegerField(default=0, verbose_name='Discount Percentage'),
+        ),
+        migrations.AddField(
+            model_name='discount',
+            name='fixed_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Fixed Amount'),
+        ),
+        migrations.AddField(
+            model_name='discount',
+            name='min_order_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Minimum Order Amount'),
+        ),
+        migrations.AddIndex(
+            model_name='discount',
+            index=models.Index(fields=['is_active', 'valid_from', 'valid_to'], name='discount_active_validity_idx'),
+        ),
+    ]
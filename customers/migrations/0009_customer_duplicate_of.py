@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+PHONE_DEFAULT_COUNTRY_CODE = getattr(settings, 'PHONE_DEFAULT_COUNTRY_CODE', '98')
+
+PHONE_PUNCTUATION = str.maketrans('', '', ' -().')
+
+
+def normalize_phone(phone_number, country_code=PHONE_DEFAULT_COUNTRY_CODE):
+    """Frozen copy of customers.resolver.normalize_phone as of this migration"""
+    if not phone_number:
+        return None
+    raw = str(phone_number).strip()
+    if not raw.lstrip('+').translate(PHONE_PUNCTUATION).isdigit():
+        return None
+    digits = ''.join(filter(str.isdigit, raw))
+
+    if raw.startswith('+'):
+        number = digits
+    elif digits.startswith('00'):
+        number = digits[2:]
+    elif digits.startswith('0'):
+        number = country_code + digits[1:]
+    elif digits.startswith(country_code) and len(digits) > 10:
+        number = digits
+    else:
+        number = country_code + digits
+
+    if not 8 <= len(number) <= 15 or number.startswith('0'):
+        return None
+    return f'+{number}'
+
+
+def flag_duplicates(apps, schema_editor):
+    """Point every customer left without phone_e164 by 0007 at the customer that kept the number"""
+    Customer = apps.get_model('customers', 'Customer')
+    candidates = Customer.objects.filter(phone_e164__isnull=True).order_by('pk').only('pk', 'phone_number')
+    last_pk = 0
+    while True:
+        customers = list(candidates.filter(pk__gt=last_pk)[:BATCH_SIZE])
+        if not customers:
+            break
+        last_pk = customers[-1].pk
+
+        numbers = {customer.pk: normalize_phone(customer.phone_number) for customer in customers}
+        owners = dict(
+            Customer.objects.filter(phone_e164__in={e164 for e164 in numbers.values() if e164})
+            .values_list('phone_e164', 'pk')
+        )
+        flagged = []
+        for customer in customers:
+            owner = owners.get(numbers[customer.pk])
+            if owner is not None:
+                customer.duplicate_of_id = owner
+                flagged.append(customer)
+        Customer.objects.bulk_update(flagged, ['duplicate_of'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0008_discount_rules'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='customers.customer', verbose_name='Duplicate Of'),
+        ),
+        migrations.RunPython(flag_duplicates, migrations.RunPython.noop),
+    ]
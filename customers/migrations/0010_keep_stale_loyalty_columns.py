@@ -0,0 +1,43 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    The loyalty and visit fields added in 0003 were later removed from Customer
+    without a migration, so their NOT NULL columns reject every new customer.
+    The columns and their data are kept: the non-null ones get database
+    defaults, and the fields are only dropped from the migration state.
+    """
+
+    dependencies = [
+        ('customers', '0009_customer_duplicate_of'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.AlterField(
+                    model_name='customer',
+                    name='loyalty_discount_active',
+                    field=models.BooleanField(default=False, db_default=False, verbose_name='Loyalty Discount Active'),
+                ),
+                migrations.AlterField(
+                    model_name='customer',
+                    name='loyalty_discount_percentage',
+                    field=models.PositiveIntegerField(default=10, db_default=10, verbose_name='Loyalty Discount Percentage'),
+                ),
+                migrations.AlterField(
+                    model_name='customer',
+                    name='visit_count',
+                    field=models.PositiveIntegerField(default=0, db_default=0, verbose_name='Visit Count'),
+                ),
+            ],
+            state_operations=[
+                migrations.RemoveField(model_name='customer', name='last_visit'),
+                migrations.RemoveField(model_name='customer', name='loyalty_discount_active'),
+                migrations.RemoveField(model_name='customer', name='loyalty_discount_expires'),
+                migrations.RemoveField(model_name='customer', name='loyalty_discount_percentage'),
+                migrations.RemoveField(model_name='customer', name='visit_count'),
+            ],
+        ),
+    ]
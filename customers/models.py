@@ -2,7 +2,9 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
-from django.db.models import Sum
+
+# phone_number was not loaded (deferred) when the customer was read
+_DEFERRED = object()
 
 class Customer(models.Model):
     MEMBERSHIP_CHOICES = [
@@ -14,6 +16,14 @@ class Customer(models.Model):
     
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='customer', verbose_name='User')
     phone_number = models.CharField(max_length=15, unique=True, verbose_name='Phone Number')
+    # phone_number in E.164 form, kept in step by save(); see customers.resolver
+    phone_e164 = models.CharField(max_length=16, unique=True, null=True, blank=True, editable=False, verbose_name='Phone Number (E.164)')
+    # Legacy customer whose number differs only in formatting from an older customer's; that customer
+    # keeps phone_e164 and this one has none until the duplicate is merged or its number corrected
+    duplicate_of = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, null=True, blank=True, related_name='duplicates',
+        verbose_name='Duplicate Of'
+    )
     national_code = models.CharField(max_length=10, unique=True, null=True, blank=True, verbose_name='National ID')
     address = models.TextField(blank=True, verbose_name='Address')
     birth_date = models.DateField(null=True, blank=True, verbose_name='Birth Date')
@@ -25,6 +35,13 @@ class Customer(models.Model):
         verbose_name='Membership Level'
     )
     is_active = models.BooleanField(default=True, verbose_name='Active')
+
+    # Lifetime figures over delivered or fully paid orders, maintained by customers.stats
+    order_count = models.PositiveIntegerField(default=0, verbose_name='Order Count')
+    lifetime_spend = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='Lifetime Spend')
+    last_order_at = models.DateTimeField(null=True, blank=True, verbose_name='Last Order')
+    avg_order_value = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Average Order Value')
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -32,35 +49,58 @@ class Customer(models.Model):
         verbose_name = 'Customer'
         verbose_name_plural = 'Customers'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='customer_created_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.get_full_name()} - {self.phone_number}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_phone_number = instance.__dict__.get('phone_number', _DEFERRED)
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Only a new or changed number is normalized again, so a flagged duplicate keeps its empty phone_e164
+        loaded = getattr(self, '_loaded_phone_number', _DEFERRED)
+        update_fields = kwargs.get('update_fields')
+        phone_changed = (
+            (self._state.adding or self.__dict__.get('phone_number', loaded) != loaded)
+            and (update_fields is None or 'phone_number' in update_fields)
+        )
+        if phone_changed:
+            from .resolver import normalize_phone
+            self.phone_e164 = normalize_phone(self.phone_number)
+            self.duplicate_of = None
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'phone_e164', 'duplicate_of'}
+        super().save(*args, **kwargs)
+        if phone_changed:
+            self._loaded_phone_number = self.phone_number
+
     @property
     def total_orders(self):
-        return self.orders.count()
+        return self.order_count
 
     @property
     def total_spent(self):
-        return self.orders.aggregate(total=Sum('final_amount'))['total'] or 0
+        return self.lifetime_spend
 
     def update_membership_level(self):
         """Update membership level based on total points"""
-        if self.total_points >= 10000:
-            self.membership_level = 'platinum'
-        elif self.total_points >= 5000:
-            self.membership_level = 'gold'
-        elif self.total_points >= 1000:
-            self.membership_level = 'silver'
-        else:
-            self.membership_level = 'regular'
+        from .loyalty import tier_for
+        self.membership_level = tier_for(self.total_points)
         self.save(update_fields=['membership_level'])
 
-    def add_points(self, points):
-        """Add points to customer's total"""
-        self.total_points += points
-        self.save(update_fields=['total_points'])
-        self.update_membership_level()
+    def add_points(self, points, idempotency_key=None, reason='adjustment', description=''):
+        """
+        Add (or with a negative value, deduct) points through the points ledger.
+        Balance and membership level are updated in one atomic UPDATE; see customers.loyalty.
+        """
+        from .loyalty import award_points
+        return award_points(self, points, idempotency_key, reason, description)
 
 class CustomerRating(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='ratings', verbose_name='Customer')
@@ -86,14 +126,59 @@ class CustomerRating(models.Model):
         super().save(*args, **kwargs)
         
         if is_new:
-            # Add points based on rating
+            # Add points based on rating; the ledger key makes this award happen at most once
             points = self.rating * 10  # 10 points per star
-            self.customer.add_points(points)
+            self.customer.add_points(points, f'rating:{self.pk}', 'rating', f'Rated order {self.order_id}')
+
+class PointsTransaction(models.Model):
+    """
+    Loyalty points ledger. A customer's total_points is the sum of their transactions;
+    the unique idempotency key (e.g. "rating:<id>") keeps a source from awarding twice.
+    """
+    REASON_CHOICES = [
+        ('opening', 'Opening Balance'),
+        ('rating', 'Order Rating'),
+        ('order', 'Order'),
+        ('redemption', 'Redemption'),
+        ('expiry', 'Expiry'),
+        ('adjustment', 'Manual Adjustment'),
+    ]
+
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='points_transactions', verbose_name='Customer')
+    points = models.IntegerField(verbose_name='Points')
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES, verbose_name='Reason')
+    idempotency_key = models.CharField(max_length=100, unique=True, verbose_name='Idempotency Key')
+    description = models.CharField(max_length=255, blank=True, verbose_name='Description')
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        verbose_name = 'Points Transaction'
+        verbose_name_plural = 'Points Transactions'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['customer', 'created_at'], name='points_customer_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.points:+d} points for {self.customer_id} ({self.get_reason_display()})"
 
 class Discount(models.Model):
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='discounts', verbose_name='Customer')
+    """
+    A discount for one customer, for every customer of a membership level, or
+    (with neither set) for anyone with the code. Evaluated by customers.discounts.
+    """
+    TYPE_CHOICES = [
+        ('percentage', 'Percentage'),
+        ('fixed', 'Fixed Amount'),
+    ]
+
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, null=True, blank=True, related_name='discounts', verbose_name='Customer')
+    membership_level = models.CharField(max_length=20, choices=Customer.MEMBERSHIP_CHOICES, blank=True, verbose_name='Membership Level')
     code = models.CharField(max_length=20, unique=True, verbose_name='Discount Code')
-    percentage = models.PositiveIntegerField(verbose_name='Discount Percentage')
+    discount_type = models.CharField(max_length=20, choices=TYPE_CHOICES, default='percentage', verbose_name='Discount Type')
+    percentage = models.PositiveIntegerField(default=0, verbose_name='Discount Percentage')
+    fixed_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Fixed Amount')
+    min_order_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Minimum Order Amount')
     is_active = models.BooleanField(default=True, verbose_name='Active')
     valid_from = models.DateTimeField(verbose_name='Valid From')
     valid_to = models.DateTimeField(verbose_name='Valid To')
@@ -104,8 +189,13 @@ class Discount(models.Model):
         verbose_name = 'Discount'
         verbose_name_plural = 'Discounts'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['is_active', 'valid_from', 'valid_to'], name='discount_active_validity_idx'),
+        ]
 
     def __str__(self):
+        if self.discount_type == 'fixed':
+            return f"{self.code} - {self.fixed_amount}"
         return f"{self.code} - {self.percentage}%"
 
     def is_valid(self):
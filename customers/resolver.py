@@ -0,0 +1,185 @@
+"""
+Customer identification by phone number.
+
+Phone numbers are normalized to E.164 ("+989121234567") and stored in the
+unique, indexed Customer.phone_e164 column, so "0912 123 4567",
+"989121234567" and "+98 912 123 4567" all identify the same customer with a
+single indexed lookup. That lookup is not cached: a cached customer id
+would still need the same one-row query to load the customer. New customers
+keep phone_number in the national form existing rows use ("09121234567").
+
+``resolver.get_or_create`` is safe under concurrent requests for the same
+number: the losing request's insert hits the unique constraints, is rolled
+back, and the winner's customer is returned instead.
+
+Async views use the ``a``-prefixed variants (``aby_phone``, ``aget_or_create``,
+``afrom_request``, ``aremember``), which go through the async ORM, cache and
+session APIs.
+"""
+
+from django.conf import settings
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+
+from .models import Customer
+
+PHONE_DEFAULT_COUNTRY_CODE = getattr(settings, 'PHONE_DEFAULT_COUNTRY_CODE', '98')
+PHONE_PUNCTUATION = str.maketrans('', '', ' -().')
+
+
+def normalize_phone(phone_number, country_code=PHONE_DEFAULT_COUNTRY_CODE):
+    """
+    E.164 form of a phone number, or None if it cannot be one.
+    Numbers without an international prefix are taken to be in the default country.
+    """
+    if not phone_number:
+        return None
+    raw = str(phone_number).strip()
+    # Placeholders such as "temp_1a2b3c4d" or "anonymous" are not phone numbers
+    if not raw.lstrip('+').translate(PHONE_PUNCTUATION).isdigit():
+        return None
+    digits = ''.join(filter(str.isdigit, raw))
+
+    if raw.startswith('+'):
+        number = digits
+    elif digits.startswith('00'):
+        number = digits[2:]
+    elif digits.startswith('0'):
+        # National trunk prefix
+        number = country_code + digits[1:]
+    elif digits.startswith(country_code) and len(digits) > 10:
+        number = digits
+    else:
+        number = country_code + digits
+
+    if not 8 <= len(number) <= 15 or number.startswith('0'):
+        return None
+    return f'+{number}'
+
+
+def national_phone(e164, country_code=PHONE_DEFAULT_COUNTRY_CODE):
+    """The form phone_number is stored in: national ("09121234567") in the default country, E.164 elsewhere"""
+    prefix = f'+{country_code}'
+    if e164.startswith(prefix):
+        return '0' + e164[len(prefix):]
+    return e164
+
+
+class CustomerResolver:
+    """Finds (or creates) the customer behind a phone number or a request"""
+
+    def by_phone(self, phone_number):
+        """Customer with this phone number, or None. At most one indexed query."""
+        e164 = normalize_phone(phone_number)
+        if not e164:
+            return None
+        return Customer.objects.filter(phone_e164=e164).first()
+
+    async def aby_phone(self, phone_number):
+        """Async by_phone"""
+        e164 = normalize_phone(phone_number)
+        if not e164:
+            return None
+        return await Customer.objects.filter(phone_e164=e164).afirst()
+
+    def get_or_create(self, phone_number):
+        """
+        (customer, created) for a phone number. A new customer gets a
+        passwordless user named after the number.
+        Raises ValueError for numbers that cannot be normalized.
+        """
+        e164 = normalize_phone(phone_number)
+        if not e164:
+            raise ValueError(f'Invalid phone number: {phone_number!r}')
+
+        customer = self.by_phone(e164)
+        if customer:
+            return customer, False
+
+        digits = e164[1:]
+        try:
+            with transaction.atomic():
+                user = User(username=f'user_{digits}', email='', is_active=True)
+                user.set_unusable_password()
+                user.save()
+                customer = Customer.objects.create(
+                    user=user,
+                    phone_number=national_phone(e164),
+                    national_code=None,
+                    membership_level='regular',
+                    total_points=0,
+                )
+        except IntegrityError:
+            # A concurrent request registered the same number first
+            customer = self.by_phone(e164)
+            if customer is None:
+                raise
+            return customer, False
+        return customer, True
+
+    async def aget_or_create(self, phone_number):
+        """Async get_or_create; the registration transaction runs in a worker thread"""
+        customer = await self.aby_phone(phone_number)
+        if customer:
+            return customer, False
+        return await sync_to_async(self.get_or_create)(phone_number)
+
+    def from_request(self, request):
+        """
+        Customer identified by the session (phone modal), the logged-in user,
+        or the phone number remembered in the session, in that order. None if none of them match.
+        """
+        customer_id = request.session.get('customer_id')
+        if customer_id:
+            customer = Customer.objects.filter(pk=customer_id).first()
+            if customer:
+                return customer
+
+        if request.user.is_authenticated:
+            customer = Customer.objects.filter(user=request.user).first()
+            if customer:
+                return customer
+
+        phone_number = request.session.get('customer_phone')
+        if phone_number:
+            customer = self.by_phone(phone_number)
+            if customer:
+                request.session['customer_id'] = customer.pk
+                return customer
+        return None
+
+    async def afrom_request(self, request):
+        """Async from_request"""
+        customer_id = await request.session.aget('customer_id')
+        if customer_id:
+            customer = await Customer.objects.filter(pk=customer_id).afirst()
+            if customer:
+                return customer
+
+        user = await request.auser()
+        if user.is_authenticated:
+            customer = await Customer.objects.filter(user=user).afirst()
+            if customer:
+                return customer
+
+        phone_number = await request.session.aget('customer_phone')
+        if phone_number:
+            customer = await self.aby_phone(phone_number)
+            if customer:
+                await request.session.aset('customer_id', customer.pk)
+                return customer
+        return None
+
+    def remember(self, request, customer):
+        """Store the customer in the session so later requests resolve it by id"""
+        request.session['customer_id'] = customer.pk
+        request.session['customer_phone'] = customer.phone_e164 or customer.phone_number
+
+    async def aremember(self, request, customer):
+        """Async remember"""
+        await request.session.aset('customer_id', customer.pk)
+        await request.session.aset('customer_phone', customer.phone_e164 or customer.phone_number)
+
+
+resolver = CustomerResolver()
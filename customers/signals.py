@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .discounts import invalidate_rules
+from .models import Discount
+
+
+@receiver(post_save, sender=Discount)
+@receiver(post_delete, sender=Discount)
+def invalidate_discount_rules(sender, **kwargs):
+    """Any discount edit makes every process reload the compiled rules"""
+    invalidate_rules()
@@ -0,0 +1,117 @@
+"""
+Denormalized customer lifetime statistics.
+
+Customer.order_count, lifetime_spend, last_order_at and avg_order_value are
+recomputed for one customer with a single aggregate over that customer's
+orders whenever an order is delivered, fully paid, or leaves either state.
+Bulk status updates (see orders/kitchen.py) recompute all the customers they
+affect with one grouped aggregate.
+Recomputing instead of incrementing keeps the figures correct when the same
+transition is saved twice. The reconcile_customer_stats command fixes any
+drift in bulk.
+"""
+
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+
+from orders.models import Order
+
+from .models import Customer
+
+# Orders that count towards a customer's lifetime figures
+COMPLETED_ORDER = (Q(status='delivered') | Q(payment_status='paid')) & ~Q(status='cancelled')
+
+STATS_FIELDS = ['order_count', 'lifetime_spend', 'last_order_at', 'avg_order_value']
+
+EMPTY_STATS = {
+    'order_count': 0,
+    'lifetime_spend': Decimal('0'),
+    'last_order_at': None,
+    'avg_order_value': Decimal('0'),
+}
+
+
+def is_completed(status, payment_status):
+    """Python twin of COMPLETED_ORDER for an order's in-memory state"""
+    return status != 'cancelled' and (status == 'delivered' or payment_status == 'paid')
+
+
+def compute_stats(customer_ids):
+    """Return {customer_id: stats} for the given customers in one grouped query"""
+    rows = (
+        Order.objects.filter(COMPLETED_ORDER, customer_id__in=customer_ids)
+        .values('customer_id')
+        .annotate(
+            order_count=Count('id'),
+            lifetime_spend=Sum('final_amount'),
+            last_order_at=Max('created_at'),
+        )
+        .order_by()
+    )
+    stats = {customer_id: dict(EMPTY_STATS) for customer_id in customer_ids}
+    for row in rows:
+        count = row['order_count']
+        spend = row['lifetime_spend'] or Decimal('0')
+        stats[row['customer_id']] = {
+            'order_count': count,
+            'lifetime_spend': spend,
+            'last_order_at': row['last_order_at'],
+            'avg_order_value': (spend / count).quantize(Decimal('0.01')) if count else Decimal('0'),
+        }
+    return stats
+
+
+def refresh_customer_stats(customer_id):
+    """Recompute and store one customer's lifetime figures"""
+    Customer.objects.filter(pk=customer_id).update(**compute_stats([customer_id])[customer_id])
+
+
+def schedule_stats_refresh(customer_id):
+    """Refresh a customer's figures once the surrounding transaction commits"""
+    transaction.on_commit(lambda: refresh_customer_stats(customer_id))
+
+
+def refresh_many_customer_stats(customer_ids):
+    """Recompute and store several customers' lifetime figures with one aggregate and one bulk update"""
+    stats = compute_stats(customer_ids)
+    Customer.objects.bulk_update([Customer(pk=pk, **values) for pk, values in stats.items()], STATS_FIELDS)
+
+
+def schedule_many_stats_refresh(customer_ids):
+    """Refresh several customers' figures once the surrounding transaction commits (for bulk order updates)"""
+    customer_ids = sorted(set(customer_ids))
+    if customer_ids:
+        transaction.on_commit(lambda: refresh_many_customer_stats(customer_ids))
+
+
+def reconcile(batch_size=500):
+    """
+    Recompute every customer's figures in pk-ordered batches and save only the rows that drifted.
+    Returns (checked, fixed).
+    """
+    checked = fixed = 0
+    last_pk = 0
+    while True:
+        customers = list(
+            Customer.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', *STATS_FIELDS)[:batch_size]
+        )
+        if not customers:
+            break
+        last_pk = customers[-1].pk
+
+        stats = compute_stats([customer.pk for customer in customers])
+        drifted = []
+        for customer in customers:
+            values = stats[customer.pk]
+            if any(getattr(customer, field) != values[field] for field in STATS_FIELDS):
+                for field in STATS_FIELDS:
+                    setattr(customer, field, values[field])
+                drifted.append(customer)
+
+        if drifted:
+            Customer.objects.bulk_update(drifted, STATS_FIELDS)
+        checked += len(customers)
+        fixed += len(drifted)
+    return checked, fixed
@@ -1,3 +1,154 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from . import loyalty
+from .resolver import resolver
+from .models import Customer, PointsTransaction
+
+
+class CustomerTestCase(TestCase):
+    def create_customer(self, phone_number='09120000001', **fields):
+        user = User.objects.create_user(f'customer-{phone_number}')
+        return Customer.objects.create(user=user, phone_number=phone_number, **fields)
+
+
+class PointsLedgerTests(CustomerTestCase):
+    """The balance is the sum of the ledger, and a ledger entry is applied at most once"""
+
+    def setUp(self):
+        self.customer = self.create_customer()
+
+    def test_same_key_is_applied_once(self):
+        entry, created = loyalty.award_points(self.customer, 40, 'rating:1', 'rating')
+        again, created_again = loyalty.award_points(self.customer, 40, 'rating:1', 'rating')
+
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(again.pk, entry.pk)
+        self.assertEqual(PointsTransaction.objects.filter(customer=self.customer).count(), 1)
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.total_points, 40)
+
+    def test_deduction_below_zero_records_nothing(self):
+        loyalty.award_points(self.customer, 30, 'order:1', 'order')
+        with self.assertRaises(loyalty.InsufficientPoints):
+            loyalty.award_points(self.customer, -50, 'redemption:1', 'redemption')
+
+        self.assertFalse(PointsTransaction.objects.filter(idempotency_key='redemption:1').exists())
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.total_points, 30)
+
+    def test_recompute_balances_matches_the_ledger(self):
+        loyalty.award_points(self.customer, 1200, 'order:1', 'order')
+        loyalty.award_points(self.customer, -300, 'redemption:1', 'redemption')
+        Customer.objects.filter(pk=self.customer.pk).update(total_points=0, membership_level='regular')
+
+        loyalty.recompute_balances([self.customer.pk])
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.total_points, 900)
+        self.assertEqual(self.customer.membership_level, 'regular')
+
+
+class MembershipTierTests(CustomerTestCase):
+    """Tier thresholds are inclusive, in Python and in the SQL CASE alike"""
+
+    BOUNDARIES = [
+        (0, 'regular'), (999, 'regular'), (1000, 'silver'), (4999, 'silver'),
+        (5000, 'gold'), (9999, 'gold'), (10000, 'platinum'),
+    ]
+
+    def test_tier_for(self):
+        for points, level in self.BOUNDARIES:
+            with self.subTest(points=points):
+                self.assertEqual(loyalty.tier_for(points), level)
+
+    def test_next_tier(self):
+        self.assertEqual(loyalty.next_tier(999), ('silver', 1))
+        self.assertEqual(loyalty.next_tier(5000), ('platinum', 5000))
+        self.assertEqual(loyalty.next_tier(10000), (None, 0))
+
+    def test_award_moves_the_level_with_the_balance(self):
+        customer = self.create_customer()
+        loyalty.award_points(customer, 999, 'order:1', 'order')
+        self.assertEqual(customer.membership_level, 'regular')
+        loyalty.award_points(customer, 1, 'order:2', 'order')
+        self.assertEqual(customer.membership_level, 'silver')
+        loyalty.award_points(customer, -1, 'redemption:1', 'redemption')
+        self.assertEqual(customer.membership_level, 'regular')
+
+    def test_recalculate_tiers_only_touches_wrong_levels(self):
+        customers = {
+            points: self.create_customer(f'0912{points:07d}', total_points=points)
+            for points, _ in self.BOUNDARIES
+        }
+        Customer.objects.update(membership_level='regular')
+
+        changed = loyalty.recalculate_tiers(batch_size=2)
+        self.assertEqual(changed, sum(1 for _, level in self.BOUNDARIES if level != 'regular'))
+        for points, level in self.BOUNDARIES:
+            self.assertEqual(Customer.objects.get(pk=customers[points].pk).membership_level, level)
+        self.assertEqual(loyalty.recalculate_tiers(), 0)
+
+
+class PhoneNormalizationTests(CustomerTestCase):
+    """phone_e164 follows phone_number, and flagged duplicates can still be saved"""
+
+    def setUp(self):
+        self.owner = self.create_customer('09121234567')
+        duplicate = self.create_customer('09350000000')
+        # As left by migrations 0007 and 0009 for a legacy number in another format
+        Customer.objects.filter(pk=duplicate.pk).update(
+            phone_number='0912 123 4567', phone_e164=None, duplicate_of=self.owner,
+        )
+        self.duplicate = Customer.objects.get(pk=duplicate.pk)
+
+    def test_new_customer_gets_the_normalized_number(self):
+        self.assertEqual(self.owner.phone_e164, '+989121234567')
+
+    def test_saving_a_duplicate_keeps_it_flagged(self):
+        self.duplicate.address = 'Somewhere'
+        self.duplicate.save()
+        Customer.objects.get(pk=self.duplicate.pk).save(update_fields=['address'])
+
+        self.duplicate.refresh_from_db()
+        self.assertIsNone(self.duplicate.phone_e164)
+        self.assertEqual(self.duplicate.duplicate_of, self.owner)
+
+    def test_correcting_the_number_clears_the_flag(self):
+        self.duplicate.phone_number = '09351112233'
+        self.duplicate.save(update_fields=['phone_number'])
+
+        self.duplicate.refresh_from_db()
+        self.assertEqual(self.duplicate.phone_e164, '+989351112233')
+        self.assertIsNone(self.duplicate.duplicate_of)
+
+    def test_deferred_number_is_left_alone(self):
+        customer = Customer.objects.only('pk', 'address').get(pk=self.duplicate.pk)
+        customer.address = 'Elsewhere'
+        customer.save()
+        self.assertIsNone(Customer.objects.get(pk=self.duplicate.pk).phone_e164)
+
+
+class ResolverTests(CustomerTestCase):
+    """One stored phone format, one query per lookup, and no raw numbers in the logs"""
+
+    def test_new_customer_is_stored_in_the_national_form(self):
+        customer, created = resolver.get_or_create('+98 912 765 4321')
+        self.assertTrue(created)
+        self.assertEqual((customer.phone_number, customer.phone_e164), ('09127654321', '+989127654321'))
+
+        self.assertEqual(resolver.get_or_create('989127654321'), (customer, False))
+
+    def test_lookup_is_one_query(self):
+        customer = self.create_customer('09121234567')
+        with self.assertNumQueries(1):
+            self.assertEqual(resolver.by_phone('0912 123 4567'), customer)
+        with self.assertNumQueries(1):
+            self.assertEqual(resolver.by_phone('+989121234567'), customer)
+
+    def test_phone_modal_does_not_log_the_number(self):
+        with self.assertLogs('customers.views', 'DEBUG') as logs:
+            response = self.client.post(reverse('customers:submit_phone_number'), {'phone_number': '09127654321'})
+        self.assertTrue(response.json()['success'])
+        self.assertNotIn('7654321', '\n'.join(logs.output))
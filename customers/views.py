@@ -7,11 +7,18 @@ from django.db.models import Avg, Count, Q, Sum
 from django.http import JsonResponse
 from .models import Customer, Discount, CustomerRating
 from .forms import CustomerRegistrationForm, CustomerProfileForm, CustomerRatingForm, ManagementCustomerForm, ManagementCustomerRatingForm, ManagementDiscountForm
+from .discounts import available_discounts
+from .loyalty import next_tier, tier_requirements
+from .resolver import normalize_phone, resolver
 from staff.models import StaffLog
 from django.contrib.auth.models import User
 from orders.models import Order
+import logging
 import uuid
 from Dalooneh.decorators import superuser_required
+from Dalooneh.pagination import paginate_keyset
+
+logger = logging.getLogger(__name__)
 
 def register(request):
     if request.method == 'POST':
@@ -61,8 +68,8 @@ def profile(request):
     
     # Get customer statistics
     stats = {
-        'total_orders': customer.total_orders,
-        'total_spent': customer.total_spent,
+        'total_orders': customer.order_count,
+        'total_spent': customer.lifetime_spend,
         'average_rating': customer.ratings.aggregate(Avg('rating'))['rating__avg'] or 0,
         'membership_level': customer.get_membership_level_display(),
         'total_points': customer.total_points
@@ -81,9 +88,9 @@ def order_history(request):
     
     # Get order statistics
     stats = {
-        'total_orders': orders.count(),
-        'total_spent': sum(order.final_amount for order in orders),
-        'average_order_value': sum(order.final_amount for order in orders) / orders.count() if orders.exists() else 0
+        'total_orders': customer.order_count,
+        'total_spent': customer.lifetime_spend,
+        'average_order_value': customer.avg_order_value
     }
     
     return render(request, 'customers/order_history.html', {
@@ -94,11 +101,7 @@ def order_history(request):
 @login_required
 def discount_list(request):
     customer = request.user.customer
-    active_discounts = customer.discounts.filter(
-        is_active=True,
-        valid_from__lte=timezone.now(),
-        valid_to__gte=timezone.now()
-    )
+    active_discounts = available_discounts(customer)
     
     # Get membership benefits
     membership_benefits = {
@@ -134,12 +137,9 @@ def rate_order(request, order_id):
             rating = form.save(commit=False)
             rating.customer = customer
             rating.order = order
+            # Saving the rating awards its points (once, through the points ledger)
             rating.save()
             
-            # Add points based on rating
-            points = rating.rating * 10  # 10 points per star
-            customer.add_points(points)
-            
             messages.success(request, 'Your rating has been submitted successfully.')
             return redirect('customers:order_history')
     else:
@@ -154,21 +154,9 @@ def rate_order(request, order_id):
 def membership_details(request):
     customer = request.user.customer
     
-    # Get membership requirements
-    requirements = {
-        'silver': 1000,
-        'gold': 5000,
-        'platinum': 10000
-    }
-    
-    # Calculate progress to next level
-    next_level = None
-    points_needed = 0
-    for level, points in requirements.items():
-        if customer.total_points < points:
-            next_level = level
-            points_needed = points - customer.total_points
-            break
+    # Get membership requirements and progress to next level
+    requirements = tier_requirements()
+    next_level, points_needed = next_tier(customer.total_points)
     
     return render(request, 'customers/membership_details.html', {
         'customer': customer,
@@ -177,11 +165,10 @@ def membership_details(request):
         'requirements': requirements
     })
 
-def submit_phone_number(request):
+async def submit_phone_number(request):
     """Handle phone number submission from modal"""
     if request.method == 'POST':
         phone_number = request.POST.get('phone_number')
-        print(f"DEBUG: Received phone number: {phone_number}")
         
         # Validate phone number - Improved validation
         if not phone_number:
@@ -194,96 +181,51 @@ def submit_phone_number(request):
         phone_number = ''.join(filter(str.isdigit, phone_number))
         
         # Validate length after cleanup
-        if len(phone_number) < 10 or len(phone_number) > 15:
+        if len(phone_number) < 10 or len(phone_number) > 15 or not normalize_phone(phone_number):
             return JsonResponse({
                 'success': False,
                 'message': 'The entered number is not valid. Please enter the number correctly'
             })
         
         try:
-            # Check if a customer with this phone number already exists
-            customer = Customer.objects.filter(phone_number=phone_number).first()
+            # One indexed lookup for returning customers; concurrent first visits share one customer
+            customer, is_new = await resolver.aget_or_create(phone_number)
+            logger.debug("%s customer %s from the phone modal", 'New' if is_new else 'Existing', customer.id)
             
-            if not customer:
-                print(f"DEBUG: Creating new customer for number: {phone_number}")
-                # Create a new user with a simple username based on phone number
-                username = f"user_{phone_number}"
-                
-                # Create user without password
-                user = User.objects.create(
-                    username=username,
-                    email="",
-                    # No password required, just create the user
-                    # We'll set a non-usable password
-                    is_active=True
-                )
-                # Set a non-usable password
-                user.set_unusable_password()
-                user.save()
-                
-                try:
-                    # Create customer with phone number only
-                    customer = Customer.objects.create(
-                        user=user,
-                        phone_number=phone_number,
-                        national_code=None,  # No national code needed
-                        membership_level="regular",  # Set default membership level
-                        total_points=0
-                    )
-                    
-                    print(f"DEBUG: New customer created with ID: {customer.id}")
-                except Exception as create_error:
-                    # If customer creation fails, delete the user we just created
-                    user.delete()
-                    print(f"ERROR in customer creation: {str(create_error)}")
-                    return JsonResponse({
-                        'success': False,
-                        'message': 'There was a problem connecting to the server. Please try again'
-                    })
-                
-                # Associate with the current session
-                request.session['customer_id'] = customer.id
-                request.session['is_new_customer'] = True
-                
-                is_new = True
+            # Associate with the current session
+            await resolver.aremember(request, customer)
+            await request.session.aset('is_new_customer', is_new)
+            
+            if is_new:
                 message = 'Your number has been registered successfully. Thank you for choosing Dalooneh'
             else:
-                print(f"DEBUG: Existing customer found with ID: {customer.id}")
-                # Store customer ID in session
-                request.session['customer_id'] = customer.id
-                request.session['is_new_customer'] = False
-                
-                is_new = False
                 message = 'Welcome. Your number is registered in the system'
             
-            # Store the customer's phone number in the session for easy access
-            request.session['customer_phone'] = phone_number
-            
             # If there's an active table session, associate the customer with it
-            if 'table_token' in request.session:
+            table_token = await request.session.aget('table_token')
+            if table_token:
                 from tables.models import TableSession
                 try:
-                    session = TableSession.objects.get(token=request.session['table_token'])
-                    print(f"DEBUG: Associating customer with table session: {session.token}")
+                    session = await TableSession.objects.aget(token=table_token)
+                    logger.debug("Associating customer %s with table session %s", customer.id, session.token)
                     # You can add additional logic here to associate the customer with the table session
                 except TableSession.DoesNotExist:
-                    print("DEBUG: No active table session found")
+                    logger.debug("No active table session found")
             
             # Get previous orders if customer exists and has orders
             previous_orders = []
             if not is_new:
                 from orders.models import Order
                 orders = Order.objects.filter(customer=customer).order_by('-created_at')[:3]
-                if orders.exists():
-                    previous_orders = [
-                        {
-                            'id': order.id, 
-                            'number': order.order_number, 
-                            'date': order.created_at.strftime('%Y-%m-%d'), 
-                            'total': float(order.final_amount)
-                        } 
-                        for order in orders
-                    ]
+                previous_orders = [
+                    {
+                        'id': order.id, 
+                        'number': order.order_number, 
+                        'date': order.created_at.strftime('%Y-%m-%d'), 
+                        'total': float(order.final_amount)
+                    } 
+                    async for order in orders
+                ]
             
             return JsonResponse({
                 'success': True,
@@ -293,8 +235,8 @@ def submit_phone_number(request):
                 'message': message,
                 'previous_orders': previous_orders
             })
-        except Exception as e:
-            print(f"ERROR: Error creating/finding customer: {str(e)}")
+        except Exception:
+            logger.exception("Could not create or find the customer from the phone modal")
             return JsonResponse({
                 'success': False,
                 'message': 'There was a problem connecting to the server. Please try again'
@@ -343,7 +285,7 @@ def management_customer_list(request):
     search_query = request.GET.get('q')
     
     # Base queryset
-    customers = Customer.objects.all().select_related('user').order_by('-created_at')
+    customers = Customer.objects.all().select_related('user')
     
     # Apply filters
     if membership:
@@ -360,8 +302,11 @@ def management_customer_list(request):
             Q(national_code__icontains=search_query)
         )
     
+    page_obj = paginate_keyset(request, customers)
+    
     return render(request, 'customers/management/customer_list.html', {
-        'customers': customers,
+        'customers': page_obj.object_list,
+        'page_obj': page_obj,
         'filters': {
             'membership': membership,
             'is_active': is_active,
@@ -373,7 +318,7 @@ def management_customer_list(request):
 @login_required
 def management_customer_detail(request, customer_id):
     """Show customer details."""
-    customer = get_object_or_404(Customer, id=customer_id)
+    customer = get_object_or_404(Customer.objects.select_related('user'), id=customer_id)
     
     # Get related data
     orders = Order.objects.filter(customer=customer).order_by('-created_at')
@@ -433,7 +378,7 @@ def management_customer_add(request):
 @login_required
 def management_customer_edit(request, customer_id):
     """Edit an existing customer."""
-    customer = get_object_or_404(Customer, id=customer_id)
+    customer = get_object_or_404(Customer.objects.select_related('user'), id=customer_id)
     
     if request.method == 'POST':
         form = ManagementCustomerForm(request.POST, instance=customer)
@@ -540,7 +485,7 @@ def management_discount_add(request):
 @login_required
 def management_discount_edit(request, discount_id):
     """Edit an existing discount."""
-    discount = get_object_or_404(Discount, id=discount_id)
+    discount = get_object_or_404(Discount.objects.select_related('customer__user'), id=discount_id)
     
     if request.method == 'POST':
         form = ManagementDiscountForm(request.POST, instance=discount)
@@ -561,7 +506,7 @@ def management_discount_edit(request, discount_id):
 @login_required
 def management_discount_delete(request, discount_id):
     """Delete a discount."""
-    discount = get_object_or_404(Discount, id=discount_id)
+    discount = get_object_or_404(Discount.objects.select_related('customer__user'), id=discount_id)
     
     if request.method == 'POST':
         discount.delete()
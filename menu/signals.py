@@ -0,0 +1,15 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from Dalooneh.cache import menu as menu_cache
+
+from .models import Category, Product
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_menu_cache(sender, **kwargs):
+    """Cached menu pages are dropped whenever a category or product changes"""
+    menu_cache.invalidate()
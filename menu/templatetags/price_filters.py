@@ -0,0 +1,13 @@
+from django import template
+from django.contrib.humanize.templatetags.humanize import intcomma
+from django.template.defaultfilters import floatformat
+
+register = template.Library()
+
+
+@register.filter
+def price_in_thousand(value):
+    """Price with thousand separators, as shown in the cart (e.g. 1,250.00 USD)"""
+    if value in (None, ''):
+        return ''
+    return f'{intcomma(floatformat(value, 2))} USD'
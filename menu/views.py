@@ -1,8 +1,6 @@
 from django.shortcuts import render, get_object_or_404
 from django.views.generic import ListView, DetailView
-from django.views.decorators.cache import cache_page
-from django.core.cache import cache
-from django.db.models import Q
+from django.db.models import Count, Q
 from django.utils import timezone
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
@@ -11,9 +9,10 @@ from .models import Category, Product
 from tables.models import Table
 from .forms import CategoryForm, ProductForm
 from Dalooneh.decorators import superuser_required
+from Dalooneh.cache import menu as menu_cache
 from django.http import JsonResponse
 
-@cache_page(60 * 15)  # Cache for 15 minutes
+@menu_cache.cache_page(60 * 15)  # Cache for 15 minutes, or until the menu changes
 def category_list(request):
     categories = Category.objects.filter(is_active=True)
     
@@ -28,7 +27,7 @@ def category_list(request):
         'table': table
     })
 
-@cache_page(60 * 15)  # Cache for 15 minutes
+@menu_cache.cache_page(60 * 15)  # Cache for 15 minutes, or until the menu changes
 def public_category_list(request):
     """View for listing categories without requiring table authentication"""
     categories = Category.objects.filter(is_active=True)
@@ -47,7 +46,7 @@ def public_category_list(request):
         'table': table
     })
 
-@cache_page(60 * 15)  # Cache for 15 minutes
+@menu_cache.cache_page(60 * 15)  # Cache for 15 minutes, or until the menu changes
 def product_list(request, category_id):
     category = get_object_or_404(Category, id=category_id, is_active=True)
     
@@ -90,7 +89,7 @@ def product_list(request, category_id):
         }
     })
 
-@cache_page(60 * 15)  # Cache for 15 minutes
+@menu_cache.cache_page(60 * 15)  # Cache for 15 minutes, or until the menu changes
 def product_detail(request, product_id):
     product = get_object_or_404(Product, id=product_id, is_active=True)
     
@@ -124,9 +123,9 @@ class MenuView(ListView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # Get table info
-        table = None
-        if 'table_token' in self.request.session:
+        # Get table info (TableAuthMiddleware has already loaded it for a diner with a valid session)
+        table = getattr(self.request, 'table', None)
+        if table is None and 'table_token' in self.request.session:
             table = get_object_or_404(Table, id=self.request.session.get('table_id'))
         context['table'] = table
         
@@ -222,7 +221,7 @@ def management_dashboard(request):
 @login_required
 def management_category_list(request):
     """List all categories for management."""
-    categories = Category.objects.all().order_by('name')
+    categories = Category.objects.annotate(product_count=Count('products')).order_by('name')
     return render(request, 'menu/management/category_list.html', {'categories': categories})
 
 @superuser_required
@@ -291,11 +290,11 @@ def management_category_edit(request, category_id):
 @login_required
 def management_category_delete(request, category_id):
     """Delete a category."""
-    category = get_object_or_404(Category, id=category_id)
+    category = get_object_or_404(Category.objects.annotate(product_count=Count('products')), id=category_id)
     
     if request.method == 'POST':
         # Check if category has products
-        if category.products.exists():
+        if category.product_count:
             messages.error(request, 'Cannot delete a category that has products.')
             return redirect('menu:management_category_list')
         
@@ -318,7 +317,7 @@ def management_product_list(request):
     search_query = request.GET.get('q')
     
     # Base queryset
-    products = Product.objects.all().order_by('category', 'name')
+    products = Product.objects.select_related('category').order_by('category', 'name')
     
     # Apply filters
     if category_id:
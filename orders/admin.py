@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import Order, OrderItem, Payment
+from .models import Order, OrderItem, Payment, DailySalesSummary, OrderEvent
 from django import forms
 from django.shortcuts import redirect
 from django.urls import path
@@ -58,7 +58,7 @@ class OrderAdmin(admin.ModelAdmin):
     list_display = ['order_number', 'get_customer_phone', 'table', 'status', 'payment_status', 'total_amount', 'final_amount', 'created_at']
     list_filter = [PhoneNumberFilter, 'status', 'payment_status', 'created_at']
     search_fields = ['order_number', 'customer__phone_number', 'customer__user__first_name', 'customer__user__last_name']
-    readonly_fields = ['order_number', 'created_at', 'updated_at', 'get_customer_phone']
+    readonly_fields = ['order_number', 'amount_paid', 'created_at', 'updated_at', 'get_customer_phone']
     date_hierarchy = 'created_at'
     inlines = [OrderItemInline, PaymentInline]
     fieldsets = (
@@ -69,7 +69,7 @@ class OrderAdmin(admin.ModelAdmin):
             'fields': ('status', 'payment_status')
         }),
         ('Financial', {
-            'fields': ('total_amount', 'discount_amount', 'final_amount')
+            'fields': ('total_amount', 'discount_amount', 'final_amount', 'amount_paid')
         }),
         ('Notes', {
             'fields': ('notes',)
@@ -137,5 +137,19 @@ class OrderItemAdmin(admin.ModelAdmin):
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ['id', 'order', 'amount', 'payment_method', 'status', 'created_at']
     list_filter = ['payment_method', 'status', 'created_at']
-    search_fields = ['order__order_number', 'transaction_id', 'order__customer__phone_number']
-    readonly_fields = ['created_at', 'updated_at']
+    search_fields = ['order__order_number', 'transaction_id', 'idempotency_key', 'order__customer__phone_number']
+    readonly_fields = ['idempotency_key', 'created_at', 'updated_at']
+
+@admin.register(DailySalesSummary)
+class DailySalesSummaryAdmin(admin.ModelAdmin):
+    list_display = ['date', 'order_count', 'delivered_orders', 'cancelled_orders', 'revenue', 'discounts', 'item_count', 'cash_payments', 'card_payments', 'settled_at', 'updated_at']
+    date_hierarchy = 'date'
+    readonly_fields = ['settled_at', 'settlement', 'created_at', 'updated_at']
+
+@admin.register(OrderEvent)
+class OrderEventAdmin(admin.ModelAdmin):
+    list_display = ['order', 'action', 'old_status', 'new_status', 'staff', 'created_at']
+    list_filter = ['action', 'created_at']
+    search_fields = ['order__order_number']
+    raw_id_fields = ['order', 'staff']
+    readonly_fields = ['created_at']
@@ -0,0 +1,104 @@
+import json
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+from .kitchen import (
+    ALL_STATIONS, KITCHEN_GROUP, board, bump_orders, can_use_kitchen_display, load_tickets, recall_orders,
+    station_ticket,
+)
+
+
+class KitchenConsumer(AsyncWebsocketConsumer):
+    """
+    Kitchen display for one station.
+    Sends the station's open tickets on connect and incremental updates afterwards;
+    accepts bump/recall actions for one or many orders.
+    """
+
+    async def connect(self):
+        """
+        Join the kitchen group and send the current board
+        """
+        user = self.scope['user']
+        if not await database_sync_to_async(can_use_kitchen_display)(user):
+            await self.close()
+            return
+
+        self.station = self.scope['url_route']['kwargs'].get('station') or ALL_STATIONS
+
+        # Join the group before loading so no update is missed while the board is read
+        await self.channel_layer.group_add(KITCHEN_GROUP, self.channel_name)
+        board.displays += 1
+        if not board.loaded:
+            board.load(await database_sync_to_async(load_tickets)())
+
+        await self.accept()
+        await self.send(text_data=json.dumps({
+            'type': 'snapshot',
+            'station': self.station,
+            'tickets': board.tickets_for(self.station),
+        }))
+
+    async def disconnect(self, close_code):
+        """
+        Leave the kitchen group; drop the board when the last display in this process goes away
+        """
+        if not hasattr(self, 'station'):
+            return
+        await self.channel_layer.group_discard(KITCHEN_GROUP, self.channel_name)
+        board.displays -= 1
+        if board.displays <= 0:
+            # Nobody receives updates any more, so the board would go stale
+            board.displays = 0
+            board.reset()
+
+    async def receive(self, text_data):
+        """
+        Handle {"action": "bump" | "recall", "order_ids": [...]} from the display
+        """
+        try:
+            data = json.loads(text_data)
+            action = data.get('action')
+            order_ids = [int(order_id) for order_id in data.get('order_ids', [])]
+        except (ValueError, TypeError, AttributeError):
+            await self.send(text_data=json.dumps({'type': 'error', 'message': 'Invalid message.'}))
+            return
+
+        staff = getattr(self.scope['user'], 'staff', None)
+        if action == 'bump':
+            changed = await database_sync_to_async(bump_orders)(order_ids, staff)
+        elif action == 'recall':
+            changed = await database_sync_to_async(recall_orders)(order_ids, staff)
+        else:
+            await self.send(text_data=json.dumps({'type': 'error', 'message': 'Unknown action.'}))
+            return
+
+        # The tickets themselves arrive through kitchen_update like on every other display
+        await self.send(text_data=json.dumps({
+            'type': 'ack',
+            'action': action,
+            'order_ids': changed,
+        }))
+
+    async def kitchen_update(self, event):
+        """
+        Apply a ticket update to the board and forward the station's view of it
+        """
+        board.apply(event['tickets'], event['removed'])
+
+        tickets = []
+        removed = list(event['removed'])
+        for ticket in event['tickets']:
+            visible = station_ticket(ticket, self.station)
+            if visible is None:
+                # Still open, but nothing left for this station
+                removed.append(ticket['id'])
+            else:
+                tickets.append(visible)
+
+        if tickets or removed:
+            await self.send(text_data=json.dumps({
+                'type': 'update',
+                'tickets': tickets,
+                'removed': removed,
+            }))
@@ -0,0 +1,52 @@
+"""
+Per-order event history.
+
+Order status and payment status transitions are recorded automatically by
+orders.signals whenever an order is saved. To attribute a transition to a
+staff member, set ``order._changed_by`` (or ``payment._changed_by``) before
+saving. Edits, and bulk transitions done with ``update()``, are recorded
+explicitly with the helpers below.
+"""
+
+from .models import OrderEvent
+
+
+def staff_for(request):
+    """StaffUser behind a request, or None for customers and plain superusers"""
+    return getattr(request.user, 'staff', None)
+
+
+def order_event(order, action, staff=None, old_status='', new_status='', **data):
+    """One unsaved event of an order's history"""
+    return OrderEvent(
+        order=order,
+        staff=staff,
+        action=action,
+        old_status=old_status or '',
+        new_status=new_status or '',
+        data=data,
+    )
+
+
+def record_order_event(order, action, staff=None, old_status='', new_status='', **data):
+    """Append one event to an order's history"""
+    event = order_event(order, action, staff, old_status, new_status, **data)
+    event.save()
+    return event
+
+
+def record_order_events(events):
+    """Append several events built with ``order_event`` in one INSERT"""
+    if events:
+        OrderEvent.objects.bulk_create(events)
+
+
+def record_bulk_transition(transitions, staff=None):
+    """
+    Record status changes made with a single UPDATE.
+    ``transitions`` is a list of (order_id, old_status, new_status).
+    """
+    OrderEvent.objects.bulk_create([
+        OrderEvent(order_id=order_id, staff=staff, action='status_change', old_status=old_status, new_status=new_status)
+        for order_id, old_status, new_status in transitions
+    ])
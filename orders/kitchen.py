@@ -0,0 +1,221 @@
+"""
+Kitchen display board.
+
+Each ASGI process keeps the open tickets (confirmed and preparing orders with
+their items) in memory. The board is loaded from the database once, when the
+first display connects, and afterwards only changes through events pushed on
+the "kitchen" channel group: whenever an order enters, leaves or changes while
+in the kitchen, the affected tickets are read once and broadcast to every
+display. Displays never poll the database.
+
+Stations are menu categories; a station display only shows the items of its
+category. The "all" station shows every item (expo screen).
+"""
+
+import datetime
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models import Prefetch, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from customers.stats import is_completed, schedule_many_stats_refresh
+from tables.models import OPEN_ORDER_STATUSES
+
+from .events import record_bulk_transition
+from .models import Order, OrderItem
+from .rollups import business_day, schedule_refresh
+
+logger = logging.getLogger(__name__)
+
+KITCHEN_GROUP = 'kitchen'
+ALL_STATIONS = 'all'
+
+# Orders shown on the kitchen display
+KITCHEN_STATUSES = ('confirmed', 'preparing')
+
+# Bump moves a ticket one step forward, recall brings a ready ticket back
+BUMP_TRANSITIONS = {'confirmed': 'preparing', 'preparing': 'ready'}
+RECALL_TRANSITIONS = {'ready': 'preparing'}
+# Freeing a table cancels every order that is still open on it
+CANCEL_TRANSITIONS = {status: 'cancelled' for status in OPEN_ORDER_STATUSES}
+
+
+def can_use_kitchen_display(user):
+    """Kitchen displays are open to superusers and staff accounts"""
+    return user.is_authenticated and (user.is_superuser or user.is_staff or hasattr(user, 'staff'))
+
+
+def build_ticket(order):
+    """Serialize an order (with prefetched items) into a display ticket"""
+    items = []
+    preparation_time = 0
+    for item in order.items.all():
+        product = item.product
+        preparation_time = max(preparation_time, product.preparation_time or 0)
+        items.append({
+            'id': item.id,
+            'product': product.name,
+            'quantity': item.quantity,
+            'notes': item.notes,
+            'station': product.category.slug,
+            'preparation_time': product.preparation_time,
+        })
+
+    return {
+        'id': order.id,
+        'order_number': order.order_number,
+        'table': str(order.table.number) if order.table_id else '',
+        'status': order.status,
+        'notes': order.notes,
+        'created_at': order.created_at.isoformat(),
+        'due_at': (order.created_at + datetime.timedelta(minutes=preparation_time)).isoformat(),
+        'items': items,
+    }
+
+
+def load_tickets(order_ids=None):
+    """Read kitchen tickets in three queries (orders, items, products with categories)"""
+    orders = (
+        Order.objects.filter(status__in=KITCHEN_STATUSES)
+        .select_related('table')
+        .prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('product__category').order_by('id'))
+        )
+        .order_by('created_at', 'id')
+    )
+    if order_ids is not None:
+        orders = orders.filter(id__in=order_ids)
+    return [build_ticket(order) for order in orders]
+
+
+def station_ticket(ticket, station):
+    """Ticket as seen by one station, or None if the station has nothing to cook on it"""
+    if station == ALL_STATIONS:
+        return ticket
+    items = [item for item in ticket['items'] if item['station'] == station]
+    if not items:
+        return None
+    return dict(ticket, items=items)
+
+
+class KitchenBoard:
+    """In-memory, per-process set of open tickets keyed by order id"""
+
+    def __init__(self):
+        self.tickets = {}
+        self.loaded = False
+        self.displays = 0
+
+    def load(self, tickets):
+        self.tickets = {ticket['id']: ticket for ticket in tickets}
+        self.loaded = True
+
+    def reset(self):
+        self.tickets = {}
+        self.loaded = False
+
+    def apply(self, tickets, removed):
+        """Apply an update event. Idempotent, since every display in the process receives it."""
+        for order_id in removed:
+            self.tickets.pop(order_id, None)
+        for ticket in tickets:
+            self.tickets[ticket['id']] = ticket
+
+    def tickets_for(self, station):
+        """Open tickets for a station, oldest first"""
+        tickets = sorted(self.tickets.values(), key=lambda ticket: (ticket['created_at'], ticket['id']))
+        return [t for t in (station_ticket(ticket, station) for ticket in tickets) if t is not None]
+
+
+board = KitchenBoard()
+
+
+def publish_orders(order_ids):
+    """Broadcast the current state of the given orders to every kitchen display"""
+    order_ids = set(order_ids)
+    if not order_ids:
+        return
+    tickets = load_tickets(order_ids)
+    removed = sorted(order_ids - {ticket['id'] for ticket in tickets})
+
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(
+            KITCHEN_GROUP,
+            {
+                'type': 'kitchen_update',
+                'tickets': tickets,
+                'removed': removed,
+            }
+        )
+    except Exception as e:
+        # A down channel layer must never break order processing
+        logger.error(f"Error publishing kitchen update: {str(e)}", exc_info=True)
+
+
+def schedule_publish(order_ids):
+    """Publish kitchen updates once the surrounding transaction commits"""
+    order_ids = list(order_ids)
+    transaction.on_commit(lambda: publish_orders(order_ids))
+
+
+def _transition(order_ids, transitions, staff=None):
+    """
+    Move every listed order along ``transitions`` with one UPDATE per target status.
+    Orders that are not in a source status are left alone. Returns the changed ids.
+    """
+    changed = set()
+    events = []
+    with transaction.atomic():
+        orders = list(
+            Order.objects.select_for_update()
+            .filter(id__in=order_ids, status__in=list(transitions))
+            .values_list('id', 'status', 'created_at', 'payment_status', 'customer_id')
+        )
+        now = timezone.now()
+        for target in dict.fromkeys(transitions.values()):
+            sources = [source for source, to in transitions.items() if to == target]
+            moved = [(order_id, status) for order_id, status, *_ in orders if status in sources]
+            if moved:
+                timestamp_field = Order.STATUS_TIMESTAMP_FIELDS[target]
+                Order.objects.filter(id__in=[order_id for order_id, _ in moved], status__in=sources).update(
+                    status=target,
+                    updated_at=now,
+                    **{timestamp_field: Coalesce(timestamp_field, Value(now))}
+                )
+                changed.update(order_id for order_id, _ in moved)
+                events.extend((order_id, status, target) for order_id, status in moved)
+
+        # update() skips post_save, so keep the history, the rollup, the customer figures and the displays in sync here
+        record_bulk_transition(events, staff)
+        for day in {business_day(created_at) for order_id, _, created_at, *_ in orders if order_id in changed}:
+            schedule_refresh(day)
+        # e.g. cancelling a paid order takes it out of its customer's lifetime figures
+        schedule_many_stats_refresh(
+            customer_id for order_id, status, _, payment_status, customer_id in orders
+            if order_id in changed and customer_id
+            and is_completed(status, payment_status) != is_completed(transitions[status], payment_status)
+        )
+        schedule_publish(changed)
+    return sorted(changed)
+
+
+def bump_orders(order_ids, staff=None):
+    """Advance tickets: confirmed -> preparing, preparing -> ready"""
+    return _transition(order_ids, BUMP_TRANSITIONS, staff)
+
+
+def recall_orders(order_ids, staff=None):
+    """Bring bumped (ready) tickets back onto the display"""
+    return _transition(order_ids, RECALL_TRANSITIONS, staff)
+
+
+def cancel_orders(order_ids, staff=None):
+    """Cancel open orders (e.g. when their table is freed), taking their tickets off the display"""
+    return _transition(order_ids, CANCEL_TRANSITIONS, staff)
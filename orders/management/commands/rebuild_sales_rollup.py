@@ -0,0 +1,64 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+
+from orders.models import Order, Payment
+from orders.rollups import business_day, rebuild_range
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily sales rollup table from order and payment history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--from',
+            dest='date_from',
+            help='First business day to rebuild (YYYY-MM-DD, default: first order)',
+        )
+        parser.add_argument(
+            '--to',
+            dest='date_to',
+            help='Last business day to rebuild (YYYY-MM-DD, default: yesterday; the current day is never stored)',
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            help='Only rebuild the last N business days',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            date_to = self._parse(options['date_to'])
+            date_from = self._parse(options['date_from'])
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+
+        # The current business day is computed live by summarize()
+        yesterday = business_day() - datetime.timedelta(days=1)
+        date_to = min(date_to or yesterday, yesterday)
+
+        if options['days']:
+            date_from = date_to - datetime.timedelta(days=options['days'] - 1)
+
+        if not date_from:
+            first = min(
+                filter(None, [
+                    Order.objects.aggregate(first=Min('created_at'))['first'],
+                    Payment.objects.aggregate(first=Min('created_at'))['first'],
+                ]),
+                default=None,
+            )
+            if first is None:
+                self.stdout.write('No orders or payments found, nothing to rebuild')
+                return
+            date_from = business_day(first)
+
+        self.stdout.write(f'Rebuilding sales rollup from {date_from} to {date_to}')
+        count = rebuild_range(date_from, date_to)
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt {count} daily summaries'))
+
+    def _parse(self, value):
+        if not value:
+            return None
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
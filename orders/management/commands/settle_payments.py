@@ -0,0 +1,41 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.payments import settle_day
+from orders.rollups import business_day
+
+
+class Command(BaseCommand):
+    help = 'Settle a business day: reconcile paid amounts and lock its sales rollup row'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--date',
+            help='Business day to settle (YYYY-MM-DD, default: the previous business day)',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Settle the day again even if it is already settled',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            day = self._parse(options['date']) or business_day() - datetime.timedelta(days=1)
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+
+        self.stdout.write(f'Settling business day {day}')
+        summary = settle_day(day, force=options['force'])
+        settlement = summary.settlement
+        self.stdout.write(
+            f'Revenue {summary.revenue}, cash {summary.cash_payments}, card {summary.card_payments}, '
+            f'{settlement.get("reconciled_orders", 0)} order(s) reconciled'
+        )
+        self.stdout.write(self.style.SUCCESS(f'Business day {day} settled at {summary.settled_at}'))
+
+    def _parse(self, value):
+        if not value:
+            return None
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
@@ -0,0 +1,139 @@
+"""
+Service-time metrics from the per-status order timestamps.
+
+Stage durations are bucketed by the hour the order was confirmed (when it
+reached the kitchen) and summarized as p50/p95. The rows are selected with a
+range on the indexed confirmed_at column. On PostgreSQL the percentiles are
+computed in the database with PERCENTILE_CONT; other backends fetch only the
+timestamp columns for the range and compute them in Python.
+"""
+
+import datetime
+
+from django.db import connections
+from django.db.models import Aggregate, Count, DurationField, ExpressionWrapper, F
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import Order
+from .rollups import business_day_bounds
+
+# (name, start field, end field)
+SERVICE_STAGES = [
+    ('confirmed_to_preparing', 'confirmed_at', 'preparing_at'),
+    ('preparing_to_ready', 'preparing_at', 'ready_at'),
+    ('ready_to_delivered', 'ready_at', 'delivered_at'),
+    ('confirmed_to_ready', 'confirmed_at', 'ready_at'),
+    ('confirmed_to_delivered', 'confirmed_at', 'delivered_at'),
+]
+
+PERCENTILES = {'p50': 0.5, 'p95': 0.95}
+
+
+class PercentileCont(Aggregate):
+    """PostgreSQL PERCENTILE_CONT(fraction) WITHIN GROUP (ORDER BY expression)"""
+    function = 'PERCENTILE_CONT'
+    template = '%(function)s(%(fraction)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+
+    def __init__(self, expression, fraction, **extra):
+        super().__init__(expression, fraction=float(fraction), **extra)
+
+
+def percentile(values, fraction):
+    """Linear-interpolated percentile of a sorted list (same definition as PERCENTILE_CONT)"""
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def _summary(durations):
+    durations = sorted(durations)
+    summary = {'count': len(durations)}
+    for name, fraction in PERCENTILES.items():
+        value = percentile(durations, fraction)
+        summary[name] = round(value, 1) if value is not None else None
+    return summary
+
+
+def _duration(start, end):
+    return ExpressionWrapper(F(end) - F(start), output_field=DurationField())
+
+
+def _confirmed_orders(start, end):
+    return Order.objects.filter(confirmed_at__gte=start, confirmed_at__lt=end)
+
+
+def _postgresql_stage_hours(orders):
+    """{hour: {stage: summary}} with the percentiles computed by PostgreSQL"""
+    hours = {}
+    for stage, start_field, end_field in SERVICE_STAGES:
+        aggregates = {'count': Count('id')}
+        for name, fraction in PERCENTILES.items():
+            aggregates[name] = PercentileCont(_duration(start_field, end_field), fraction, output_field=DurationField())
+        rows = (
+            orders.filter(**{f'{start_field}__isnull': False, f'{end_field}__isnull': False})
+            .annotate(hour=TruncHour('confirmed_at'))
+            .values('hour')
+            .annotate(**aggregates)
+            .order_by()
+        )
+        for row in rows:
+            hours.setdefault(row['hour'], {})[stage] = {
+                'count': row['count'],
+                **{name: round(row[name].total_seconds(), 1) for name in PERCENTILES},
+            }
+    return hours
+
+
+def _python_stage_hours(orders):
+    """{hour: {stage: summary}} computed from the timestamp columns of the range"""
+    fields = ['confirmed_at', 'preparing_at', 'ready_at', 'delivered_at']
+    durations = {}
+    for row in orders.values(*fields).order_by().iterator(chunk_size=2000):
+        hour = timezone.localtime(row['confirmed_at']).replace(minute=0, second=0, microsecond=0)
+        for stage, start_field, end_field in SERVICE_STAGES:
+            if row[start_field] and row[end_field]:
+                seconds = (row[end_field] - row[start_field]).total_seconds()
+                durations.setdefault(hour, {}).setdefault(stage, []).append(seconds)
+    return {
+        hour: {stage: _summary(values) for stage, values in stages.items()}
+        for hour, stages in durations.items()
+    }
+
+
+def service_times(date_from, date_to=None):
+    """
+    p50/p95 stage durations (in seconds) per hour for orders confirmed in the
+    given business days, plus the order count per hour.
+    """
+    start, end = business_day_bounds(date_from, date_to)
+    orders = _confirmed_orders(start, end)
+
+    if connections[orders.db].vendor == 'postgresql':
+        stage_hours = _postgresql_stage_hours(orders)
+    else:
+        stage_hours = _python_stage_hours(orders)
+
+    counts = {
+        row['hour']: row['orders']
+        for row in orders.annotate(hour=TruncHour('confirmed_at')).values('hour').annotate(orders=Count('id')).order_by()
+    }
+
+    hours = []
+    for hour in sorted(set(counts) | set(stage_hours)):
+        stages = stage_hours.get(hour, {})
+        hours.append({
+            'hour': hour,
+            'orders': counts.get(hour, 0),
+            'stages': {stage: stages.get(stage) for stage, _, _ in SERVICE_STAGES},
+        })
+
+    return {
+        'from': start,
+        'to': end,
+        'stages': [stage for stage, _, _ in SERVICE_STAGES],
+        'hours': hours,
+    }
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_order_payment_created_id_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='Business Day')),
+                ('order_count', models.PositiveIntegerField(default=0, verbose_name='Order Count')),
+                ('pending_orders', models.PositiveIntegerField(default=0, verbose_name='Pending Orders')),
+                ('confirmed_orders', models.PositiveIntegerField(default=0, verbose_name='Confirmed Orders')),
+                ('preparing_orders', models.PositiveIntegerField(default=0, verbose_name='Preparing Orders')),
+                ('ready_orders', models.PositiveIntegerField(default=0, verbose_name='Ready Orders')),
+                ('delivered_orders', models.PositiveIntegerField(default=0, verbose_name='Delivered Orders')),
+                ('cancelled_orders', models.PositiveIntegerField(default=0, verbose_name='Cancelled Orders')),
+                ('unpaid_orders', models.PositiveIntegerField(default=0, verbose_name='Unpaid Orders')),
+                ('partially_paid_orders', models.PositiveIntegerField(default=0, verbose_name='Partially Paid Orders')),
+                ('paid_orders', models.PositiveIntegerField(default=0, verbose_name='Paid Orders')),
+                ('refunded_orders', models.PositiveIntegerField(default=0, verbose_name='Refunded Orders')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Revenue')),
+                ('discounts', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Discounts')),
+                ('item_count', models.PositiveIntegerField(default=0, verbose_name='Items Sold')),
+                ('payment_count', models.PositiveIntegerField(default=0, verbose_name='Payment Count')),
+                ('cash_payments', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Cash Payments')),
+                ('card_payments', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Card Payments')),
+                ('refunded_payments', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Refunded Payments')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Daily Sales Summary',
+                'verbose_name_plural': 'Daily Sales Summaries',
+                'ordering': ['-date'],
+            },
+        ),
+    ]
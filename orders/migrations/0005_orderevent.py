@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:40
+
+import django.core.serializers.json
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_dailysalessummary'),
+        ('staff', '0005_stafflog_created_at_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('created', 'Order Created'), ('status_change', 'Status Changed'), ('payment_status_change', 'Payment Status Changed'), ('payment', 'Payment Recorded'), ('edit', 'Order Edited')], max_length=30, verbose_name='Action')),
+                ('old_status', models.CharField(blank=True, max_length=20, verbose_name='Old Status')),
+                ('new_status', models.CharField(blank=True, max_length=20, verbose_name='New Status')),
+                ('data', models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Details')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='orders.order', verbose_name='Order')),
+                ('staff', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_events', to='staff.staffuser', verbose_name='Staff Member')),
+            ],
+            options={
+                'verbose_name': 'Order Event',
+                'verbose_name_plural': 'Order Events',
+                'ordering': ['created_at', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='orderevent',
+            index=models.Index(fields=['order', 'created_at'], name='orderevent_order_created_idx'),
+        ),
+    ]
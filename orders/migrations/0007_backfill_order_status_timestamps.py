@@ -0,0 +1,95 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:32
+
+import re
+
+from django.db import migrations, transaction
+from django.db.models import Min
+
+BATCH_SIZE = 1000
+
+STATUS_TIMESTAMP_FIELDS = {
+    'confirmed': 'confirmed_at',
+    'preparing': 'preparing_at',
+    'ready': 'ready_at',
+    'delivered': 'delivered_at',
+    'cancelled': 'cancelled_at',
+}
+
+# Written by the status views before OrderEvent existed
+STATUS_LOG_PATTERN = re.compile(r'Order (\S+) status changed from (\w+) to (\w+)')
+
+
+def _keep_earliest(stamps, status, value):
+    if status in STATUS_TIMESTAMP_FIELDS and (status not in stamps or value < stamps[status]):
+        stamps[status] = value
+
+
+def backfill_status_timestamps(apps, schema_editor):
+    Order = apps.get_model('orders', 'Order')
+    OrderEvent = apps.get_model('orders', 'OrderEvent')
+    StaffLog = apps.get_model('staff', 'StaffLog')
+
+    # Older transitions only exist as staff log text; read it once, streamed
+    logged = {}
+    log_rows = StaffLog.objects.filter(
+        action__in=['order_status_change', 'order_status_update']
+    ).values_list('details', 'created_at').iterator(chunk_size=BATCH_SIZE)
+    for details, created_at in log_rows:
+        match = STATUS_LOG_PATTERN.search(details)
+        if match:
+            order_number, _, new_status = match.groups()
+            _keep_earliest(logged.setdefault(order_number, {}), new_status, created_at)
+
+    fields = list(STATUS_TIMESTAMP_FIELDS.values())
+    last_pk = 0
+    while True:
+        # One short transaction per chunk so the table is never locked for the whole backfill
+        with transaction.atomic():
+            orders = list(
+                Order.objects.filter(pk__gt=last_pk)
+                .order_by('pk')
+                .only('pk', 'order_number', 'status', 'updated_at', *fields)[:BATCH_SIZE]
+            )
+            if not orders:
+                break
+            last_pk = orders[-1].pk
+
+            recorded = {}
+            events = (
+                OrderEvent.objects.filter(order_id__in=[order.pk for order in orders], action='status_change')
+                .values('order_id', 'new_status')
+                .annotate(first_at=Min('created_at'))
+                .order_by()
+            )
+            for event in events:
+                _keep_earliest(recorded.setdefault(event['order_id'], {}), event['new_status'], event['first_at'])
+
+            for order in orders:
+                stamps = dict(logged.get(order.order_number, {}))
+                for status, value in recorded.get(order.pk, {}).items():
+                    _keep_earliest(stamps, status, value)
+                # Without any history the last update is the best guess for the current status
+                if order.status in STATUS_TIMESTAMP_FIELDS and order.status not in stamps:
+                    stamps[order.status] = order.updated_at
+
+                for status, value in stamps.items():
+                    field = STATUS_TIMESTAMP_FIELDS[status]
+                    if getattr(order, field) is None:
+                        setattr(order, field, value)
+
+            Order.objects.bulk_update(orders, fields)
+
+
+class Migration(migrations.Migration):
+
+    # Each chunk commits on its own
+    atomic = False
+
+    dependencies = [
+        ('orders', '0006_order_status_timestamps'),
+        ('staff', '0005_stafflog_created_at_default'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_status_timestamps, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Q
+
+BATCH_SIZE = 500
+
+# Placeholder customers created for diners who never gave a phone number
+PLACEHOLDER_CUSTOMERS = (
+    Q(user__username__startswith='temp_', phone_number__startswith='temp_')
+    | Q(user__username='anonymous', phone_number='00000000000')
+    | Q(user__username='anonymous_customer', phone_number='anonymous')
+)
+
+
+def collapse_placeholder_customers(apps, schema_editor):
+    """Turn orders of placeholder customers into guest orders and delete the placeholder customers and users"""
+    Customer = apps.get_model('customers', 'Customer')
+    Order = apps.get_model('orders', 'Order')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+
+    placeholders = Customer.objects.filter(PLACEHOLDER_CUSTOMERS, user__is_staff=False, user__is_superuser=False)
+    while True:
+        rows = list(placeholders.order_by('pk').values_list('pk', 'user_id')[:BATCH_SIZE])
+        if not rows:
+            break
+        customer_ids = [customer_id for customer_id, _ in rows]
+        Order.objects.filter(customer_id__in=customer_ids).update(customer=None)
+        Customer.objects.filter(pk__in=customer_ids).delete()
+        User.objects.filter(pk__in=[user_id for _, user_id in rows]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0007_customer_phone_e164'),
+        ('orders', '0007_backfill_order_status_timestamps'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='customer',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='customers.customer', verbose_name='Customer'),
+        ),
+        migrations.RunPython(collapse_placeholder_customers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_order_guest_customer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='discount_code',
+            field=models.CharField(blank=True, max_length=20, verbose_name='Discount Code'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:35
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 1000
+
+
+def backfill_amount_paid(apps, schema_editor):
+    Order = apps.get_model('orders', 'Order')
+    Payment = apps.get_model('orders', 'Payment')
+    completed = (
+        Payment.objects.filter(order=OuterRef('pk'), status='completed')
+        .values('order')
+        .annotate(total=Sum('amount'))
+        .values('total')[:1]
+    )
+    amount_paid = Coalesce(Subquery(completed), Value(Decimal('0')), output_field=DecimalField(max_digits=10, decimal_places=2))
+
+    last_pk = 0
+    while True:
+        pks = list(Order.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:BATCH_SIZE])
+        if not pks:
+            break
+        last_pk = pks[-1]
+        Order.objects.filter(pk__in=pks).update(amount_paid=amount_paid)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0009_order_discount_code'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='amount_paid',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Amount Paid'),
+        ),
+        migrations.RunPython(backfill_amount_paid, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:10
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0010_order_amount_paid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True, verbose_name='Idempotency Key'),
+        ),
+        migrations.AddField(
+            model_name='dailysalessummary',
+            name='settled_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Settled At'),
+        ),
+        migrations.AddField(
+            model_name='dailysalessummary',
+            name='settlement',
+            field=models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Settlement'),
+        ),
+    ]
@@ -0,0 +1,163 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:05
+
+import datetime
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, DateTimeField, ExpressionWrapper, F, Min, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+# Frozen copy of orders.rollups.compute_range as of this migration
+
+BUSINESS_DAY_START_HOUR = getattr(settings, 'BUSINESS_DAY_START_HOUR', 0)
+
+ORDER_STATUS_FIELDS = {
+    'pending': 'pending_orders',
+    'confirmed': 'confirmed_orders',
+    'preparing': 'preparing_orders',
+    'ready': 'ready_orders',
+    'delivered': 'delivered_orders',
+    'cancelled': 'cancelled_orders',
+}
+
+PAYMENT_STATUS_FIELDS = {
+    'pending': 'unpaid_orders',
+    'partial': 'partially_paid_orders',
+    'paid': 'paid_orders',
+    'refunded': 'refunded_orders',
+}
+
+PLACED_ORDER = ~Q(status__in=['pending', 'cancelled'])
+
+SUMMARY_FIELDS = (
+    ['order_count']
+    + list(ORDER_STATUS_FIELDS.values())
+    + list(PAYMENT_STATUS_FIELDS.values())
+    + ['revenue', 'discounts', 'item_count', 'payment_count', 'cash_payments', 'card_payments', 'refunded_payments']
+)
+
+
+def _business_day(value):
+    return timezone.localtime(value - datetime.timedelta(hours=BUSINESS_DAY_START_HOUR)).date()
+
+
+def _bounds(date_from, date_to):
+    start_time = datetime.time(hour=BUSINESS_DAY_START_HOUR)
+    start = timezone.make_aware(datetime.datetime.combine(date_from, start_time))
+    end = timezone.make_aware(datetime.datetime.combine(date_to + datetime.timedelta(days=1), start_time))
+    return start, end
+
+
+def _day_of(field):
+    expression = F(field)
+    if BUSINESS_DAY_START_HOUR:
+        expression = ExpressionWrapper(
+            F(field) - datetime.timedelta(hours=BUSINESS_DAY_START_HOUR),
+            output_field=DateTimeField(),
+        )
+    return TruncDate(expression)
+
+
+def _compute_range(apps, date_from, date_to):
+    Order = apps.get_model('orders', 'Order')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    Payment = apps.get_model('orders', 'Payment')
+
+    start, end = _bounds(date_from, date_to)
+    results = {}
+
+    def row(day):
+        if day not in results:
+            results[day] = {field: 0 for field in SUMMARY_FIELDS}
+        return results[day]
+
+    order_aggregates = {
+        'order_count': Count('id'),
+        'revenue': Sum('final_amount', filter=PLACED_ORDER),
+        'discounts': Sum('discount_amount', filter=PLACED_ORDER),
+    }
+    for status, field in ORDER_STATUS_FIELDS.items():
+        order_aggregates[field] = Count('id', filter=Q(status=status))
+    for status, field in PAYMENT_STATUS_FIELDS.items():
+        order_aggregates[field] = Count('id', filter=Q(payment_status=status))
+
+    orders = (
+        Order.objects.filter(created_at__gte=start, created_at__lt=end)
+        .annotate(day=_day_of('created_at'))
+        .values('day')
+        .annotate(**order_aggregates)
+        .order_by()
+    )
+    for values in orders:
+        day = values.pop('day')
+        row(day).update({field: value or 0 for field, value in values.items()})
+
+    items = (
+        OrderItem.objects.filter(order__created_at__gte=start, order__created_at__lt=end)
+        .filter(~Q(order__status__in=['pending', 'cancelled']))
+        .annotate(day=_day_of('order__created_at'))
+        .values('day')
+        .annotate(quantity=Sum('quantity'))
+        .order_by()
+    )
+    for values in items:
+        row(values['day'])['item_count'] = values['quantity'] or 0
+
+    completed = Q(status='completed')
+    payments = (
+        Payment.objects.filter(created_at__gte=start, created_at__lt=end)
+        .annotate(day=_day_of('created_at'))
+        .values('day')
+        .annotate(
+            payment_count=Count('id', filter=completed),
+            cash_payments=Sum('amount', filter=completed & Q(payment_method='cash')),
+            card_payments=Sum('amount', filter=completed & Q(payment_method='card')),
+            refunded_payments=Sum('amount', filter=Q(status='refunded')),
+        )
+        .order_by()
+    )
+    for values in payments:
+        day = values.pop('day')
+        row(day).update({field: value or 0 for field, value in values.items()})
+
+    return results
+
+
+def backfill_closed_days(apps, schema_editor):
+    """Store every closed business day, so summarize() only has to compute the current one"""
+    Order = apps.get_model('orders', 'Order')
+    Payment = apps.get_model('orders', 'Payment')
+    DailySalesSummary = apps.get_model('orders', 'DailySalesSummary')
+
+    first = min(
+        filter(None, [
+            Order.objects.aggregate(first=Min('created_at'))['first'],
+            Payment.objects.aggregate(first=Min('created_at'))['first'],
+        ]),
+        default=None,
+    )
+    yesterday = _business_day(timezone.now()) - datetime.timedelta(days=1)
+    if first is None or _business_day(first) > yesterday:
+        return
+
+    figures = _compute_range(apps, _business_day(first), yesterday)
+    rows = DailySalesSummary.objects.filter(date__lte=yesterday)
+    for day in rows.filter(settled_at__isnull=False).values_list('date', flat=True):
+        figures.pop(day, None)
+    rows.filter(settled_at__isnull=True).delete()
+    DailySalesSummary.objects.bulk_create(
+        [DailySalesSummary(date=day, **values) for day, values in sorted(figures.items())],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0011_payment_idempotency_settlement'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_closed_days, migrations.RunPython.noop),
+    ]
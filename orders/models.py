@@ -1,6 +1,15 @@
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
 from django.db import models, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.lookups import GreaterThan, GreaterThanOrEqual
+from django.db.models.signals import post_save
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 from menu.models import Product
+from customers.discounts import best_discount
 from customers.models import Customer
 from tables.models import Table
 
@@ -21,22 +30,46 @@ class Order(models.Model):
         ('refunded', 'Refunded'),
     ]
 
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='orders', verbose_name='Customer')
+    # Empty for guest orders from diners who did not give a phone number
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, null=True, blank=True, related_name='orders', verbose_name='Customer')
     table = models.ForeignKey(Table, on_delete=models.PROTECT, related_name='orders', verbose_name='Table')
     order_number = models.CharField(max_length=20, unique=True, verbose_name='Order Number')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='Status')
     payment_status = models.CharField(max_length=20, choices=PAYMENT_STATUS_CHOICES, default='pending', verbose_name='Payment Status')
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Total Amount')
     discount_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Discount Amount')
+    # Code entered by the customer; automatic discounts are re-evaluated against it as the cart changes
+    discount_code = models.CharField(max_length=20, blank=True, verbose_name='Discount Code')
     final_amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Final Amount')
+    # Sum of completed payments, kept in step by Payment.save() and Payment.delete()
+    amount_paid = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Amount Paid')
     notes = models.TextField(blank=True, verbose_name='Notes')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Set the first time the order reaches each status (see STATUS_TIMESTAMP_FIELDS)
+    confirmed_at = models.DateTimeField(null=True, blank=True, verbose_name='Confirmed At')
+    preparing_at = models.DateTimeField(null=True, blank=True, verbose_name='Preparing At')
+    ready_at = models.DateTimeField(null=True, blank=True, verbose_name='Ready At')
+    delivered_at = models.DateTimeField(null=True, blank=True, verbose_name='Delivered At')
+    cancelled_at = models.DateTimeField(null=True, blank=True, verbose_name='Cancelled At')
+
+    STATUS_TIMESTAMP_FIELDS = {
+        'confirmed': 'confirmed_at',
+        'preparing': 'preparing_at',
+        'ready': 'ready_at',
+        'delivered': 'delivered_at',
+        'cancelled': 'cancelled_at',
+    }
+
     class Meta:
         verbose_name = 'Order'
         verbose_name_plural = 'Orders'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='order_created_id_idx'),
+            models.Index(fields=['confirmed_at'], name='order_confirmed_at_idx'),
+        ]
 
     def __str__(self):
         return f"Order {self.order_number}"
@@ -64,6 +97,14 @@ class Order(models.Model):
                     
                 self.order_number = f"{prefix}{new_number}"
         
+        # Stamp the first time the order reaches its current status
+        timestamp_field = self.STATUS_TIMESTAMP_FIELDS.get(self.status)
+        if timestamp_field and getattr(self, timestamp_field) is None:
+            setattr(self, timestamp_field, timezone.now())
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'status' in update_fields:
+                kwargs['update_fields'] = list(update_fields) + [timestamp_field]
+        
         super().save(*args, **kwargs)
 
     @property
@@ -72,9 +113,30 @@ class Order(models.Model):
 
     @property
     def remaining_amount(self):
-        """Calculate remaining amount to be paid"""
-        paid_amount = sum(payment.amount for payment in self.payments.filter(status='completed'))
-        return self.final_amount - paid_amount
+        """Amount still to be paid"""
+        return self.final_amount - self.amount_paid
+
+    def recalculate_totals(self, save=True):
+        """
+        Recompute the subtotal from the items, apply the best discount for the
+        customer (and the entered code, if any) to it and store the totals if
+        they changed. The discount is re-evaluated on every cart change, so
+        removing items can never leave a discount larger than the subtotal.
+        Returns the items.
+        """
+        items = list(self.items.all())
+        total = sum((item.quantity * item.price for item in items), Decimal('0'))
+        _, discount_amount = best_discount(self.customer, total, self.discount_code)
+        totals = (total, discount_amount, max(total - discount_amount, Decimal('0')))
+        if totals != (self.total_amount, self.discount_amount, self.final_amount):
+            self.total_amount, self.discount_amount, self.final_amount = totals
+            if save:
+                self.save(update_fields=['total_amount', 'discount_amount', 'final_amount', 'updated_at'])
+        return items
+
+    async def arecalculate_totals(self, save=True):
+        """Async recalculate_totals"""
+        return await sync_to_async(self.recalculate_totals)(save)
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items', verbose_name='Order')
@@ -111,6 +173,17 @@ class OrderItem(models.Model):
             return 0
         return self.quantity * self.price
 
+def payment_status_for(paid, default):
+    """SQL expression for an order's payment status given an expression for its paid amount"""
+    return Case(
+        When(GreaterThan(paid, 0), then=Case(
+            When(GreaterThanOrEqual(paid, F('final_amount')), then=Value('paid')),
+            default=Value('partial'),
+        )),
+        default=default,
+        output_field=models.CharField(),
+    )
+
 class Payment(models.Model):
     PAYMENT_METHODS = [
         ('cash', 'Cash'),
@@ -129,6 +202,8 @@ class Payment(models.Model):
     payment_method = models.CharField(max_length=10, choices=PAYMENT_METHODS, verbose_name='Payment Method')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='Status')
     transaction_id = models.CharField(max_length=100, blank=True, verbose_name='Transaction ID')
+    # Client token from the payment form; a repeated post with the same key records nothing (see orders.payments)
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False, verbose_name='Idempotency Key')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -136,16 +211,148 @@ class Payment(models.Model):
         verbose_name = 'Payment'
         verbose_name_plural = 'Payments'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='payment_created_id_idx'),
+        ]
+
+    # Amount this payment has added to order.amount_paid as stored in the database
+    _counted_amount = Decimal('0')
 
     def __str__(self):
         return f"Payment for Order {self.order.order_number}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._counted_amount = instance._paid_contribution()
+        return instance
+
+    def _paid_contribution(self):
+        return Decimal(self.amount) if self.status == 'completed' else Decimal('0')
+
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        # Update order payment status
-        if self.status == 'completed':
-            if self.order.remaining_amount <= 0:
-                self.order.payment_status = 'paid'
-            else:
-                self.order.payment_status = 'partial'
-            self.order.save(update_fields=['payment_status'])
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._apply_to_order(self._paid_contribution())
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            self._apply_to_order(Decimal('0'))
+        return result
+
+    def _apply_to_order(self, contribution):
+        """
+        Move order.amount_paid by the change in this payment's contribution and
+        derive the order's payment status from the new total, in one UPDATE.
+        Refunds and deleted payments decrement.
+        """
+        delta = contribution - self._counted_amount
+        self._counted_amount = contribution
+        if not delta:
+            return
+        # Load the order (if not already cached) before the UPDATE so its snapshot is the old state
+        order = self.order
+
+        paid = F('amount_paid') + delta
+        payment_status = payment_status_for(paid, Value('refunded') if delta < 0 else F('payment_status'))
+        Order.objects.filter(pk=self.order_id).update(amount_paid=paid, payment_status=payment_status)
+
+        # The UPDATE bypasses Order.save(); mirror it on the in-memory order and
+        # send post_save so the rollup, history and customer stats receivers run
+        order.amount_paid += delta
+        if order.amount_paid > 0:
+            order.payment_status = 'paid' if order.amount_paid >= order.final_amount else 'partial'
+        elif delta < 0:
+            order.payment_status = 'refunded'
+        if getattr(self, '_changed_by', None) and not getattr(order, '_changed_by', None):
+            order._changed_by = self._changed_by
+        post_save.send(sender=Order, instance=order, created=False, update_fields={'amount_paid', 'payment_status'},
+                       raw=False, using=self._state.db)
+
+class OrderEvent(models.Model):
+    """
+    One entry in an order's history.
+    Status and payment status transitions are recorded by orders.signals on every
+    save; edits and bulk transitions are recorded through orders.events.
+    """
+    ACTION_CHOICES = [
+        ('created', 'Order Created'),
+        ('status_change', 'Status Changed'),
+        ('payment_status_change', 'Payment Status Changed'),
+        ('payment', 'Payment Recorded'),
+        ('edit', 'Order Edited'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='events', verbose_name='Order')
+    staff = models.ForeignKey('staff.StaffUser', on_delete=models.SET_NULL, null=True, blank=True, related_name='order_events', verbose_name='Staff Member')
+    action = models.CharField(max_length=30, choices=ACTION_CHOICES, verbose_name='Action')
+    old_status = models.CharField(max_length=20, blank=True, verbose_name='Old Status')
+    new_status = models.CharField(max_length=20, blank=True, verbose_name='New Status')
+    data = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder, verbose_name='Details')
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        verbose_name = 'Order Event'
+        verbose_name_plural = 'Order Events'
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['order', 'created_at'], name='orderevent_order_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.order} - {self.get_action_display()} - {self.created_at}"
+
+class DailySalesSummary(models.Model):
+    """
+    Pre-aggregated sales figures for one business day.
+
+    Order counts and revenue are keyed by the day the order was created, payment
+    totals by the day the payment was recorded. Only closed days are stored:
+    a day's row is written when it is settled with the settle_payments
+    command, rebuilt from history with the rebuild_sales_rollup command, or
+    stored by the first summary after the day closes. Later changes to an
+    unsettled closed day refresh its row (orders.rollups).
+    """
+    date = models.DateField(unique=True, verbose_name='Business Day')
+
+    order_count = models.PositiveIntegerField(default=0, verbose_name='Order Count')
+    pending_orders = models.PositiveIntegerField(default=0, verbose_name='Pending Orders')
+    confirmed_orders = models.PositiveIntegerField(default=0, verbose_name='Confirmed Orders')
+    preparing_orders = models.PositiveIntegerField(default=0, verbose_name='Preparing Orders')
+    ready_orders = models.PositiveIntegerField(default=0, verbose_name='Ready Orders')
+    delivered_orders = models.PositiveIntegerField(default=0, verbose_name='Delivered Orders')
+    cancelled_orders = models.PositiveIntegerField(default=0, verbose_name='Cancelled Orders')
+
+    unpaid_orders = models.PositiveIntegerField(default=0, verbose_name='Unpaid Orders')
+    partially_paid_orders = models.PositiveIntegerField(default=0, verbose_name='Partially Paid Orders')
+    paid_orders = models.PositiveIntegerField(default=0, verbose_name='Paid Orders')
+    refunded_orders = models.PositiveIntegerField(default=0, verbose_name='Refunded Orders')
+
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='Revenue')
+    discounts = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='Discounts')
+    item_count = models.PositiveIntegerField(default=0, verbose_name='Items Sold')
+
+    payment_count = models.PositiveIntegerField(default=0, verbose_name='Payment Count')
+    cash_payments = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='Cash Payments')
+    card_payments = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='Card Payments')
+    refunded_payments = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='Refunded Payments')
+
+    # Set by the end-of-day settlement (orders.payments.settle_day); settled rows are no longer refreshed
+    settled_at = models.DateTimeField(null=True, blank=True, verbose_name='Settled At')
+    settlement = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder, verbose_name='Settlement')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Daily Sales Summary'
+        verbose_name_plural = 'Daily Sales Summaries'
+        ordering = ['-date']
+
+    def __str__(self):
+        return f"Sales summary for {self.date}"
+
+    @property
+    def total_payments(self):
+        return self.cash_payments + self.card_payments
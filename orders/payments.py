@@ -0,0 +1,136 @@
+"""
+Payment recording and end-of-day settlement.
+
+Payment forms carry an idempotency key generated when the form is rendered.
+``record_payment`` stores it in the unique Payment.idempotency_key column, so
+a double-posted form (a retrying cashier tablet, a double click) returns the
+payment recorded by the first post instead of charging twice. A key is bound
+to the order it was first used for.
+
+``settle_day`` closes a business day: it reconciles Order.amount_paid for
+every order paid that day, summarizes the day's payments by method and status,
+and stores the day's figures in the sales rollup marked as settled. Settled
+rows are not touched by later rollup refreshes or rebuilds.
+"""
+
+import uuid
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, DecimalField, Exists, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import DailySalesSummary, Order, Payment, payment_status_for
+from .rollups import business_day_bounds, compute_day
+
+
+def new_idempotency_key():
+    """Key to embed in a payment form when it is rendered"""
+    return uuid.uuid4().hex
+
+
+def record_payment(order, idempotency_key=None, staff=None, **fields):
+    """
+    Record a payment for an order. Returns (payment, created); a key that was
+    already used for this order returns the existing payment with
+    created=False. Raises ValueError if the key was used for another order.
+    """
+    idempotency_key = idempotency_key or None
+    if idempotency_key:
+        existing = _payment_for_key(order, idempotency_key)
+        if existing:
+            return existing, False
+
+    payment = Payment(order=order, idempotency_key=idempotency_key, **fields)
+    payment._changed_by = staff
+    try:
+        with transaction.atomic():
+            payment.save()
+    except IntegrityError:
+        if not idempotency_key:
+            raise
+        # A concurrent post with the same key got there first, unless the conflict was on another constraint
+        existing = _payment_for_key(order, idempotency_key)
+        if existing is None:
+            raise
+        return existing, False
+    return payment, True
+
+
+def _payment_for_key(order, idempotency_key):
+    """The payment already recorded for the order under the key, if any"""
+    existing = Payment.objects.filter(idempotency_key=idempotency_key).first()
+    if existing and existing.order_id != order.pk:
+        raise ValueError('This payment form was already used for another order.')
+    return existing
+
+
+def reconcile_amount_paid(start, end):
+    """
+    Correct amount_paid (and the payment status derived from it) for every
+    order with a payment in [start, end) in one UPDATE. An order with nothing
+    paid is 'refunded' if it has refunded payments and unpaid otherwise.
+    Returns the number of orders that had drifted.
+    """
+    completed_total = Coalesce(
+        Subquery(
+            Payment.objects.filter(order=OuterRef('pk'), status='completed')
+            .values('order')
+            .annotate(total=Sum('amount'))
+            .values('total')[:1]
+        ),
+        Value(0),
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    )
+    nothing_paid = Case(
+        When(Exists(Payment.objects.filter(order=OuterRef('pk'), status='refunded')), then=Value('refunded')),
+        default=Value('pending'),
+    )
+    payment_status = payment_status_for(completed_total, nothing_paid)
+    paid_orders = Payment.objects.filter(created_at__gte=start, created_at__lt=end).values('order_id')
+    return (
+        Order.objects.filter(pk__in=paid_orders)
+        # Either figure may have drifted on its own
+        .exclude(amount_paid=completed_total, payment_status=payment_status)
+        .update(amount_paid=completed_total, payment_status=payment_status)
+    )
+
+
+def payment_breakdown(start, end):
+    """{method: {status: {'count', 'total'}}} for the payments in [start, end), in one grouped query"""
+    breakdown = {}
+    rows = (
+        Payment.objects.filter(created_at__gte=start, created_at__lt=end)
+        .values('payment_method', 'status')
+        .annotate(count=Count('id'), total=Sum('amount'))
+        .order_by()
+    )
+    for row in rows:
+        breakdown.setdefault(row['payment_method'], {})[row['status']] = {
+            'count': row['count'],
+            'total': row['total'] or 0,
+        }
+    return breakdown
+
+
+def settle_day(day, force=False):
+    """
+    Settle one business day and return its DailySalesSummary. A day that is
+    already settled is returned unchanged unless ``force`` is set.
+    """
+    with transaction.atomic():
+        summary = DailySalesSummary.objects.select_for_update().filter(date=day).first()
+        if summary and summary.settled_at and not force:
+            return summary
+
+        start, end = business_day_bounds(day)
+        reconciled = reconcile_amount_paid(start, end)
+        settlement = {
+            'reconciled_orders': reconciled,
+            'payments': payment_breakdown(start, end),
+        }
+        summary, _ = DailySalesSummary.objects.update_or_create(
+            date=day,
+            defaults={**compute_day(day), 'settlement': settlement, 'settled_at': timezone.now()},
+        )
+    return summary
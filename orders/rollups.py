@@ -0,0 +1,245 @@
+"""
+Daily sales rollup maintenance.
+
+Dashboards read pre-aggregated DailySalesSummary rows instead of scanning the
+full orders and payments tables. Every figure is computed with grouped SQL
+aggregates over a created_at range, so refreshing one day after a transition
+and rebuilding a whole year of history use the same code path.
+
+Only closed business days are stored. The current day changes with every
+order and payment and is always computed live, so transitions on it don't
+touch the table. A day's row is written when it is settled (settle_payments)
+or rebuilt (rebuild_sales_rollup); later changes to a closed, unsettled day
+refresh its row. Days nobody settled are stored by the first summarize()
+after they close (store_closed_days).
+"""
+
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, DateTimeField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailySalesSummary, Order, OrderItem, Payment
+
+# Orders placed after midnight but before this hour count towards the previous business day
+BUSINESS_DAY_START_HOUR = getattr(settings, 'BUSINESS_DAY_START_HOUR', 0)
+
+ORDER_STATUS_FIELDS = {
+    'pending': 'pending_orders',
+    'confirmed': 'confirmed_orders',
+    'preparing': 'preparing_orders',
+    'ready': 'ready_orders',
+    'delivered': 'delivered_orders',
+    'cancelled': 'cancelled_orders',
+}
+
+PAYMENT_STATUS_FIELDS = {
+    'pending': 'unpaid_orders',
+    'partial': 'partially_paid_orders',
+    'paid': 'paid_orders',
+    'refunded': 'refunded_orders',
+}
+
+# Carts and cancelled orders don't count towards revenue or items sold
+PLACED_ORDER = ~Q(status__in=['pending', 'cancelled'])
+
+SUMMARY_FIELDS = (
+    ['order_count']
+    + list(ORDER_STATUS_FIELDS.values())
+    + list(PAYMENT_STATUS_FIELDS.values())
+    + ['revenue', 'discounts', 'item_count', 'payment_count', 'cash_payments', 'card_payments', 'refunded_payments']
+)
+
+
+def business_day(value=None):
+    """Return the business day a timestamp belongs to (defaults to now)"""
+    value = value or timezone.now()
+    shifted = value - datetime.timedelta(hours=BUSINESS_DAY_START_HOUR)
+    return timezone.localtime(shifted).date()
+
+
+def business_day_bounds(date_from, date_to=None):
+    """Return the [start, end) datetimes covering the given business day(s)"""
+    date_to = date_to or date_from
+    start_time = datetime.time(hour=BUSINESS_DAY_START_HOUR)
+    start = timezone.make_aware(datetime.datetime.combine(date_from, start_time))
+    end = timezone.make_aware(datetime.datetime.combine(date_to + datetime.timedelta(days=1), start_time))
+    return start, end
+
+
+def _day_of(field):
+    """SQL expression mapping a timestamp column to its business day"""
+    expression = F(field)
+    if BUSINESS_DAY_START_HOUR:
+        expression = ExpressionWrapper(
+            F(field) - datetime.timedelta(hours=BUSINESS_DAY_START_HOUR),
+            output_field=DateTimeField(),
+        )
+    return TruncDate(expression)
+
+
+def compute_range(date_from, date_to):
+    """
+    Compute summary figures for every business day in [date_from, date_to].
+    Returns {date: {field: value}} and runs three grouped queries regardless of the range size.
+    """
+    start, end = business_day_bounds(date_from, date_to)
+    results = {}
+
+    def row(day):
+        if day not in results:
+            results[day] = {field: 0 for field in SUMMARY_FIELDS}
+        return results[day]
+
+    order_aggregates = {
+        'order_count': Count('id'),
+        'revenue': Sum('final_amount', filter=PLACED_ORDER),
+        'discounts': Sum('discount_amount', filter=PLACED_ORDER),
+    }
+    for status, field in ORDER_STATUS_FIELDS.items():
+        order_aggregates[field] = Count('id', filter=Q(status=status))
+    for status, field in PAYMENT_STATUS_FIELDS.items():
+        order_aggregates[field] = Count('id', filter=Q(payment_status=status))
+
+    orders = (
+        Order.objects.filter(created_at__gte=start, created_at__lt=end)
+        .annotate(day=_day_of('created_at'))
+        .values('day')
+        .annotate(**order_aggregates)
+        .order_by()
+    )
+    for values in orders:
+        day = values.pop('day')
+        row(day).update({field: value or 0 for field, value in values.items()})
+
+    items = (
+        OrderItem.objects.filter(order__created_at__gte=start, order__created_at__lt=end)
+        .filter(~Q(order__status__in=['pending', 'cancelled']))
+        .annotate(day=_day_of('order__created_at'))
+        .values('day')
+        .annotate(quantity=Sum('quantity'))
+        .order_by()
+    )
+    for values in items:
+        row(values['day'])['item_count'] = values['quantity'] or 0
+
+    completed = Q(status='completed')
+    payments = (
+        Payment.objects.filter(created_at__gte=start, created_at__lt=end)
+        .annotate(day=_day_of('created_at'))
+        .values('day')
+        .annotate(
+            payment_count=Count('id', filter=completed),
+            cash_payments=Sum('amount', filter=completed & Q(payment_method='cash')),
+            card_payments=Sum('amount', filter=completed & Q(payment_method='card')),
+            refunded_payments=Sum('amount', filter=Q(status='refunded')),
+        )
+        .order_by()
+    )
+    for values in payments:
+        day = values.pop('day')
+        row(day).update({field: value or 0 for field, value in values.items()})
+
+    return results
+
+
+def compute_day(day):
+    """Compute summary figures for a single business day"""
+    return compute_range(day, day).get(day, {field: 0 for field in SUMMARY_FIELDS})
+
+
+def refresh_day(day):
+    """Recompute and store the rollup row for one business day (settled days are left as settled)"""
+    if DailySalesSummary.objects.filter(date=day, settled_at__isnull=False).exists():
+        return None
+    summary, _ = DailySalesSummary.objects.update_or_create(date=day, defaults=compute_day(day))
+    return summary
+
+
+def rebuild_range(date_from, date_to):
+    """Replace the unsettled rollup rows in [date_from, date_to] with freshly computed ones"""
+    figures = compute_range(date_from, date_to)
+    with transaction.atomic():
+        rows = DailySalesSummary.objects.filter(date__gte=date_from, date__lte=date_to)
+        for day in rows.filter(settled_at__isnull=False).values_list('date', flat=True):
+            figures.pop(day, None)
+        rows.filter(settled_at__isnull=True).delete()
+        DailySalesSummary.objects.bulk_create(
+            [DailySalesSummary(date=day, **values) for day, values in sorted(figures.items())],
+            batch_size=500,
+        )
+    return len(figures)
+
+
+def store_closed_days():
+    """
+    Store a row for every closed business day since the first order that has
+    none yet, quiet days included, so a later check finds nothing missing.
+    Runs once per business day and cache; returns the number of rows stored.
+    """
+    yesterday = business_day() - datetime.timedelta(days=1)
+    marker = f'orders.rollups:closed-through:{yesterday.isoformat()}'
+    if cache.get(marker):
+        return 0
+
+    stored = 0
+    first_order = Order.objects.order_by('created_at').values_list('created_at', flat=True).first()
+    if first_order is not None and business_day(first_order) <= yesterday:
+        first_day = business_day(first_order)
+        days = (yesterday - first_day).days + 1
+        rows = DailySalesSummary.objects.filter(date__gte=first_day, date__lte=yesterday)
+        if rows.count() < days:
+            existing = set(rows.values_list('date', flat=True))
+            missing = [
+                day for day in (first_day + datetime.timedelta(days=offset) for offset in range(days))
+                if day not in existing
+            ]
+            figures = compute_range(missing[0], missing[-1])
+            DailySalesSummary.objects.bulk_create(
+                [DailySalesSummary(date=day, **figures.get(day, {})) for day in missing],
+                batch_size=500,
+                ignore_conflicts=True,
+            )
+            stored = len(missing)
+    cache.set(marker, True, 60 * 60 * 24)
+    return stored
+
+
+def schedule_refresh(day):
+    """Refresh a closed day's rollup once the surrounding transaction commits (the current day is computed live)"""
+    if day >= business_day():
+        return
+    transaction.on_commit(lambda: refresh_day(day))
+
+
+def live_summary(day=None):
+    """Unsaved DailySalesSummary computed live, used for the current business day"""
+    day = day or business_day()
+    return DailySalesSummary(date=day, **compute_day(day))
+
+
+def summarize(date_from=None, date_to=None, live=None):
+    """
+    Totals over a range of business days.
+    Closed days come from stored rollup rows; today is always computed live,
+    or taken from ``live`` when the caller already has live_summary().
+    """
+    store_closed_days()
+    today = business_day()
+    date_to = min(date_to or today, today)
+
+    stored = DailySalesSummary.objects.filter(date__lt=today, date__lte=date_to)
+    if date_from:
+        stored = stored.filter(date__gte=date_from)
+    totals = stored.aggregate(**{field: Sum(field) for field in SUMMARY_FIELDS})
+    totals = {field: value or 0 for field, value in totals.items()}
+
+    if date_to == today and (date_from is None or date_from <= today):
+        figures = compute_day(today) if live is None else {field: getattr(live, field) for field in SUMMARY_FIELDS}
+        for field, value in figures.items():
+            totals[field] += value
+    return totals
@@ -0,0 +1,149 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from customers.stats import is_completed, schedule_stats_refresh
+
+from .events import order_event, record_order_event, record_order_events
+from .kitchen import KITCHEN_STATUSES, schedule_publish
+from .models import Order, OrderItem, Payment
+from .rollups import business_day, schedule_refresh
+
+# Fields that change an order's contribution to the daily sales rollup
+ROLLUP_FIELDS = ('status', 'payment_status', 'final_amount', 'discount_amount')
+
+
+@receiver(post_init, sender=Order)
+def remember_rollup_state(sender, instance, **kwargs):
+    """Snapshot the rollup-relevant fields so post_save can tell what changed"""
+    instance._rollup_state = tuple(instance.__dict__.get(field) for field in ROLLUP_FIELDS)
+    instance._kitchen_status = instance.__dict__.get('status')
+    instance._event_state = (instance.__dict__.get('status'), instance.__dict__.get('payment_status'))
+    instance._customer_stats_state = (
+        is_completed(instance.__dict__.get('status'), instance.__dict__.get('payment_status')),
+        instance.__dict__.get('final_amount'),
+        instance.__dict__.get('customer_id'),
+    )
+
+
+@receiver(post_save, sender=Order)
+def refresh_rollup_for_order(sender, instance, created, **kwargs):
+    """
+    Refresh the order's business day when it is created or transitions.
+    Cart edits on pending orders don't affect any rollup figure except the count.
+    """
+    previous = getattr(instance, '_rollup_state', None)
+    current = tuple(instance.__dict__.get(field) for field in ROLLUP_FIELDS)
+    instance._rollup_state = current
+
+    if not created and previous == current:
+        return
+    if not created and previous and previous[0] == current[0] == 'pending' and previous[1] == current[1]:
+        return
+    schedule_refresh(business_day(instance.created_at))
+
+
+@receiver(post_save, sender=Payment)
+def refresh_rollup_for_payment(sender, instance, **kwargs):
+    schedule_refresh(business_day(instance.created_at))
+
+
+@receiver(post_delete, sender=Order)
+@receiver(post_delete, sender=Payment)
+def refresh_rollup_on_delete(sender, instance, **kwargs):
+    schedule_refresh(business_day(instance.created_at))
+
+
+@receiver(post_save, sender=Order)
+def publish_kitchen_order(sender, instance, **kwargs):
+    """Push the ticket to the kitchen displays when an order enters, changes in or leaves the kitchen"""
+    previous = getattr(instance, '_kitchen_status', None)
+    instance._kitchen_status = instance.status
+    if previous in KITCHEN_STATUSES or instance.status in KITCHEN_STATUSES:
+        schedule_publish([instance.pk])
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def publish_kitchen_item(sender, instance, **kwargs):
+    """Items edited on an order that is already in the kitchen update its ticket"""
+    # Items are edited through their order, so its status is normally cached on the item. Without it,
+    # publish anyway: publish_orders only sends tickets for orders that are in the kitchen.
+    if OrderItem.order.is_cached(instance) and instance.order.status not in KITCHEN_STATUSES:
+        return
+    schedule_publish([instance.order_id])
+
+
+@receiver(post_save, sender=Order)
+def record_order_transitions(sender, instance, created, **kwargs):
+    """
+    Append status and payment status transitions to the order's event history.
+    A cart is only recorded as created once it is submitted (leaves pending for
+    anything but cancelled), so abandoned carts leave no history behind.
+    """
+    previous = getattr(instance, '_event_state', None)
+    instance._event_state = (instance.status, instance.payment_status)
+    staff = getattr(instance, '_changed_by', None)
+
+    if created:
+        if instance.status != 'pending':
+            record_order_event(instance, 'created', staff, new_status=instance.status)
+        return
+    if previous is None:
+        return
+    # One save can make several transitions; they are written together
+    events = []
+    if previous[0] != instance.status:
+        if previous[0] == 'pending' and instance.status != 'cancelled':
+            events.append(order_event(instance, 'created', staff, new_status='pending'))
+        events.append(order_event(instance, 'status_change', staff, previous[0], instance.status))
+    if previous[1] != instance.payment_status:
+        events.append(order_event(instance, 'payment_status_change', staff, previous[1], instance.payment_status))
+    record_order_events(events)
+
+
+@receiver(post_save, sender=Payment)
+def record_payment_event(sender, instance, created, **kwargs):
+    """Payments show up in the order history when recorded and when their status changes"""
+    previous = getattr(instance, '_event_status', None)
+    instance._event_status = instance.status
+    if not created and previous == instance.status:
+        return
+    record_order_event(
+        instance.order,
+        'payment',
+        getattr(instance, '_changed_by', None),
+        '' if created else previous,
+        instance.status,
+        payment_id=instance.pk,
+        amount=instance.amount,
+        payment_method=instance.payment_method,
+    )
+
+
+@receiver(post_init, sender=Payment)
+def remember_payment_status(sender, instance, **kwargs):
+    instance._event_status = instance.__dict__.get('status')
+
+
+@receiver(post_save, sender=Order)
+def refresh_customer_stats_for_order(sender, instance, created, **kwargs):
+    """Keep the customer's lifetime figures in step when an order is delivered, paid, or leaves either state"""
+    previous = getattr(instance, '_customer_stats_state', None)
+    current = (is_completed(instance.status, instance.payment_status), instance.final_amount, instance.customer_id)
+    instance._customer_stats_state = current
+
+    if created:
+        changed = current[0]
+    else:
+        changed = previous != current and (current[0] or (previous is not None and previous[0]))
+    if not changed:
+        return
+    # A guest order claimed by a customer (or moved between customers) changes both sides
+    for customer_id in {current[2], previous[2] if previous else None} - {None}:
+        schedule_stats_refresh(customer_id)
+
+
+@receiver(post_delete, sender=Order)
+def refresh_customer_stats_on_delete(sender, instance, **kwargs):
+    if instance.customer_id and is_completed(instance.status, instance.payment_status):
+        schedule_stats_refresh(instance.customer_id)
@@ -1,3 +1,319 @@
+import datetime
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import IntegrityError, connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from django.contrib.auth.models import User
+
+from customers.models import Customer, Discount
+from menu.models import Category, Product
+from tables.models import Table
+
+from .metrics import percentile, service_times
+from . import kitchen, payments
+from .models import DailySalesSummary, Order, OrderEvent, OrderItem, Payment
+from .rollups import business_day, business_day_bounds, store_closed_days, summarize
+
+
+class OrderTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.table = Table.objects.create(number=1)
+        category = Category.objects.create(name='Mains')
+        cls.product = Product.objects.create(category=category, name='Stew', description='Stew', price=Decimal('10.00'))
+
+    def create_order(self, status='pending', amount=Decimal('10.00'), **fields):
+        return Order.objects.create(table=self.table, status=status, total_amount=amount, final_amount=amount, **fields)
+
+
+class KitchenItemPublishTests(OrderTestCase):
+    """Item changes reach the kitchen displays only for orders in the kitchen, without an extra query"""
+
+    def test_cart_item_is_not_published(self):
+        order = self.create_order()
+        with mock.patch('orders.signals.schedule_publish') as publish, self.assertNumQueries(1):
+            OrderItem.objects.create(order=order, product=self.product, quantity=1, price=self.product.price)
+        publish.assert_not_called()
+
+    def test_item_on_a_kitchen_order_is_published(self):
+        order = self.create_order(status='confirmed')
+        with mock.patch('orders.signals.schedule_publish') as publish, self.assertNumQueries(1):
+            item = OrderItem.objects.create(order=order, product=self.product, quantity=1, price=self.product.price)
+        publish.assert_called_once_with([order.pk])
+
+        publish.reset_mock()
+        with mock.patch('orders.signals.schedule_publish') as publish:
+            OrderItem.objects.get(pk=item.pk).delete()
+        publish.assert_called_once_with([order.pk])
+
+
+class KitchenTransitionTests(OrderTestCase):
+    """Bulk kitchen transitions keep the customer's lifetime figures in step"""
+
+    def test_cancelling_a_paid_order_refreshes_its_customer(self):
+        user = User.objects.create(username='diner')
+        customer = Customer.objects.create(user=user, phone_number='09120000001')
+        with self.captureOnCommitCallbacks(execute=True):
+            paid = self.create_order(status='ready', customer=customer, payment_status='paid')
+            self.create_order(status='delivered', amount=Decimal('5.00'), customer=customer)
+        customer.refresh_from_db()
+        self.assertEqual((customer.order_count, customer.lifetime_spend), (2, Decimal('15.00')))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(kitchen.cancel_orders([paid.pk]), [paid.pk])
+        customer.refresh_from_db()
+        self.assertEqual((customer.order_count, customer.lifetime_spend), (1, Decimal('5.00')))
+
+    def test_bumping_leaves_the_figures_alone(self):
+        user = User.objects.create(username='diner')
+        customer = Customer.objects.create(user=user, phone_number='09120000001')
+        order = self.create_order(status='confirmed', customer=customer, payment_status='paid')
+        with mock.patch('customers.stats.refresh_many_customer_stats') as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                kitchen.bump_orders([order.pk])
+        refresh.assert_not_called()
+
+
+class OrderTotalsTests(OrderTestCase):
+    """Cart totals re-evaluate the discount against the current subtotal"""
+
+    def test_stale_discount_never_makes_the_total_negative(self):
+        order = self.create_order(discount_amount=Decimal('25.00'))
+        OrderItem.objects.create(order=order, product=self.product, quantity=1, price=self.product.price)
+
+        order.recalculate_totals()
+        order.refresh_from_db()
+        self.assertEqual((order.total_amount, order.discount_amount, order.final_amount),
+                         (Decimal('10.00'), Decimal('0.00'), Decimal('10.00')))
+
+    def test_removing_items_re_evaluates_the_minimum_order(self):
+        now = timezone.now()
+        Discount.objects.create(code='BIG', discount_type='fixed', fixed_amount=Decimal('15.00'),
+                                min_order_amount=Decimal('20.00'), valid_from=now - datetime.timedelta(days=1),
+                                valid_to=now + datetime.timedelta(days=1))
+        order = self.create_order(discount_code='BIG')
+        item = OrderItem.objects.create(order=order, product=self.product, quantity=3, price=self.product.price)
+        order.recalculate_totals()
+        self.assertEqual((order.discount_amount, order.final_amount), (Decimal('15.00'), Decimal('15.00')))
+
+        item.quantity = 1
+        item.save()
+        order.recalculate_totals()
+        order.refresh_from_db()
+        self.assertEqual((order.discount_amount, order.final_amount), (Decimal('0'), Decimal('10.00')))
+
+    def test_unchanged_totals_are_not_saved(self):
+        order = self.create_order()
+        OrderItem.objects.create(order=order, product=self.product, quantity=1, price=self.product.price)
+        order.recalculate_totals()
+        with self.assertNumQueries(1):
+            order.recalculate_totals()
+
+
+class PaymentTests(OrderTestCase):
+    """Double-posted payment forms record once; settlement reconciles paid amounts once per day"""
+
+    def pay(self, order, key, amount=Decimal('10.00')):
+        return payments.record_payment(order, key, amount=amount, payment_method='cash', status='completed')
+
+    def test_double_post_records_one_payment(self):
+        order = self.create_order(status='confirmed')
+        first, created = self.pay(order, 'key-1')
+        self.assertTrue(created)
+        again, created = self.pay(order, 'key-1')
+        self.assertFalse(created)
+        self.assertEqual(again.pk, first.pk)
+        order.refresh_from_db()
+        self.assertEqual((order.amount_paid, order.payment_status), (Decimal('10.00'), 'paid'))
+
+    def test_key_used_for_another_order_is_rejected(self):
+        self.pay(self.create_order(status='confirmed'), 'key-1')
+        other = self.create_order(status='confirmed')
+        with self.assertRaises(ValueError):
+            self.pay(other, 'key-1')
+        self.assertFalse(Payment.objects.filter(order=other).exists())
+
+    def test_concurrent_post_returns_the_winning_payment(self):
+        order = self.create_order(status='confirmed')
+        first, _ = self.pay(order, 'key-1')
+        lookups = iter([lambda order, key: None, payments._payment_for_key])
+        # The pre-check misses (the other post has not committed yet) and the insert hits the unique key
+        with mock.patch('orders.payments._payment_for_key', side_effect=lambda *args: next(lookups)(*args)):
+            payment, created = self.pay(order, 'key-1')
+        self.assertFalse(created)
+        self.assertEqual(payment.pk, first.pk)
+        self.assertEqual(Payment.objects.filter(order=order).count(), 1)
+
+    def test_conflict_on_another_constraint_is_raised(self):
+        order = self.create_order(status='confirmed')
+        # The key is free, so the IntegrityError is not a concurrent post of the same form
+        with mock.patch.object(Payment, 'save', side_effect=IntegrityError('NOT NULL constraint failed')):
+            with self.assertRaises(IntegrityError):
+                self.pay(order, 'key-1')
+
+    def test_reconcile_fixes_a_status_that_drifted_alone(self):
+        order = self.create_order(status='delivered')
+        self.pay(order, 'key-1')
+        Order.objects.filter(pk=order.pk).update(payment_status='partial')
+
+        start, end = business_day_bounds(business_day())
+        self.assertEqual(payments.reconcile_amount_paid(start, end), 1)
+        order.refresh_from_db()
+        self.assertEqual((order.amount_paid, order.payment_status), (Decimal('10.00'), 'paid'))
+        self.assertEqual(payments.reconcile_amount_paid(start, end), 0)
+
+    def test_reconcile_sets_the_status_when_nothing_is_paid(self):
+        refunded = self.create_order(status='delivered')
+        self.pay(refunded, 'key-1')
+        unpaid = self.create_order(status='delivered')
+        Payment.objects.create(order=unpaid, amount=Decimal('10.00'), payment_method='card', status='pending')
+        # Drift that bypassed Payment.save()
+        Payment.objects.filter(order=refunded).update(status='refunded')
+        Order.objects.filter(pk=unpaid.pk).update(amount_paid=Decimal('10.00'), payment_status='paid')
+
+        start, end = business_day_bounds(business_day())
+        self.assertEqual(payments.reconcile_amount_paid(start, end), 2)
+        self.assertEqual(
+            dict(Order.objects.values_list('pk', 'payment_status')),
+            {refunded.pk: 'refunded', unpaid.pk: 'pending'},
+        )
+
+    def test_settling_a_settled_day_changes_nothing(self):
+        order = self.create_order(status='delivered')
+        self.pay(order, 'key-1')
+        day = business_day()
+        summary = payments.settle_day(day)
+        self.assertEqual(summary.settlement['reconciled_orders'], 0)
+        summary.refresh_from_db()
+
+        Order.objects.filter(pk=order.pk).update(amount_paid=0)
+        again = payments.settle_day(day)
+        self.assertEqual((again.settled_at, again.settlement), (summary.settled_at, summary.settlement))
+        self.assertEqual(Order.objects.get(pk=order.pk).amount_paid, 0)
+
+        forced = payments.settle_day(day, force=True)
+        self.assertEqual(forced.settlement['reconciled_orders'], 1)
+        self.assertEqual(Order.objects.get(pk=order.pk).amount_paid, Decimal('10.00'))
+
+
+class SalesRollupTests(OrderTestCase):
+    """Closed days count towards the totals whether or not anyone settled them"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_closed_day_without_a_row_is_stored_by_the_next_summary(self):
+        yesterday = business_day() - datetime.timedelta(days=1)
+        order = self.create_order(status='delivered', amount=Decimal('10.00'))
+        Order.objects.filter(pk=order.pk).update(created_at=order.created_at - datetime.timedelta(days=1))
+        self.create_order(status='delivered', amount=Decimal('15.00'))
+        self.assertFalse(DailySalesSummary.objects.filter(date=yesterday).exists())
+
+        totals = summarize()
+        self.assertEqual(totals['order_count'], 2)
+        self.assertEqual(totals['revenue'], Decimal('25.00'))
+        self.assertEqual(DailySalesSummary.objects.get(date=yesterday).revenue, Decimal('10.00'))
+
+        # The day is checked once; the next summary only reads the rows
+        self.assertEqual(store_closed_days(), 0)
+
+    def test_quiet_days_are_stored_as_empty_rows(self):
+        order = self.create_order(status='delivered')
+        Order.objects.filter(pk=order.pk).update(created_at=order.created_at - datetime.timedelta(days=3))
+
+        self.assertEqual(store_closed_days(), 3)
+        self.assertEqual(
+            list(DailySalesSummary.objects.order_by('date').values_list('order_count', flat=True)), [1, 0, 0],
+        )
+
+
+class OrderEventTests(OrderTestCase):
+    """Carts enter the order history when they are submitted, not when they are created"""
+
+    def actions(self, order):
+        return list(OrderEvent.objects.filter(order=order).order_by('id').values_list('action', 'old_status', 'new_status'))
+
+    def test_cart_has_no_history_until_submitted(self):
+        order = self.create_order()
+        self.assertEqual(self.actions(order), [])
+
+        order.status = 'confirmed'
+        order.save()
+        self.assertEqual(self.actions(order), [
+            ('created', '', 'pending'),
+            ('status_change', 'pending', 'confirmed'),
+        ])
+
+    def test_abandoned_cart_is_not_recorded_as_created(self):
+        order = self.create_order()
+        order.status = 'cancelled'
+        order.save()
+        self.assertEqual(self.actions(order), [('status_change', 'pending', 'cancelled')])
+
+    def test_order_placed_by_staff_is_recorded_as_created(self):
+        order = self.create_order(status='confirmed')
+        self.assertEqual(self.actions(order), [('created', '', 'confirmed')])
+
+    def test_transitions_of_one_save_are_written_in_one_insert(self):
+        order = self.create_order()
+        order.status = 'delivered'
+        order.payment_status = 'paid'
+        with CaptureQueriesContext(connection) as captured:
+            order.save()
+        inserts = [query for query in captured.captured_queries if query['sql'].startswith('INSERT INTO "orders_orderevent"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(self.actions(order), [
+            ('created', '', 'pending'),
+            ('status_change', 'pending', 'delivered'),
+            ('payment_status_change', 'pending', 'paid'),
+        ])
+
+
+class ServiceTimeTests(OrderTestCase):
+    """Each status is stamped the first time it is reached, and stage durations are summarized per hour"""
+
+    def test_status_timestamp_is_set_once(self):
+        order = self.create_order()
+        self.assertIsNone(order.confirmed_at)
+
+        order.status = 'confirmed'
+        order.save(update_fields=['status'])
+        confirmed_at = Order.objects.get(pk=order.pk).confirmed_at
+        self.assertIsNotNone(confirmed_at)
+
+        order.status = 'preparing'
+        order.save()
+        order.status = 'confirmed'
+        order.save()
+        self.assertEqual(Order.objects.get(pk=order.pk).confirmed_at, confirmed_at)
+
+    def test_percentile_interpolates_like_percentile_cont(self):
+        self.assertIsNone(percentile([], 0.5))
+        self.assertEqual(percentile([10], 0.95), 10)
+        self.assertEqual(percentile([10, 20, 30, 40], 0.5), 25)
+        self.assertAlmostEqual(percentile([10, 20, 30, 40], 0.95), 38.5)
+
+    def test_stage_durations_per_confirmed_hour(self):
+        hour = timezone.localtime().replace(minute=0, second=0, microsecond=0)
+        for minutes_to_ready in (10, 20, 30):
+            order = self.create_order(status='ready')
+            Order.objects.filter(pk=order.pk).update(
+                confirmed_at=hour,
+                preparing_at=hour + datetime.timedelta(minutes=2),
+                ready_at=hour + datetime.timedelta(minutes=minutes_to_ready),
+                delivered_at=None,
+            )
 
-# Create your tests here.
+        result = service_times(business_day(hour))
+        self.assertEqual(len(result['hours']), 1)
+        row = result['hours'][0]
+        self.assertEqual(row['hour'], hour)
+        self.assertEqual(row['orders'], 3)
+        self.assertEqual(row['stages']['confirmed_to_ready'], {'count': 3, 'p50': 1200.0, 'p95': 1740.0})
+        self.assertEqual(row['stages']['confirmed_to_preparing']['p50'], 120.0)
+        self.assertIsNone(row['stages']['ready_to_delivered'])
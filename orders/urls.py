@@ -13,11 +13,16 @@ urlpatterns = [
     
     # Management panel URLs
     path('management/', views.management_dashboard, name='management_dashboard'),
+    path('management/metrics/service-times/', views.management_service_metrics, name='management_service_metrics'),
+    path('kitchen/', views.kitchen_display, name='kitchen_display'),
+    path('kitchen/<slug:station>/', views.kitchen_display, name='kitchen_station_display'),
     path('management/orders/', views.management_order_list, name='management_order_list'),
+    path('management/orders/export/', views.management_order_export, name='management_order_export'),
     path('management/orders/<int:order_id>/', views.management_order_detail, name='management_order_detail'),
     path('management/orders/<int:order_id>/edit/', views.management_order_edit, name='management_order_edit'),
     path('management/orders/<int:order_id>/status/', views.management_order_update_status, name='management_order_update_status'),
     path('management/payments/', views.management_payment_list, name='management_payment_list'),
+    path('management/payments/export/', views.management_payment_export, name='management_payment_export'),
     path('management/payments/<int:payment_id>/', views.management_payment_detail, name='management_payment_detail'),
     path('management/payments/add/<int:order_id>/', views.management_payment_add, name='management_payment_add'),
     path('management/quick-order/', views.management_quick_order, name='management_quick_order'),
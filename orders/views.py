@@ -12,7 +12,7 @@ Note: All date handling uses standard Gregorian calendar.
 """
 
 from django.shortcuts import render, get_object_or_404, redirect
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.views.decorators.http import require_POST
 from django.http import JsonResponse, HttpResponse
 from django.contrib import messages
@@ -24,16 +24,24 @@ from django.utils.html import strip_tags
 from django.core.mail import send_mail
 from django.conf import settings
 import json
+from decimal import Decimal
 import datetime
 from datetime import datetime, timedelta
 
 from .models import Order, OrderItem, Payment
+from .events import record_order_event, staff_for
+from .kitchen import ALL_STATIONS, can_use_kitchen_display
+from .metrics import service_times
+from .payments import new_idempotency_key, record_payment
+from .rollups import ORDER_STATUS_FIELDS, PAYMENT_STATUS_FIELDS, business_day, live_summary, summarize
 from menu.models import Product, Category
-from customers.models import Customer, Discount
-from staff.models import StaffLog
+from customers.models import Customer
+from customers.discounts import available_discounts, best_discount, find_discount
+from staff.audit import audit_log
 from tables.models import Table
 from Dalooneh.decorators import superuser_required
-from django.contrib.auth.models import User
+from Dalooneh.pagination import paginate_keyset
+from Dalooneh.exports import export_queryset
 """Views for orders app.
 
 All user-facing messages and texts are in English.
@@ -58,16 +66,16 @@ def cart_view(request):
         }
     )
     
-    # Get available discounts
-    available_discounts = customer.discounts.filter(
-        is_active=True,
-        valid_from__lte=timezone.now(),
-        valid_to__gte=timezone.now()
-    )
+    # Apply the best discount targeted at this customer, evaluated against the cached rules
+    order.customer = customer
+    order.recalculate_totals()
+    discount, _ = best_discount(customer, order.total_amount, order.discount_code)
     
     return render(request, 'orders/cart.html', {
         'order': order,
-        'available_discounts': available_discounts
+        'items': order.items.select_related('product'),
+        'applied_discount': discount,
+        'available_discounts': available_discounts(customer)
     })
 
 @require_POST
@@ -128,12 +136,12 @@ def add_to_cart(request):
                 order_item.quantity = quantity  # Replace instead of adding
                 order_item.save()
         
-        # Update order totals
-        order.update_totals()
+        # Update order totals; the discount is re-evaluated against the new subtotal
+        order.recalculate_totals()
         
         # Log cart update
         if hasattr(request.user, 'staff'):
-            StaffLog.objects.create(
+            audit_log(
                 staff=request.user.staff,
                 action='cart_update',
                 details=f'Product {product.name} added to cart',
@@ -162,8 +170,8 @@ def remove_from_cart(request, item_id):
         order = order_item.order
         order_item.delete()
         
-        # Update order totals
-        order.update_totals()
+        # Update order totals; the discount is re-evaluated against the new subtotal
+        order.recalculate_totals()
         
         return JsonResponse({
             'success': True,
@@ -191,8 +199,8 @@ def update_cart(request, item_id):
         else:
             order_item.delete()
         
-        # Update order totals
-        order.update_totals()
+        # Update order totals; the discount is re-evaluated against the new subtotal
+        order.recalculate_totals()
         
         return JsonResponse({
             'success': True,
@@ -213,19 +221,19 @@ def apply_discount(request):
         discount_code = request.POST.get('discount_code')
         order_id = request.POST.get('order_id')
         
-        order = get_object_or_404(Order, id=order_id, customer__user=request.user)
-        discount = get_object_or_404(Discount, code=discount_code, customer=order.customer)
+        order = get_object_or_404(Order.objects.select_related('customer'), id=order_id, customer__user=request.user)
+        discount = find_discount(discount_code, order.customer)
         
-        if not discount.is_valid():
+        if discount is None:
             return JsonResponse({
                 'success': False,
                 'message': 'Invalid or expired discount code.'
             }, status=400)
         
         # Apply discount
-        order.discount_amount = (order.total_amount * discount.percentage) / 100
-        order.final_amount = order.total_amount - order.discount_amount
-        order.save()
+        order.discount_code = discount.code
+        order.save(update_fields=['discount_code', 'updated_at'])
+        order.recalculate_totals()
         
         return JsonResponse({
             'success': True,
@@ -248,26 +256,24 @@ def checkout(request):
     if request.method == 'POST':
         # Get payment method and amount
         payment_method = request.POST.get('payment_method')
-        amount = float(request.POST.get('amount', order.final_amount))
+        amount = Decimal(request.POST.get('amount', order.final_amount))
         
-        # Create payment
-        payment = Payment.objects.create(
-            order=order,
+        # Create payment; saving it updates the order's paid amount and payment status
+        payment, created = record_payment(
+            order,
             amount=amount,
-            payment_method=payment_method
+            payment_method=payment_method,
+            status='completed'
         )
         
         # Update order status
-        if payment.amount >= order.final_amount:
+        if order.payment_status == 'paid':
             order.status = 'confirmed'
-            order.payment_status = 'paid'
-        else:
-            order.payment_status = 'partial'
-        order.save()
+            order.save(update_fields=['status', 'updated_at'])
         
         # Log payment
         if hasattr(request.user, 'staff'):
-            StaffLog.objects.create(
+            audit_log(
                 staff=request.user.staff,
                 action='payment_create',
                 details=f'Payment of {amount} created for order {order.order_number}',
@@ -280,7 +286,7 @@ def checkout(request):
     
     return render(request, 'orders/checkout.html', {
         'order': order,
-        'payment_methods': dict(Payment.PAYMENT_METHODS)
+        'payment_methods': dict(Payment.PAYMENT_METHODS),
     })
 
 @login_required
@@ -299,26 +305,47 @@ def order_detail(request, order_id):
 def is_staff_or_superuser(user):
     return user.is_staff or user.is_superuser
 
+@login_required
+@user_passes_test(can_use_kitchen_display)
+def kitchen_display(request, station=ALL_STATIONS):
+    """Kitchen display page; tickets arrive over the ws/kitchen/ socket"""
+    stations = Category.objects.filter(is_active=True).only('name', 'slug').order_by('name')
+    if station != ALL_STATIONS:
+        get_object_or_404(Category, slug=station)
+    
+    return render(request, 'orders/kitchen/display.html', {
+        'station': station,
+        'stations': stations,
+        'all_stations': ALL_STATIONS,
+    })
+
 @superuser_required
 @login_required
 def management_dashboard(request):
-    # Get statistics for dashboard
-    today = timezone.now().date()
+    # Closed days come from the daily rollup, only today is aggregated live
+    today = live_summary()
+    totals = summarize(live=today)
     
     # Order statistics
-    total_orders = Order.objects.count()
-    today_orders = Order.objects.filter(created_at__date=today).count()
+    total_orders = totals['order_count']
+    today_orders = today.order_count
     
     # Payment statistics
-    total_payments = Payment.objects.filter(status='completed').aggregate(Sum('amount'))['amount__sum'] or 0
-    today_payments = Payment.objects.filter(status='completed', created_at__date=today).aggregate(Sum('amount'))['amount__sum'] or 0
+    total_payments = totals['cash_payments'] + totals['card_payments']
+    today_payments = today.total_payments
     
     # Status statistics
-    orders_by_status = Order.objects.values('status').annotate(count=Count('id'))
-    orders_by_payment_status = Order.objects.values('payment_status').annotate(count=Count('id'))
+    orders_by_status = [
+        {'status': status, 'count': totals[field]}
+        for status, field in ORDER_STATUS_FIELDS.items() if totals[field]
+    ]
+    orders_by_payment_status = [
+        {'payment_status': status, 'count': totals[field]}
+        for status, field in PAYMENT_STATUS_FIELDS.items() if totals[field]
+    ]
     
     # Recent orders
-    recent_orders = Order.objects.order_by('-created_at')[:10]
+    recent_orders = Order.objects.select_related('customer__user', 'table').order_by('-created_at')[:10]
     
     context = {
         'total_orders': total_orders,
@@ -334,7 +361,21 @@ def management_dashboard(request):
 
 @superuser_required
 @login_required
-def management_order_list(request):
+def management_service_metrics(request):
+    """p50/p95 kitchen stage durations per hour as JSON (?date_from=YYYY-MM-DD&date_to=YYYY-MM-DD)"""
+    today = business_day()
+    try:
+        date_from = datetime.strptime(request.GET.get('date_from') or today.isoformat(), '%Y-%m-%d').date()
+        date_to = datetime.strptime(request.GET.get('date_to') or date_from.isoformat(), '%Y-%m-%d').date()
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Dates must be in YYYY-MM-DD format.'}, status=400)
+    if date_to < date_from or (date_to - date_from).days > 92:
+        return JsonResponse({'success': False, 'message': 'Invalid date range (at most 93 days).'}, status=400)
+    
+    return JsonResponse({'success': True, **service_times(date_from, date_to)})
+
+def filter_management_orders(request):
+    """Apply the order list filters from the query string (shared by the list and its export)"""
     # Filter parameters
     status = request.GET.get('status', '')
     payment_status = request.GET.get('payment_status', '')
@@ -344,7 +385,7 @@ def management_order_list(request):
     search_query = request.GET.get('q', '')
     
     # Start with all orders
-    orders = Order.objects.all().order_by('-created_at')
+    orders = Order.objects.select_related('customer__user', 'table')
     
     # Apply filters
     if status:
@@ -380,8 +421,23 @@ def management_order_list(request):
             Q(order_number__icontains=search_query)
         )
     
+    return orders
+
+@superuser_required
+@login_required
+def management_order_list(request):
+    status = request.GET.get('status', '')
+    payment_status = request.GET.get('payment_status', '')
+    date_from = request.GET.get('date_from', '')
+    date_to = request.GET.get('date_to', '')
+    search_query = request.GET.get('q', '')
+    
+    orders = filter_management_orders(request)
+    page_obj = paginate_keyset(request, orders)
+    
     context = {
-        'orders': orders,
+        'orders': page_obj.object_list,
+        'page_obj': page_obj,
         'status_choices': Order.STATUS_CHOICES,
         'payment_status_choices': Order.PAYMENT_STATUS_CHOICES,
         'selected_status': status,
@@ -393,17 +449,37 @@ def management_order_list(request):
     
     return render(request, 'orders/management/order_list.html', context)
 
+@superuser_required
+@login_required
+def management_order_export(request):
+    """Stream the filtered order list as CSV/XLSX"""
+    orders = filter_management_orders(request).order_by('-created_at', '-id')
+    columns = [
+        ('Order Number', 'order_number'),
+        ('Customer Phone', 'customer__phone_number'),
+        ('Table', 'table__number'),
+        ('Status', 'status'),
+        ('Payment Status', 'payment_status'),
+        ('Total Amount', 'total_amount'),
+        ('Discount Amount', 'discount_amount'),
+        ('Final Amount', 'final_amount'),
+        ('Created At', 'created_at'),
+    ]
+    return export_queryset(request, orders, columns, 'orders', 'Orders')
+
 @superuser_required
 @login_required
 def management_order_detail(request, order_id):
-    order = get_object_or_404(Order, id=order_id)
-    order_items = order.items.all()
+    order = get_object_or_404(Order.objects.select_related('customer__user', 'table'), id=order_id)
+    order_items = order.items.select_related('product')
     payments = order.payments.all().order_by('-created_at')
+    events = order.events.select_related('staff').order_by('-created_at', '-id')
     
     context = {
         'order': order,
         'order_items': order_items,
         'payments': payments,
+        'events': events,
         'status_choices': Order.STATUS_CHOICES,
     }
     
@@ -412,17 +488,20 @@ def management_order_detail(request, order_id):
 @superuser_required
 @login_required
 def management_order_edit(request, order_id):
-    order = get_object_or_404(Order, id=order_id)
+    order = get_object_or_404(Order.objects.select_related('customer__user', 'table'), id=order_id)
     
     if request.method == 'POST':
         # Update order notes
         notes = request.POST.get('notes', '')
+        old_notes = order.notes
         order.notes = notes
         order.save()
+        if notes != old_notes:
+            record_order_event(order, 'edit', staff_for(request), fields=['notes'])
         
         # Log order edit
         if hasattr(request.user, 'staff'):
-            StaffLog.objects.create(
+            audit_log(
                 staff=request.user.staff,
                 action='order_edit',
                 details=f'Order {order.order_number} edited',
@@ -443,17 +522,19 @@ def management_order_edit(request, order_id):
 @login_required
 @require_POST
 def management_order_update_status(request, order_id):
-    order = get_object_or_404(Order, id=order_id)
+    # The confirmation notification reads the table and the customer's name
+    order = get_object_or_404(Order.objects.select_related('table', 'customer__user'), id=order_id)
     
     new_status = request.POST.get('status')
     if new_status in dict(Order.STATUS_CHOICES):
         old_status = order.status
         order.status = new_status
+        order._changed_by = staff_for(request)
         order.save()
         
         # Log status change
         if hasattr(request.user, 'staff'):
-            StaffLog.objects.create(
+            audit_log(
                 staff=request.user.staff,
                 action='order_status_update',
                 details=f'Order {order.order_number} status changed from {old_status} to {new_status}',
@@ -467,9 +548,8 @@ def management_order_update_status(request, order_id):
     
     return redirect('orders:management_order_detail', order_id=order.id)
 
-@superuser_required
-@login_required
-def management_payment_list(request):
+def filter_management_payments(request):
+    """Apply the payment list filters from the query string (shared by the list and its export)"""
     # Filter parameters
     payment_method = request.GET.get('payment_method', '')
     status = request.GET.get('status', '')
@@ -477,7 +557,7 @@ def management_payment_list(request):
     date_to = request.GET.get('date_to', '')
     
     # Start with all payments
-    payments = Payment.objects.all().order_by('-created_at')
+    payments = Payment.objects.select_related('order__customer__user')
     
     # Apply filters
     if payment_method:
@@ -510,8 +590,23 @@ def management_payment_list(request):
             except:
                 pass
     
+    return payments
+
+@superuser_required
+@login_required
+def management_payment_list(request):
+    payment_method = request.GET.get('payment_method', '')
+    status = request.GET.get('status', '')
+    date_from = request.GET.get('date_from', '')
+    date_to = request.GET.get('date_to', '')
+    
+    payments = filter_management_payments(request)
+    
+    page_obj = paginate_keyset(request, payments)
+    
     context = {
-        'payments': payments,
+        'payments': page_obj.object_list,
+        'page_obj': page_obj,
         'payment_method_choices': Payment.PAYMENT_METHODS,
         'status_choices': Payment.STATUS_CHOICES,
         'selected_payment_method': payment_method,
@@ -522,10 +617,27 @@ def management_payment_list(request):
     
     return render(request, 'orders/management/payment_list.html', context)
 
+@superuser_required
+@login_required
+def management_payment_export(request):
+    """Stream the filtered payment list as CSV/XLSX"""
+    payments = filter_management_payments(request).order_by('-created_at', '-id')
+    columns = [
+        ('Payment ID', 'id'),
+        ('Order Number', 'order__order_number'),
+        ('Customer Phone', 'order__customer__phone_number'),
+        ('Amount', 'amount'),
+        ('Payment Method', 'payment_method'),
+        ('Status', 'status'),
+        ('Transaction ID', 'transaction_id'),
+        ('Created At', 'created_at'),
+    ]
+    return export_queryset(request, payments, columns, 'payments', 'Payments')
+
 @superuser_required
 @login_required
 def management_payment_detail(request, payment_id):
-    payment = get_object_or_404(Payment, id=payment_id)
+    payment = get_object_or_404(Payment.objects.select_related('order__customer__user', 'order__table'), id=payment_id)
     
     context = {
         'payment': payment,
@@ -536,25 +648,35 @@ def management_payment_detail(request, payment_id):
 @superuser_required
 @login_required
 def management_payment_add(request, order_id):
-    order = get_object_or_404(Order, id=order_id)
+    order = get_object_or_404(Order.objects.select_related('customer__user'), id=order_id)
     
     if request.method == 'POST':
         amount = request.POST.get('amount')
         payment_method = request.POST.get('payment_method')
         transaction_id = request.POST.get('transaction_id', '')
         
-        # Create payment
-        payment = Payment.objects.create(
-            order=order,
-            amount=amount,
-            payment_method=payment_method,
-            transaction_id=transaction_id,
-            status='completed'
-        )
+        # Create payment; a resubmitted form carries the same key and records nothing
+        order._changed_by = staff_for(request)
+        try:
+            payment, created = record_payment(
+                order,
+                request.POST.get('idempotency_key'),
+                staff=order._changed_by,
+                amount=amount,
+                payment_method=payment_method,
+                transaction_id=transaction_id,
+                status='completed'
+            )
+        except ValueError as e:
+            messages.error(request, str(e))
+            return redirect('orders:management_order_detail', order_id=order.id)
+        if not created:
+            messages.info(request, 'This payment was already recorded.')
+            return redirect('orders:management_order_detail', order_id=order.id)
         
         # Log payment creation
         if hasattr(request.user, 'staff'):
-            StaffLog.objects.create(
+            audit_log(
                 staff=request.user.staff,
                 action='payment_create',
                 details=f'Payment of {amount} created for order {order.order_number}',
@@ -569,6 +691,7 @@ def management_payment_add(request, order_id):
         'order': order,
         'payment_methods': Payment.PAYMENT_METHODS,
         'remaining_amount': order.remaining_amount,
+        'idempotency_key': new_idempotency_key(),
     }
     
     return render(request, 'orders/management/payment_add.html', context)
@@ -581,7 +704,7 @@ def management_quick_order(request):
     For customers who don't have smartphones or who don't want to register information.
     """
     tables = Table.objects.filter(is_active=True).order_by('number')
-    products = Product.objects.filter(is_active=True, is_available=True).order_by('category__name', 'name')
+    products = Product.objects.filter(is_active=True, is_available=True).select_related('category').order_by('category__name', 'name')
     categories = Category.objects.filter(is_active=True)
     
     # Handle form submission
@@ -597,23 +720,12 @@ def management_quick_order(request):
         try:
             table = Table.objects.get(id=table_id)
             
-            # Create or get anonymous customer
-            anonymous_customer, created = Customer.objects.get_or_create(
-                phone_number='anonymous',
-                defaults={
-                    'user': User.objects.get_or_create(
-                        username='anonymous_customer',
-                        defaults={'is_active': True}
-                    )[0]
-                }
-            )
-            
             # Free the table from any previous orders
             table.free_table()
             
             # Create a new order
             order = Order.objects.create(
-                customer=anonymous_customer,
+                customer=None,  # Guest order
                 table=table,
                 total_amount=0,
                 discount_amount=0,
@@ -633,11 +745,7 @@ def management_quick_order(request):
                     )
             
             # Update order totals
-            order.total_amount = sum(
-                item.price * item.quantity for item in order.items.all()
-            )
-            order.final_amount = order.total_amount - order.discount_amount
-            order.save()
+            order.recalculate_totals()
             
             # Create a session for the table and mark it as having an order
             session = table.get_or_create_active_session()
@@ -645,7 +753,7 @@ def management_quick_order(request):
             
             # Log the quick order creation
             if hasattr(request.user, 'staff'):
-                StaffLog.objects.create(
+                audit_log(
                     staff=request.user.staff,
                     action='quick_order_created',
                     details=f'Quick order {order.order_number} created for table {table.number}',
@@ -0,0 +1,130 @@
+"""
+Buffered staff audit logging.
+
+Staff actions are recorded through ``audit_log`` instead of
+``StaffLog.objects.create``. Entries are collected in an in-process buffer and
+written with ``bulk_create`` by a background thread every
+AUDIT_LOG_BATCH_SIZE entries or AUDIT_LOG_FLUSH_INTERVAL_MS milliseconds,
+whichever comes first, so a staff click no longer waits for its log row.
+
+The buffer is bounded: once it holds AUDIT_LOG_MAX_BUFFER entries the caller
+flushes it synchronously instead of dropping records. Whatever is still
+buffered is written when the process exits. Set AUDIT_LOG_ASYNC = False (or
+pass sync=True) to write each entry immediately, e.g. in management commands
+that need the row right away.
+
+Buffering is off by default when DEBUG is on and under the test runner. When a
+test turns it on, there is no background thread: the buffer is flushed when
+each request ends, inside the test's transaction.
+"""
+
+import atexit
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import close_old_connections
+
+from Dalooneh.db import write_transaction
+
+# The module rather than StaffLog itself: staff.models imports this module
+from . import models
+
+logger = logging.getLogger(__name__)
+
+TESTING = getattr(settings, 'TESTING', False)
+
+AUDIT_LOG_ASYNC = getattr(settings, 'AUDIT_LOG_ASYNC', not (settings.DEBUG or TESTING))
+AUDIT_LOG_BATCH_SIZE = getattr(settings, 'AUDIT_LOG_BATCH_SIZE', 100)
+AUDIT_LOG_FLUSH_INTERVAL_MS = getattr(settings, 'AUDIT_LOG_FLUSH_INTERVAL_MS', 250)
+AUDIT_LOG_MAX_BUFFER = getattr(settings, 'AUDIT_LOG_MAX_BUFFER', 5000)
+
+
+class AuditLogWriter:
+    """Bounded in-process buffer of StaffLog rows flushed by a background thread"""
+
+    def __init__(self, batch_size=AUDIT_LOG_BATCH_SIZE, flush_interval_ms=AUDIT_LOG_FLUSH_INTERVAL_MS,
+                 max_buffer=AUDIT_LOG_MAX_BUFFER, background=True):
+        self.batch_size = batch_size
+        self.background = background
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_buffer = max_buffer
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_thread(self):
+        # Worker processes forked after the first write need their own thread
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, entry):
+        """Queue an unsaved StaffLog for the next flush"""
+        with self._lock:
+            if self.background:
+                self._ensure_thread()
+            self._buffer.append(entry)
+            size = len(self._buffer)
+
+        if size >= self.max_buffer:
+            # The writer thread is falling behind; make the caller pay instead of growing without bound
+            self.flush()
+        elif size >= self.batch_size and self.background:
+            self._wakeup.set()
+
+    def flush(self):
+        """Write everything buffered so far. Returns the number of rows written."""
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return 0
+        try:
+            write_transaction(models.StaffLog.objects.bulk_create)(batch, batch_size=self.batch_size)
+        except Exception as e:
+            logger.error(f"Error writing {len(batch)} staff log entries: {str(e)}", exc_info=True)
+            return 0
+        return len(batch)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self.flush():
+                close_old_connections()
+
+
+writer = AuditLogWriter(background=not TESTING)
+atexit.register(writer.flush)
+
+
+def flush_on_request_end(sender, **kwargs):
+    writer.flush()
+
+
+if TESTING:
+    request_finished.connect(flush_on_request_end)
+
+
+def audit_log(sync=False, **fields):
+    """
+    Record a staff action. Accepts the same fields as StaffLog
+    (staff, action, details, ip_address, user_agent).
+    """
+    entry = models.StaffLog(**fields)
+    if sync or not AUDIT_LOG_ASYNC:
+        entry.save()
+    else:
+        writer.write(entry)
+    return entry
+
+
+def flush_audit_log():
+    """Write any buffered entries now (e.g. before reading the log back)"""
+    return writer.flush()
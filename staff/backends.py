@@ -0,0 +1,23 @@
+from django.contrib.auth.backends import BaseBackend
+
+from .models import StaffUser
+
+
+class StaffBackend(BaseBackend):
+    """Authenticates staff members, who are StaffUser rows rather than auth users"""
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None or password is None:
+            return None
+        try:
+            staff = StaffUser.objects.get(username=username)
+        except StaffUser.DoesNotExist:
+            # Hash anyway, so a missing username takes as long as a wrong password
+            StaffUser().set_password(password)
+            return None
+        if staff.is_active and not staff.is_locked and staff.check_password(password):
+            return staff
+        return None
+
+    def get_user(self, user_id):
+        return StaffUser.objects.filter(pk=user_id, is_active=True).first()
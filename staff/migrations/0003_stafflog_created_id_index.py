@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('staff', '0002_staffactivity_userrole'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stafflog',
+            index=models.Index(fields=['created_at', 'id'], name='stafflog_created_id_idx'),
+        ),
+    ]
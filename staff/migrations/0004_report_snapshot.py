@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:20
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+def mark_existing_reports_completed(apps, schema_editor):
+    # Reports created before snapshots existed were generated synchronously
+    Report = apps.get_model('staff', 'Report')
+    Report.objects.update(status='completed')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('staff', '0003_stafflog_created_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Generating'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20, verbose_name='Status'),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='data',
+            field=models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Report Data'),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='error',
+            field=models.TextField(blank=True, verbose_name='Error'),
+        ),
+        migrations.RunPython(mark_existing_reports_completed, migrations.RunPython.noop),
+    ]
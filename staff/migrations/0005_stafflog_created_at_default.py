@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('staff', '0004_report_snapshot'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stafflog',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
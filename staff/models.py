@@ -2,6 +2,9 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser, Group, Permission
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
+from django.core.serializers.json import DjangoJSONEncoder
+
+from . import audit
 
 class StaffUser(AbstractUser):
     """Custom user model for staff members"""
@@ -43,13 +46,18 @@ class StaffUser(AbstractUser):
     def __str__(self):
         return f"{self.get_full_name()} - {self.get_role_display()}"
 
+    @property
+    def staff(self):
+        """The staff member behind request.user, which the staff views read as request.user.staff"""
+        return self
+
     def increment_failed_login(self):
         """Increment failed login attempts and update timestamp"""
         self.failed_login_attempts += 1
         self.last_failed_login = timezone.now()
         self.save(update_fields=['failed_login_attempts', 'last_failed_login'])
         # Log failed login attempt
-        StaffLog.objects.create(
+        audit.audit_log(
             staff=self,
             action='login_failed',
             details=f'Failed login attempt #{self.failed_login_attempts}'
@@ -61,7 +69,7 @@ class StaffUser(AbstractUser):
         self.last_failed_login = None
         self.save(update_fields=['failed_login_attempts', 'last_failed_login'])
         # Log reset
-        StaffLog.objects.create(
+        audit.audit_log(
             staff=self,
             action='login_reset',
             details='Failed login attempts reset'
@@ -101,12 +109,16 @@ class StaffLog(models.Model):
     details = models.TextField(verbose_name='Details')
     ip_address = models.GenericIPAddressField(null=True, blank=True, verbose_name='IP Address')
     user_agent = models.TextField(blank=True, verbose_name='User Agent')
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Set when the action happens, not when the buffered row is flushed (see staff/audit.py)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         verbose_name = 'Staff Log'
         verbose_name_plural = 'Staff Logs'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='stafflog_created_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.staff} - {self.get_action_display()} - {self.created_at}"
@@ -118,12 +130,22 @@ class Report(models.Model):
         ('monthly', 'Monthly Report'),
     ]
 
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Generating'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
     type = models.CharField(max_length=20, choices=REPORT_TYPES, verbose_name='Report Type')
     start_date = models.DateField(verbose_name='Start Date')
     end_date = models.DateField(verbose_name='End Date')
     total_orders = models.PositiveIntegerField(default=0, verbose_name='Total Orders')
     total_revenue = models.DecimalField(max_digits=12, decimal_places=0, default=0, verbose_name='Total Revenue')
     total_discounts = models.DecimalField(max_digits=12, decimal_places=0, default=0, verbose_name='Total Discounts')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='Status')
+    data = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder, verbose_name='Report Data')
+    error = models.TextField(blank=True, verbose_name='Error')
     created_by = models.ForeignKey(StaffUser, on_delete=models.SET_NULL, null=True, verbose_name='Created By')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -139,3 +161,7 @@ class Report(models.Model):
     @property
     def net_revenue(self):
         return self.total_revenue - self.total_discounts
+
+    @property
+    def is_ready(self):
+        return self.status == 'completed'
@@ -0,0 +1,139 @@
+"""
+Sales report engine.
+
+A report is computed once with grouped SQL aggregates and stored as a JSON
+snapshot on the Report row, so opening a past report is a single row read.
+Day-level totals and the daily series come from the DailySalesSummary rollup
+for closed days and from the live figures for the current day; the hourly,
+product and customer breakdowns are one grouped query each over the order
+range.
+"""
+
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import ExtractHour
+
+from orders.models import DailySalesSummary, Order, OrderItem
+from orders.rollups import PLACED_ORDER, business_day, business_day_bounds, live_summary, summarize
+from Dalooneh.routers import reporting_reads
+
+from .models import Report
+
+logger = logging.getLogger(__name__)
+
+# Ranges longer than this are generated in a background thread
+REPORT_BACKGROUND_THRESHOLD_DAYS = getattr(settings, 'REPORT_BACKGROUND_THRESHOLD_DAYS', 31)
+REPORT_TOP_CUSTOMERS = getattr(settings, 'REPORT_TOP_CUSTOMERS', 50)
+
+DAILY_FIELDS = ['order_count', 'delivered_orders', 'cancelled_orders', 'revenue', 'discounts', 'item_count']
+
+
+def build_snapshot(start_date, end_date):
+    """Compute every report breakdown for [start_date, end_date]"""
+    start, end = business_day_bounds(start_date, end_date)
+    orders = Order.objects.filter(created_at__gte=start, created_at__lt=end)
+    placed_orders = orders.filter(PLACED_ORDER)
+
+    # The current day is computed once, for both the totals and the daily series
+    today = business_day()
+    live = live_summary(today) if start_date <= today <= end_date else None
+    totals = summarize(start_date, end_date, live=live)
+
+    daily = list(
+        DailySalesSummary.objects.filter(date__gte=start_date, date__lte=end_date, date__lt=today)
+        .order_by('date')
+        .values('date', *DAILY_FIELDS)
+    )
+    if live is not None:
+        daily.append({'date': today, **{field: getattr(live, field) for field in DAILY_FIELDS}})
+
+    hourly = list(
+        placed_orders.annotate(hour=ExtractHour('created_at'))
+        .values('hour')
+        .annotate(count=Count('id'), revenue=Sum('final_amount'))
+        .order_by('hour')
+    )
+
+    line_total = ExpressionWrapper(F('quantity') * F('price'), output_field=DecimalField(max_digits=12, decimal_places=2))
+    products = list(
+        OrderItem.objects.filter(order__in=placed_orders)
+        .values('product_id', 'product__name')
+        .annotate(total_quantity=Sum('quantity'), total_revenue=Sum(line_total))
+        .order_by('-total_quantity')
+    )
+
+    customers = list(
+        placed_orders.filter(customer__isnull=False)
+        .values('customer_id', 'customer__phone_number')
+        .annotate(total_orders=Count('id'), total_spent=Sum('final_amount'))
+        .order_by('-total_spent')[:REPORT_TOP_CUSTOMERS]
+    )
+
+    return {
+        'totals': totals,
+        'daily': daily,
+        'hourly': hourly,
+        'products': products,
+        'customers': customers,
+    }
+
+
+def generate_report(report):
+    """Compute the snapshot for a report and store it, recording failures on the row"""
+    Report.objects.filter(pk=report.pk).update(status='running')
+    try:
+        # The aggregates read from the reporting replica when there is one
+        with reporting_reads():
+            data = build_snapshot(report.start_date, report.end_date)
+    except Exception as e:
+        logger.error(f"Error generating report {report.pk}: {str(e)}", exc_info=True)
+        report.status = 'failed'
+        report.error = str(e)
+        report.save(update_fields=['status', 'error', 'updated_at'])
+        return report
+
+    totals = data['totals']
+    report.data = data
+    report.total_orders = totals['order_count']
+    report.total_revenue = totals['revenue']
+    report.total_discounts = totals['discounts']
+    report.status = 'completed'
+    report.error = ''
+    report.save(update_fields=['data', 'total_orders', 'total_revenue', 'total_discounts', 'status', 'error', 'updated_at'])
+    return report
+
+
+def _generate_in_background(report_id):
+    close_old_connections()
+    try:
+        report = Report.objects.get(pk=report_id)
+        generate_report(report)
+    finally:
+        close_old_connections()
+
+
+def request_report(report_type, start_date, end_date, created_by=None):
+    """
+    Create a report and generate it.
+    Short ranges are generated inline; long ranges are handed to a background
+    thread once the creating transaction commits. Returns the Report.
+    """
+    report = Report.objects.create(
+        type=report_type,
+        start_date=start_date,
+        end_date=end_date,
+        created_by=created_by,
+        status='pending',
+    )
+
+    if (end_date - start_date).days + 1 > REPORT_BACKGROUND_THRESHOLD_DAYS:
+        transaction.on_commit(
+            lambda: threading.Thread(target=_generate_in_background, args=(report.pk,), daemon=True).start()
+        )
+    else:
+        generate_report(report)
+    return report
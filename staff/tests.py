@@ -1,3 +1,189 @@
+import datetime
+from decimal import Decimal
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+
+from django.core.signals import request_finished
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from menu.models import Category, Product
+from orders.models import Order, OrderItem
+from orders.rollups import business_day, rebuild_range
+from tables.models import Table
+
+from . import audit, reports
+from .models import Report, StaffLog, StaffUser
+
+
+class ReportSnapshotTests(TestCase):
+    """Reports are computed once into a stored snapshot that combines rollup days with the live current day"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = business_day()
+        cls.yesterday = cls.today - datetime.timedelta(days=1)
+        table = Table.objects.create(number=1)
+        category = Category.objects.create(name='Drinks')
+        cls.product = Product.objects.create(category=category, name='Tea', description='Tea', price=Decimal('5.00'))
+
+        def order(status, amount, quantity, day_offset=0):
+            order = Order.objects.create(table=table, status=status, total_amount=amount, final_amount=amount)
+            OrderItem.objects.create(order=order, product=cls.product, quantity=quantity, price=cls.product.price)
+            if day_offset:
+                Order.objects.filter(pk=order.pk).update(created_at=order.created_at - datetime.timedelta(days=day_offset))
+            return order
+
+        order('delivered', Decimal('10.00'), 2, day_offset=1)
+        order('delivered', Decimal('15.00'), 3)
+        # Neither carts nor cancelled orders count towards revenue
+        order('pending', Decimal('5.00'), 1)
+        order('cancelled', Decimal('5.00'), 1)
+        rebuild_range(cls.yesterday, cls.yesterday)
+
+    def test_snapshot_combines_stored_days_with_the_current_day(self):
+        report = reports.request_report('weekly', self.yesterday, self.today)
+
+        report.refresh_from_db()
+        self.assertEqual(report.status, 'completed')
+        self.assertEqual(report.total_orders, 4)
+        self.assertEqual(report.total_revenue, Decimal('25'))
+        self.assertEqual([day['date'] for day in report.data['daily']], [self.yesterday.isoformat(), self.today.isoformat()])
+        # The daily series adds up to the totals
+        self.assertEqual(sum(day['order_count'] for day in report.data['daily']), report.total_orders)
+        self.assertEqual(len(report.data['products']), 1)
+        self.assertEqual(report.data['products'][0]['total_quantity'], 5)
+        self.assertEqual(Decimal(report.data['products'][0]['total_revenue']), Decimal('25.00'))
+
+    def test_opening_a_report_is_one_row_read(self):
+        report = reports.request_report('daily', self.today, self.today)
+
+        with self.assertNumQueries(1):
+            data = Report.objects.get(pk=report.pk).data
+        self.assertEqual(data['totals']['order_count'], 3)
+
+    def test_failure_is_recorded_on_the_report(self):
+        with mock.patch.object(reports, 'build_snapshot', side_effect=RuntimeError('replica down')):
+            with self.assertLogs('staff.reports', 'ERROR'):
+                report = reports.request_report('daily', self.today, self.today)
+
+        report.refresh_from_db()
+        self.assertEqual(report.status, 'failed')
+        self.assertEqual(report.error, 'replica down')
+
+    def test_long_ranges_are_generated_after_commit(self):
+        start = self.today - datetime.timedelta(days=reports.REPORT_BACKGROUND_THRESHOLD_DAYS)
+        with mock.patch.object(reports.threading, 'Thread') as thread:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                report = reports.request_report('monthly', start, self.today)
+            thread.assert_not_called()
+            for callback in callbacks:
+                callback()
+
+        thread.assert_called_once_with(target=reports._generate_in_background, args=(report.pk,), daemon=True)
+        self.assertEqual(Report.objects.get(pk=report.pk).status, 'pending')
+
+
+class AuditLogTests(TestCase):
+    """Under the test runner audit rows are written inside the test's transaction"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = StaffUser.objects.create(username='cashier', role='cashier', phone_number='0', national_code='1')
+
+    def test_written_immediately_by_default(self):
+        self.assertFalse(audit.AUDIT_LOG_ASYNC)
+        self.staff.increment_failed_login()
+        self.assertTrue(StaffLog.objects.filter(staff=self.staff, action='login_failed').exists())
+
+    def test_buffered_entries_are_flushed_when_the_request_ends(self):
+        with mock.patch.object(audit, 'AUDIT_LOG_ASYNC', True):
+            audit.audit_log(staff=self.staff, action='other', details='Buffered')
+        self.assertIsNone(audit.writer._thread)
+        self.assertFalse(StaffLog.objects.filter(details='Buffered').exists())
+
+        request_finished.send(sender=self.__class__)
+        self.assertTrue(StaffLog.objects.filter(details='Buffered').exists())
+
+
+class StaffLoginTests(TestCase):
+    """Staff members log in as their StaffUser and reach the staff pages"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = StaffUser.objects.create_user(
+            'waiter', password='secret', role='waiter', phone_number='0', national_code='2',
+        )
+
+    def test_staff_member_reaches_the_staff_pages(self):
+        self.assertTrue(self.client.login(username='waiter', password='secret'))
+        response = self.client.get(reverse('staff:staff_activity_export'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.wsgi_request.user, self.staff)
+
+    def test_locked_staff_member_cannot_log_in(self):
+        self.assertFalse(self.client.login(username='waiter', password='wrong'))
+        StaffUser.objects.filter(pk=self.staff.pk).update(failed_login_attempts=5, last_failed_login=timezone.now())
+        self.assertFalse(self.client.login(username='waiter', password='secret'))
+
+
+class StaffPageTests(TestCase):
+    """The staff pages render for a logged-in staff member"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = StaffUser.objects.create(username='manager', role='admin', phone_number='0', national_code='3')
+        table = Table.objects.create(number=1)
+        cls.order = Order.objects.create(table=table, status='confirmed', total_amount=10, final_amount=10)
+        StaffLog.objects.create(staff=cls.staff, action='login', details='Logged in')
+
+    def setUp(self):
+        self.client.force_login(self.staff, backend='staff.backends.StaffBackend')
+
+    def test_dashboard(self):
+        response = self.client.get(reverse('staff:dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['today_orders_count'], 1)
+
+    def test_order_list(self):
+        response = self.client.get(reverse('staff:order_list'), {'status': 'confirmed'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, self.order.order_number)
+
+    def test_order_detail(self):
+        response = self.client.get(reverse('staff:order_detail', args=[self.order.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Created')
+
+        response = self.client.post(reverse('staff:order_detail', args=[self.order.pk]), {'status': 'preparing'})
+        self.assertRedirects(response, reverse('staff:order_detail', args=[self.order.pk]))
+        event = self.order.events.get(action='status_change')
+        self.assertEqual((event.staff, event.new_status), (self.staff, 'preparing'))
+
+    def test_reports(self):
+        report = reports.request_report('daily', business_day(), business_day(), created_by=self.staff)
+
+        response = self.client.get(reverse('staff:reports'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, reverse('staff:report_detail', args=[report.pk]))
+
+        response = self.client.get(reverse('staff:report_detail', args=[report.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['data']['totals']['order_count'], 1)
+
+    async def test_report_export_streams_asynchronously(self):
+        report = await sync_to_async(reports.request_report)('daily', business_day(), business_day())
+        await self.async_client.aforce_login(self.staff, backend='staff.backends.StaffBackend')
+
+        response = await self.async_client.get(reverse('staff:report_export', args=[report.pk]), {'section': 'daily'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(body.splitlines()), 2)
 
-# Create your tests here.
+    def test_activity(self):
+        response = self.client.get(reverse('staff:staff_activity'), {'staff': self.staff.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Logged in')
@@ -11,4 +11,8 @@ urlpatterns = [
     path('products/', views.product_management, name='product_management'),
     path('categories/', views.category_management, name='category_management'),
     path('reports/', views.reports, name='reports'),
+    path('reports/<int:report_id>/', views.report_detail, name='report_detail'),
+    path('reports/<int:report_id>/export/', views.report_export, name='report_export'),
+    path('activity/', views.staff_activity, name='staff_activity'),
+    path('activity/export/', views.staff_activity_export, name='staff_activity_export'),
 ] 
\ No newline at end of file
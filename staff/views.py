@@ -7,9 +7,14 @@ from django.db.models.functions import TruncDate, TruncHour
 from datetime import datetime, timedelta
 from .models import StaffUser, Report, StaffLog
 from orders.models import Order, OrderItem, Payment
+from orders.rollups import live_summary
+from .reports import request_report
+from .audit import audit_log
 from menu.models import Product, Category
 from customers.models import Customer, CustomerRating
 from Dalooneh.decorators import superuser_required
+from Dalooneh.pagination import paginate_keyset
+from Dalooneh.exports import export_queryset, export_response
 
 def is_staff(user):
     return hasattr(user, 'staff')
@@ -23,13 +28,12 @@ def management_index(request):
 @login_required
 @user_passes_test(is_staff)
 def dashboard(request):
-    # Get today's statistics
+    # Get today's statistics (computed live, earlier days live in the sales rollup)
     today = timezone.now().date()
-    today_orders = Order.objects.filter(created_at__date=today)
-    today_revenue = sum(order.final_amount for order in today_orders)
+    today_summary = live_summary()
     
     # Get pending orders
-    pending_orders = Order.objects.filter(status='pending').order_by('created_at')
+    pending_orders = Order.objects.filter(status='pending').select_related('table').order_by('created_at')
     
     # Get recent orders
     recent_orders = Order.objects.all().order_by('-created_at')[:5]
@@ -37,7 +41,7 @@ def dashboard(request):
     # Get staff activity
     staff_activity = StaffLog.objects.filter(
         created_at__date=today
-    ).order_by('-created_at')[:10]
+    ).select_related('staff').order_by('-created_at')[:10]
     
     # Get customer statistics
     customer_stats = {
@@ -47,8 +51,8 @@ def dashboard(request):
     }
     
     context = {
-        'today_orders_count': today_orders.count(),
-        'today_revenue': today_revenue,
+        'today_orders_count': today_summary.order_count,
+        'today_revenue': today_summary.revenue,
         'pending_orders': pending_orders,
         'recent_orders': recent_orders,
         'staff_activity': staff_activity,
@@ -66,7 +70,7 @@ def order_list(request):
     date_to = request.GET.get('date_to')
     
     # Base queryset
-    orders = Order.objects.all()
+    orders = Order.objects.select_related('customer__user', 'table')
     
     # Apply filters
     if status:
@@ -76,10 +80,10 @@ def order_list(request):
     if date_to:
         orders = orders.filter(created_at__date__lte=date_to)
     
-    orders = orders.order_by('-created_at')
+    page_obj = paginate_keyset(request, orders)
     
     # Log view
-    StaffLog.objects.create(
+    audit_log(
         staff=request.user.staff,
         action='order_list_view',
         details=f'Viewed order list with filters: status={status}, date_from={date_from}, date_to={date_to}',
@@ -88,7 +92,8 @@ def order_list(request):
     )
     
     return render(request, 'staff/order_list.html', {
-        'orders': orders,
+        'orders': page_obj.object_list,
+        'page_obj': page_obj,
         'filters': {
             'status': status,
             'date_from': date_from,
@@ -99,17 +104,18 @@ def order_list(request):
 @login_required
 @user_passes_test(is_staff)
 def order_detail(request, order_id):
-    order = get_object_or_404(Order, id=order_id)
+    order = get_object_or_404(Order.objects.select_related('customer__user', 'table'), id=order_id)
     
     if request.method == 'POST':
         new_status = request.POST.get('status')
         if new_status in dict(Order.STATUS_CHOICES):
             old_status = order.status
             order.status = new_status
+            order._changed_by = request.user.staff
             order.save()
             
             # Log status change
-            StaffLog.objects.create(
+            audit_log(
                 staff=request.user.staff,
                 action='order_status_change',
                 details=f'Order {order.order_number} status changed from {old_status} to {new_status}',
@@ -120,15 +126,14 @@ def order_detail(request, order_id):
             messages.success(request, 'Order status updated successfully.')
             return redirect('staff:order_detail', order_id=order.id)
     
-    # Get order history
-    order_history = StaffLog.objects.filter(
-        action__in=['order_status_change', 'payment_create'],
-        details__contains=order.order_number
-    ).order_by('-created_at')
+    # Get order history (indexed on order_id, created_at)
+    order_history = order.events.select_related('staff').order_by('-created_at', '-id')
     
     return render(request, 'staff/order_detail.html', {
         'order': order,
-        'order_history': order_history
+        'items': order.items.select_related('product'),
+        'order_history': order_history,
+        'status_choices': Order.STATUS_CHOICES,
     })
 
 @superuser_required
@@ -147,7 +152,7 @@ def product_management(request):
         product.save()
         
         # Log product update
-        StaffLog.objects.create(
+        audit_log(
             staff=request.user.staff,
             action='product_update',
             details=f'Product {product.name} availability changed to {is_available}',
@@ -177,7 +182,7 @@ def category_management(request):
         category.save()
         
         # Log category update
-        StaffLog.objects.create(
+        audit_log(
             staff=request.user.staff,
             action='category_update',
             details=f'Category {category.name} active status changed to {is_active}',
@@ -201,51 +206,11 @@ def reports(request):
         start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
         end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
         
-        # Get orders in date range
-        orders = Order.objects.filter(
-            created_at__date__range=[start_date, end_date]
-        )
-        
-        # Calculate statistics
-        total_orders = orders.count()
-        total_revenue = sum(order.final_amount for order in orders)
-        total_discounts = sum(order.discount_amount for order in orders)
-        
-        # Get hourly distribution
-        hourly_distribution = orders.annotate(
-            hour=TruncHour('created_at')
-        ).values('hour').annotate(
-            count=Count('id'),
-            revenue=Sum('final_amount')
-        ).order_by('hour')
-        
-        # Get product statistics
-        product_stats = OrderItem.objects.filter(
-            order__in=orders
-        ).values('product__name').annotate(
-            total_quantity=Sum('quantity'),
-            total_revenue=Sum('price')
-        ).order_by('-total_quantity')
-        
-        # Get customer statistics
-        customer_stats = orders.values('customer__user__username').annotate(
-            total_orders=Count('id'),
-            total_spent=Sum('final_amount')
-        ).order_by('-total_spent')
-        
-        # Create report
-        report = Report.objects.create(
-            type=report_type,
-            start_date=start_date,
-            end_date=end_date,
-            total_orders=total_orders,
-            total_revenue=total_revenue,
-            total_discounts=total_discounts,
-            created_by=request.user.staff
-        )
+        # Long ranges are generated in the background, short ones right away
+        report = request_report(report_type, start_date, end_date, created_by=request.user.staff)
         
         # Log report creation
-        StaffLog.objects.create(
+        audit_log(
             staff=request.user.staff,
             action='report_generate',
             details=f'Generated {report_type} report for {start_date} to {end_date}',
@@ -253,25 +218,88 @@ def reports(request):
             user_agent=request.META.get('HTTP_USER_AGENT', '')
         )
         
-        messages.success(request, 'Report created successfully.')
+        if report.is_ready:
+            messages.success(request, 'Report created successfully.')
+        elif report.status == 'failed':
+            messages.error(request, 'Report could not be generated.')
+        else:
+            messages.info(request, 'Report is being generated. It will be available shortly.')
         return redirect('staff:reports')
     
     # Get recent reports
-    recent_reports = Report.objects.all().order_by('-created_at')[:5]
+    recent_reports = Report.objects.defer('data').order_by('-created_at')[:5]
     
     return render(request, 'staff/reports.html', {'recent_reports': recent_reports})
 
 @login_required
 @user_passes_test(is_staff)
-def staff_activity(request):
-    # Get filter parameters
+def report_detail(request, report_id):
+    """Show a stored report snapshot without recomputing anything"""
+    report = get_object_or_404(Report, id=report_id)
+    
+    return render(request, 'staff/report_detail.html', {
+        'report': report,
+        'data': report.data,
+    })
+
+# Columns for each exportable report section: (header, key in the snapshot rows)
+REPORT_EXPORT_SECTIONS = {
+    'daily': [
+        ('Date', 'date'),
+        ('Orders', 'order_count'),
+        ('Delivered', 'delivered_orders'),
+        ('Cancelled', 'cancelled_orders'),
+        ('Revenue', 'revenue'),
+        ('Discounts', 'discounts'),
+        ('Items Sold', 'item_count'),
+    ],
+    'hourly': [
+        ('Hour', 'hour'),
+        ('Orders', 'count'),
+        ('Revenue', 'revenue'),
+    ],
+    'products': [
+        ('Product ID', 'product_id'),
+        ('Product', 'product__name'),
+        ('Quantity', 'total_quantity'),
+        ('Revenue', 'total_revenue'),
+    ],
+    'customers': [
+        ('Customer ID', 'customer_id'),
+        ('Phone Number', 'customer__phone_number'),
+        ('Orders', 'total_orders'),
+        ('Total Spent', 'total_spent'),
+    ],
+}
+
+@login_required
+@user_passes_test(is_staff)
+def report_export(request, report_id):
+    """Export one section of a stored report snapshot (?section=daily|hourly|products|customers)"""
+    report = get_object_or_404(Report, id=report_id)
+    if not report.is_ready:
+        messages.error(request, 'Report is not ready yet.')
+        return redirect('staff:report_detail', report_id=report.id)
+    
+    section = request.GET.get('section', 'daily')
+    columns = REPORT_EXPORT_SECTIONS.get(section)
+    if columns is None:
+        messages.error(request, 'Unknown report section.')
+        return redirect('staff:report_detail', report_id=report.id)
+    
+    header = [title for title, _ in columns]
+    rows = ([item.get(key) for _, key in columns] for item in report.data.get(section, []))
+    return export_response(request, header, rows, f'report_{report.id}_{section}', section.title())
+
+def filter_staff_activities(request):
+    """Apply the activity log filters from the query string (shared by the list and its export)"""
     staff_id = request.GET.get('staff')
     action = request.GET.get('action')
     date_from = request.GET.get('date_from')
     date_to = request.GET.get('date_to')
     
     # Base queryset
-    activities = StaffLog.objects.all()
+    activities = StaffLog.objects.select_related('staff')
     
     # Apply filters
     if staff_id:
@@ -283,13 +311,27 @@ def staff_activity(request):
     if date_to:
         activities = activities.filter(created_at__date__lte=date_to)
     
-    activities = activities.order_by('-created_at')
+    return activities
+
+@login_required
+@user_passes_test(is_staff)
+def staff_activity(request):
+    # Get filter parameters
+    staff_id = request.GET.get('staff')
+    action = request.GET.get('action')
+    date_from = request.GET.get('date_from')
+    date_to = request.GET.get('date_to')
+    
+    activities = filter_staff_activities(request)
+    
+    page_obj = paginate_keyset(request, activities)
     
     # Get staff list for filter
     staff_list = StaffUser.objects.all()
     
     return render(request, 'staff/activity.html', {
-        'activities': activities,
+        'activities': page_obj.object_list,
+        'page_obj': page_obj,
         'staff_list': staff_list,
         'filters': {
             'staff_id': staff_id,
@@ -298,3 +340,17 @@ def staff_activity(request):
             'date_to': date_to
         }
     })
+
+@login_required
+@user_passes_test(is_staff)
+def staff_activity_export(request):
+    """Stream the filtered staff activity log as CSV/XLSX"""
+    activities = filter_staff_activities(request).order_by('-created_at', '-id')
+    columns = [
+        ('Date', 'created_at'),
+        ('Staff', 'staff__username'),
+        ('Action', 'action'),
+        ('Details', 'details'),
+        ('IP Address', 'ip_address'),
+    ]
+    return export_queryset(request, activities, columns, 'staff_activity', 'Activity')
@@ -0,0 +1,362 @@
+"""
+Load simulation of the QR ordering flow (see the benchmark_ordering command).
+
+Every simulated table is a separate client with its own cookies. It runs
+through the ordering flow that a diner's phone drives:
+
+    scan the QR code          tables:table_access
+    enter a phone number      customers:submit_phone_number
+    add items to the cart     tables:add_to_cart
+    change a quantity         tables:update_cart_item
+    remove an item            tables:remove_cart_item
+    refresh the cart badge    tables:get_cart_count
+    submit the order          tables:submit_order
+
+Staff clients take the submitted orders and move each one through preparing,
+ready and delivered with orders:management_order_update_status. All tables
+run at the same time.
+
+Requests go either through the ASGI test client, in-process (``AsgiTransport``),
+or to a running server over HTTP (``HttpTransport``). Query counts come from
+the Server-Timing header written by InstrumentationMiddleware
+(Dalooneh/instrumentation.py), so they are measured by the server itself in
+both modes. The in-process run turns the header on; a server benchmarked over
+HTTP needs PERF_SERVER_TIMING=True.
+
+``seed`` creates the simulated tables and menu, which is only done for a
+running server when asked to (--seed): without it the benchmark uses the
+tables and products that already exist. The superuser the staff clients log
+in as is created for the run and deleted afterwards.
+
+``run_benchmark`` returns a JSON-serializable result that can be saved as a
+baseline. ``compare`` lists where a later result has regressed against that
+baseline.
+"""
+
+import asyncio
+import http.cookies
+import json
+import random
+import re
+import secrets
+import string
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.urls import reverse
+
+from .models import Table
+
+BENCHMARK_CATEGORY = 'Benchmark'
+BENCHMARK_STAFF_PREFIX = 'benchmark-staff'
+
+# Latency regressions smaller than this are noise, whatever the tolerance
+LATENCY_NOISE_MS = 5
+
+_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+STAFF_STATUSES = ('preparing', 'ready', 'delivered')
+
+
+class Response:
+    __slots__ = ('status', 'headers', 'body')
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+    @property
+    def queries(self):
+        match = _QUERIES.search(self.headers.get('Server-Timing', ''))
+        return int(match.group(1)) if match else None
+
+
+class AsgiTransport:
+    """Sends requests through Django's ASGI test client, in this process"""
+
+    def __init__(self):
+        from django.test import AsyncClient
+        self.client = AsyncClient(raise_request_exception=False)
+
+    async def request(self, method, path, data=None, json_body=None):
+        if json_body is not None:
+            response = await self.client.generic(
+                method, path, json.dumps(json_body), content_type='application/json',
+            )
+        elif method == 'POST':
+            response = await self.client.post(path, data or {})
+        else:
+            response = await self.client.get(path, data or {})
+        return Response(response.status_code, response.headers, response.content)
+
+    async def login(self, user, password=None):
+        await self.client.aforce_login(user)
+
+
+class HttpTransport:
+    """Sends requests to a running server; redirects are not followed"""
+
+    class _NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(self._NoRedirect)
+        # Our own CSRF secret: Django only checks that the cookie and the header agree
+        csrf_secret = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(32))
+        self.cookies = {'csrftoken': csrf_secret}
+
+    def _send(self, method, path, data, json_body):
+        url = self.base_url + path
+        headers = {
+            'Cookie': '; '.join(f'{name}={value}' for name, value in self.cookies.items()),
+            'X-CSRFToken': self.cookies['csrftoken'],
+            'Origin': self.base_url,
+            'Referer': url,
+        }
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif method == 'POST':
+            body = urllib.parse.urlencode(data or {}).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif data:
+            url = f'{url}?{urllib.parse.urlencode(data)}'
+
+        request = urllib.request.Request(url, data=body, headers=headers, method=method)
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                status, response_headers, content = response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            status, response_headers, content = e.code, e.headers, e.read()
+
+        for header in response_headers.get_all('Set-Cookie') or []:
+            cookie = http.cookies.SimpleCookie(header)
+            for name, morsel in cookie.items():
+                self.cookies[name] = morsel.value
+        return Response(status, dict(response_headers.items()), content)
+
+    async def request(self, method, path, data=None, json_body=None):
+        return await asyncio.to_thread(self._send, method, path, data, json_body)
+
+    async def login(self, user, password=None):
+        response = await self.request('POST', reverse('management_login'), {
+            'username': user.username,
+            'password': password,
+            'next': '/staff/',
+        })
+        if response.status != 302:
+            raise RuntimeError(f'Could not log in as {user.username} (status {response.status})')
+
+
+class Recorder:
+    """Latency, status and query count of every request, by endpoint"""
+
+    def __init__(self):
+        self.samples = {}
+
+    async def call(self, transport, endpoint, method, path, data=None, json_body=None):
+        started = time.perf_counter()
+        response = await transport.request(method, path, data, json_body)
+        latency_ms = (time.perf_counter() - started) * 1000
+        self.samples.setdefault(endpoint, []).append((latency_ms, response.status, response.queries))
+        return response
+
+    def summary(self):
+        endpoints = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            latencies = sorted(sample[0] for sample in samples)
+            queries = [sample[2] for sample in samples if sample[2] is not None]
+            endpoints[endpoint] = {
+                'requests': len(samples),
+                'errors': sum(1 for sample in samples if sample[1] >= 400),
+                'p50_ms': round(percentile(latencies, 0.50), 2),
+                'p95_ms': round(percentile(latencies, 0.95), 2),
+                'p99_ms': round(percentile(latencies, 0.99), 2),
+                'max_ms': round(latencies[-1], 2),
+                'avg_queries': round(sum(queries) / len(queries), 2) if queries else None,
+                'max_queries': max(queries) if queries else None,
+            }
+        return endpoints
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of already sorted values"""
+    if not values:
+        return 0.0
+    rank = max(1, round(fraction * len(values) + 0.5))
+    return values[min(rank, len(values)) - 1]
+
+
+def seed(tables, products, first_table=1, create=True):
+    """
+    Make sure the simulated tables and enough active products exist; returns (table numbers, product ids).
+    With ``create=False`` nothing is written, and LookupError is raised when something is missing.
+    """
+    from menu.models import Category, Product
+
+    numbers = list(range(first_table, first_table + tables))
+    if create:
+        for number in numbers:
+            Table.objects.update_or_create(number=number, defaults={'is_active': True})
+    else:
+        existing = set(Table.objects.filter(number__in=numbers, is_active=True).values_list('number', flat=True))
+        missing = [number for number in numbers if number not in existing]
+        if missing:
+            raise LookupError(f'No active table numbered {", ".join(map(str, missing))}')
+
+    product_ids = list(Product.objects.filter(is_active=True).order_by('id').values_list('id', flat=True)[:products])
+    if len(product_ids) < products and not create:
+        raise LookupError(f'Only {len(product_ids)} active products, {products} needed')
+    if len(product_ids) < products:
+        category, _ = Category.objects.get_or_create(name=BENCHMARK_CATEGORY)
+        for index in range(len(product_ids), products):
+            product = Product.objects.create(
+                category=category,
+                name=f'{BENCHMARK_CATEGORY} product {index + 1}',
+                description='Created by the benchmark_ordering command',
+                price=Decimal(random.randint(50, 500)),
+            )
+            product_ids.append(product.id)
+    return numbers, product_ids
+
+
+def benchmark_staff(password):
+    """A new superuser for the staff clients to log in as; delete it when the run is over"""
+    return User.objects.create_superuser(
+        f'{BENCHMARK_STAFF_PREFIX}-{secrets.token_hex(4)}', email='', password=password,
+    )
+
+
+async def simulate_table(transport, recorder, number, product_ids, items, submitted):
+    """One diner's ordering flow at table ``number``; puts the submitted order id on ``submitted``"""
+    await recorder.call(transport, 'tables:table_access', 'GET', reverse('tables:table_access', args=[number]))
+    await recorder.call(transport, 'customers:submit_phone_number', 'POST', reverse('customers:submit_phone_number'), {
+        'phone_number': f'0935{number:07d}',
+    })
+
+    item_ids = []
+    for product_id in random.sample(product_ids, min(items, len(product_ids))):
+        response = await recorder.call(transport, 'tables:add_to_cart', 'POST', reverse('tables:add_to_cart'), {
+            'product_id': product_id,
+            'quantity': random.randint(1, 3),
+        })
+        if response.status == 200:
+            item_ids.append(response.json()['item_id'])
+
+    if item_ids:
+        await recorder.call(
+            transport, 'tables:update_cart_item', 'POST', reverse('tables:update_cart_item', args=[item_ids[0]]),
+            {'quantity': random.randint(2, 5)},
+        )
+    if len(item_ids) > 1:
+        await recorder.call(
+            transport, 'tables:remove_cart_item', 'POST', reverse('tables:remove_cart_item', args=[item_ids[-1]]),
+        )
+    await recorder.call(transport, 'tables:get_cart_count', 'GET', reverse('tables:get_cart_count'))
+
+    response = await recorder.call(transport, 'tables:submit_order', 'POST', reverse('tables:submit_order'), json_body={})
+    if response.status == 200:
+        await submitted.put(response.json()['order_id'])
+
+
+async def simulate_staff(transport, recorder, submitted):
+    """Advance every submitted order to delivered, until a None arrives on ``submitted``"""
+    while True:
+        order_id = await submitted.get()
+        if order_id is None:
+            return
+        path = reverse('orders:management_order_update_status', args=[order_id])
+        for status in STAFF_STATUSES:
+            await recorder.call(transport, 'orders:management_order_update_status', 'POST', path, {'status': status})
+
+
+async def _run(make_transport, numbers, product_ids, items, staff, staff_password, staff_workers):
+    recorder = Recorder()
+    submitted = asyncio.Queue()
+
+    staff_transports = [make_transport() for _ in range(staff_workers)]
+    for transport in staff_transports:
+        await transport.login(staff, staff_password)
+
+    started = time.perf_counter()
+    staff_tasks = [asyncio.create_task(simulate_staff(transport, recorder, submitted)) for transport in staff_transports]
+    await asyncio.gather(*[
+        simulate_table(make_transport(), recorder, number, product_ids, items, submitted)
+        for number in numbers
+    ])
+    for _ in staff_tasks:
+        await submitted.put(None)
+    await asyncio.gather(*staff_tasks)
+    elapsed = time.perf_counter() - started
+
+    endpoints = recorder.summary()
+    requests = sum(stats['requests'] for stats in endpoints.values())
+    return {
+        'requests': requests,
+        'errors': sum(stats['errors'] for stats in endpoints.values()),
+        'duration_s': round(elapsed, 3),
+        'throughput_rps': round(requests / elapsed, 2) if elapsed else None,
+        'endpoints': endpoints,
+    }
+
+
+def run_benchmark(numbers, product_ids, items=3, base_url=None, staff=None, staff_password=None, staff_workers=2):
+    """
+    Simulate one ordering round at every table in ``numbers``, through the
+    ASGI test client or, with ``base_url``, against a running server.
+    """
+    if base_url:
+        def make_transport():
+            return HttpTransport(base_url)
+        result = asyncio.run(_run(make_transport, numbers, product_ids, items, staff, staff_password, staff_workers))
+    else:
+        from Dalooneh import instrumentation
+
+        server_timing = instrumentation.PERF_SERVER_TIMING
+        instrumentation.PERF_SERVER_TIMING = True
+        try:
+            result = asyncio.run(_run(AsgiTransport, numbers, product_ids, items, staff, staff_password, staff_workers))
+        finally:
+            instrumentation.PERF_SERVER_TIMING = server_timing
+    result['config'] = {
+        'mode': 'http' if base_url else 'asgi',
+        'tables': len(numbers),
+        'items': items,
+        'staff_workers': staff_workers,
+    }
+    return result
+
+
+def compare(result, baseline, tolerance=0.25):
+    """Regressions of ``result`` against ``baseline``, as readable messages"""
+    regressions = []
+
+    if baseline.get('throughput_rps') and result['throughput_rps'] < baseline['throughput_rps'] * (1 - tolerance):
+        regressions.append(f"throughput {result['throughput_rps']} req/s, baseline {baseline['throughput_rps']} req/s")
+
+    for endpoint, before in baseline.get('endpoints', {}).items():
+        after = result['endpoints'].get(endpoint)
+        if after is None:
+            regressions.append(f'{endpoint}: not exercised')
+            continue
+        if after['errors'] > before['errors']:
+            regressions.append(f"{endpoint}: {after['errors']} errors, baseline {before['errors']}")
+        if before['max_queries'] is not None and (after['max_queries'] or 0) > before['max_queries']:
+            regressions.append(f"{endpoint}: up to {after['max_queries']} queries, baseline {before['max_queries']}")
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            limit = max(before[key] * (1 + tolerance), before[key] + LATENCY_NOISE_MS)
+            if after[key] > limit:
+                regressions.append(f'{endpoint}: {key} {after[key]}, baseline {before[key]}')
+    return regressions
@@ -0,0 +1,154 @@
+import contextlib
+import io
+import json
+import os
+import secrets
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings, setup_databases, teardown_databases
+
+from Dalooneh.database_url import SQLITE_ENGINE
+from tables.benchmark import benchmark_staff, compare, run_benchmark, seed
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulate tables scanning their QR codes, ordering and staff serving the orders, and report '
+        'throughput, latency percentiles and query counts per endpoint. By default requests go through '
+        'the ASGI test client against a temporary test database; with --url they go to a running local '
+        'server that uses the same database as this command. That database is only seeded with --seed; '
+        'otherwise its existing tables and products are used.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tables', type=int, default=10, help='Number of tables ordering at once (default: 10)')
+        parser.add_argument('--items', type=int, default=3, help='Products each table adds to its cart (default: 3)')
+        parser.add_argument('--products', type=int, default=8, help='Products on the simulated menu (default: 8)')
+        parser.add_argument('--staff-workers', type=int, default=2, help='Staff clients serving orders (default: 2)')
+        parser.add_argument(
+            '--url',
+            help='Base URL of a running server (e.g. http://127.0.0.1:8000); default: in-process ASGI',
+        )
+        parser.add_argument(
+            '--seed',
+            action='store_true',
+            help='With --url, create the simulated tables and products in the database if they are missing',
+        )
+        parser.add_argument(
+            '--first-table',
+            type=int,
+            default=1,
+            help='Number of the first simulated table (default: 1)',
+        )
+        parser.add_argument('--save-baseline', metavar='PATH', help='Write the result to PATH as the new baseline')
+        parser.add_argument('--baseline', metavar='PATH', help='Compare the result with the baseline at PATH')
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.25,
+            help='Allowed latency/throughput regression against the baseline, as a fraction (default: 0.25)',
+        )
+        parser.add_argument('--json', action='store_true', help='Print the full result as JSON')
+
+    def handle(self, *args, **options):
+        if options['tables'] < 1 or options['items'] < 1:
+            raise CommandError('--tables and --items must be at least 1')
+        baseline = self._load_baseline(options['baseline'])
+
+        if options['url']:
+            result = self._benchmark(options, base_url=options['url'], create=options['seed'])
+        else:
+            result = self._in_test_database(options)
+
+        self._report(result, options['json'])
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(result, f, indent=2, sort_keys=True)
+                f.write('\n')
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {options['save_baseline']}"))
+
+        if baseline is not None:
+            regressions = compare(result, baseline, options['tolerance'])
+            if regressions:
+                for regression in regressions:
+                    self.stderr.write(f'  {regression}')
+                raise CommandError(f'{len(regressions)} regression(s) against {options["baseline"]}')
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['baseline']}"))
+
+    def _benchmark(self, options, base_url=None, create=True):
+        try:
+            numbers, product_ids = seed(
+                options['tables'],
+                max(options['products'], options['items']),
+                first_table=options['first_table'],
+                create=create,
+            )
+        except LookupError as e:
+            raise CommandError(f'{e}; pass --seed to create the benchmark tables and products')
+        password = secrets.token_urlsafe(16)
+        staff = benchmark_staff(password)
+        self.stdout.write(
+            f"Simulating {len(numbers)} tables with {options['items']} items each "
+            f"({'HTTP ' + base_url if base_url else 'in-process ASGI'})"
+        )
+        try:
+            return run_benchmark(
+                numbers,
+                product_ids,
+                items=options['items'],
+                base_url=base_url,
+                staff=staff,
+                staff_password=password,
+                staff_workers=options['staff_workers'],
+            )
+        finally:
+            staff.delete()
+
+    def _in_test_database(self, options):
+        with tempfile.TemporaryDirectory() as directory:
+            for connection in connections.all():
+                # A file rather than SQLite's shared in-memory database, which locks whole tables
+                test_settings = connection.settings_dict['TEST']
+                if connection.settings_dict['ENGINE'] == SQLITE_ENGINE and not (test_settings.get('NAME') or test_settings.get('MIRROR')):
+                    test_settings['NAME'] = os.path.join(directory, f'benchmark_{connection.alias}.sqlite3')
+
+            old_config = setup_databases(verbosity=0, interactive=False)
+            try:
+                # The test client sends Host: testserver; the views print debugging output on every request
+                with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']), \
+                        contextlib.redirect_stdout(io.StringIO()):
+                    return self._benchmark(options)
+            finally:
+                teardown_databases(old_config, verbosity=0)
+
+    def _load_baseline(self, path):
+        if not path:
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read baseline {path}: {e}')
+
+    def _report(self, result, as_json):
+        if as_json:
+            self.stdout.write(json.dumps(result, indent=2, sort_keys=True))
+            return
+
+        self.stdout.write(
+            f"{'Endpoint':<42} {'reqs':>5} {'errs':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}"
+        )
+        for endpoint, stats in result['endpoints'].items():
+            queries = '-' if stats['avg_queries'] is None else f"{stats['avg_queries']:g}"
+            self.stdout.write(
+                f"{endpoint:<42} {stats['requests']:>5} {stats['errors']:>5} {stats['p50_ms']:>8.1f} "
+                f"{stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f} {queries:>8}"
+            )
+        self.stdout.write(
+            f"{result['requests']} requests, {result['errors']} errors in {result['duration_s']}s: "
+            f"{result['throughput_rps']} req/s"
+        )
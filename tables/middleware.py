@@ -1,10 +1,24 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.shortcuts import redirect
 from django.urls import resolve
 from django.contrib import messages
 from django.utils import timezone
 from django.urls import reverse
+import logging
 
-from .views import check_session, cleanup_cart_data
+from .views import acheck_session, aget_table_session, check_session, cleanup_cart_data, get_table_session
+
+logger = logging.getLogger(__name__)
+
+# Pages that require table authentication
+RESTRICTED_URLS = [
+    'menu:menu',
+    'menu:product_detail',
+    'orders:cart',
+    'orders:add_to_cart',
+    'orders:checkout',
+    'orders:order_detail',
+]
 
 
 class TableAuthMiddleware:
@@ -12,40 +26,43 @@ class TableAuthMiddleware:
     Middleware to ensure users have a valid table session before accessing ordering pages
     """
     
+    sync_capable = True
+    async_capable = True
+    
     def __init__(self, get_response):
         self.get_response = get_response
-        
-    def __call__(self, request):
+        if iscoroutinefunction(get_response):
+            # Under ASGI the session checks run on the event loop with the async ORM
+            markcoroutinefunction(self)
+    
+    def is_public(self, path):
+        """Paths that never need a table session"""
         # Skip middleware for admin pages, management pages, and static files
-        if (request.path.startswith('/admin/') or 
-            request.path.startswith('/static/') or 
-            request.path.startswith('/media/') or
-            '/management/' in request.path or
-            'management_' in request.path):
-            return self.get_response(request)
+        if (path.startswith('/admin/') or 
+            path.startswith('/static/') or 
+            path.startswith('/media/') or
+            '/management/' in path or
+            'management_' in path):
+            return True
             
         # Skip for the table access endpoints, token validation, and public pages
-        if request.path.startswith('/table/') or request.path.startswith('/api/token/') or request.path == '/':
-            return self.get_response(request)
+        if path.startswith('/table/') or path.startswith('/api/token/') or path == '/':
+            return True
             
         # Skip for test QR code page
-        if request.path.startswith('/test-qr/'):
-            return self.get_response(request)
+        if path.startswith('/test-qr/'):
+            return True
             
         # Skip for category views - allow public access to all category-related pages
-        if '/menu/category' in request.path:
+        return '/menu/category' in path
+        
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        
+        if self.is_public(request.path):
             return self.get_response(request)
             
-        # Pages that require table authentication
-        restricted_urls = [
-            'menu:menu',
-            'menu:product_detail',
-            'orders:cart',
-            'orders:add_to_cart',
-            'orders:checkout',
-            'orders:order_detail',
-        ]
-        
         # Check if current URL requires authentication
         try:
             current_url_name = resolve(request.path).url_name
@@ -55,7 +72,7 @@ class TableAuthMiddleware:
             if 'management' in current_url_name or request.user.is_staff or request.user.is_superuser:
                 return self.get_response(request)
             
-            if current_url_name in restricted_urls or view_name in restricted_urls:
+            if current_url_name in RESTRICTED_URLS or view_name in RESTRICTED_URLS:
                 is_valid, table = check_session(request)
                 
                 if not is_valid:
@@ -76,11 +93,12 @@ class TableAuthMiddleware:
             try:
                 from .models import TableSession
                 
-                session = TableSession.objects.get(token=token)
+                # Shared with check_session above and the views
+                session = get_table_session(request, token)
                 
                 # If session has expired, clean up cart and session data
                 if session.is_expired():
-                    print(f"MIDDLEWARE: Session {token} expired, cleaning up cart data")
+                    logger.debug("Session %s expired, cleaning up cart data", token)
                     cleanup_cart_data(request, token)
                     
                     # Don't redirect if on the order summary page
@@ -101,16 +119,85 @@ class TableAuthMiddleware:
                         )
             except TableSession.DoesNotExist:
                 # Session token not valid, clear session data
-                print(f"MIDDLEWARE: Invalid session token {token}, cleaning up cart data")
+                logger.debug("Invalid session token %s, cleaning up cart data", token)
                 cleanup_cart_data(request, token)
                 
                 # Don't redirect if on the order summary page
                 if not request.path.startswith('/menu/'):
                     messages.warning(request, 'Your session is not valid. Please scan the QR code again.')
-            except Exception as e:
-                print(f"ERROR in TableSessionMiddleware: {str(e)}")
+            except Exception:
                 # No need to handle this further, let the view handle it
-                pass
+                logger.exception("TableSessionMiddleware could not check the table session")
             
         response = self.get_response(request)
-        return response 
\ No newline at end of file
+        return response 
+
+    async def __acall__(self, request):
+        if self.is_public(request.path):
+            return await self.get_response(request)
+        
+        user = await request.auser()
+        is_staff = user.is_staff or user.is_superuser
+        
+        # Check if current URL requires authentication
+        try:
+            match = resolve(request.path)
+            current_url_name = match.url_name
+            view_name = match.view_name
+        except Exception:
+            # If URL resolution fails, just continue
+            current_url_name = view_name = None
+        
+        # Skip for management views and admin users
+        if (current_url_name and 'management' in current_url_name) or is_staff:
+            return await self.get_response(request)
+        
+        if current_url_name in RESTRICTED_URLS or view_name in RESTRICTED_URLS:
+            is_valid, table = await acheck_session(request)
+            
+            if not is_valid:
+                messages.error(request, "To view the menu and place orders, please first scan the QR code on your table.")
+                return redirect('home')  # Redirect to home page
+            
+            # Add table to request for easy access in views
+            request.table = table
+        
+        # Check if session is about to expire
+        token = await request.session.aget('table_token')
+        if token:
+            from .models import TableSession
+            try:
+                session = await aget_table_session(request, token)
+                remaining = session.expires_at - timezone.now()
+                
+                # If session has expired, clean up cart and session data (this also deactivates it)
+                if remaining.total_seconds() < 0:
+                    logger.debug("Session %s expired, cleaning up cart data", token)
+                    await sync_to_async(cleanup_cart_data)(request, token)
+                    
+                    # Don't redirect if on the order summary page
+                    if 'order-summary' not in request.path:
+                        messages.warning(request, 'Your order selection time has expired. Please scan the QR code again.')
+                
+                # If session is almost expired (within 2 minutes), send a warning
+                elif remaining < timezone.timedelta(minutes=2):
+                    remaining_minutes = max(1, int(remaining.total_seconds() / 60))
+                    
+                    # Add warning to display to the user (if not already on order summary)
+                    if 'order-summary' not in request.path:
+                        messages.warning(
+                            request, 
+                            f'Your order selection time will expire in {remaining_minutes} minutes. Please submit your order.'
+                        )
+            except TableSession.DoesNotExist:
+                # Session token not valid, clear session data
+                logger.debug("Invalid session token %s, cleaning up cart data", token)
+                await sync_to_async(cleanup_cart_data)(request, token)
+                
+                # Don't redirect if on the order summary page
+                if not request.path.startswith('/menu/'):
+                    messages.warning(request, 'Your session is not valid. Please scan the QR code again.')
+            except Exception:
+                logger.exception("Could not check table session %s", token)
+        
+        return await self.get_response(request)
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tablesession',
+            index=models.Index(fields=['created_at', 'id'], name='tablesession_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tablesession',
+            index=models.Index(fields=['expires_at'], name='tablesession_expires_idx'),
+        ),
+    ]
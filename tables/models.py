@@ -1,3 +1,4 @@
+from asgiref.sync import sync_to_async
 from django.db import models
 import uuid
 import datetime
@@ -6,6 +7,7 @@ from django.urls import reverse
 from django.conf import settings
 from io import BytesIO
 from django.core.files.base import ContentFile
+import logging
 import os
 
 # Try to import qrcode but make it optional
@@ -15,6 +17,52 @@ try:
 except ImportError:
     QRCODE_AVAILABLE = False
 
+logger = logging.getLogger(__name__)
+
+# Orders that keep a table occupied
+OPEN_ORDER_STATUSES = ('pending', 'confirmed', 'preparing', 'ready')
+
+
+class TableQuerySet(models.QuerySet):
+    def with_open_orders(self):
+        """Prefetch each table's open orders, so is_occupied and current_order run no query per table"""
+        from orders.models import Order
+        return self.prefetch_related(models.Prefetch(
+            'orders',
+            queryset=Order.objects.filter(status__in=OPEN_ORDER_STATUSES).select_related('customer__user'),
+            to_attr='open_orders',
+        ))
+
+    def free(self):
+        """
+        Free the tables: deactivate their sessions and cancel their open orders.
+        Returns the ids of the cancelled orders.
+        """
+        from Dalooneh.cache import tables as tables_cache
+        # update() skips post_save, which is what drops the cached token validations
+        if TableSession.objects.filter(table__in=self, is_active=True).update(is_active=False):
+            tables_cache.invalidate()
+        return self.cancel_orders(OPEN_ORDER_STATUSES)
+
+    def cancel_orders(self, statuses):
+        """
+        Cancel the tables' orders in ``statuses`` and empty the carts of the pending ones.
+        Returns the ids of the cancelled orders.
+        """
+        from orders.kitchen import cancel_orders
+        from orders.models import Order, OrderItem
+        orders = list(Order.objects.filter(table__in=self, status__in=statuses).values_list('id', 'status'))
+        if not orders:
+            return []
+
+        cancelled = cancel_orders([order_id for order_id, _ in orders])
+        pending_ids = [order_id for order_id, status in orders if status == 'pending']
+        if pending_ids:
+            OrderItem.objects.filter(order_id__in=pending_ids).delete()
+            Order.objects.filter(id__in=pending_ids).update(total_amount=0, final_amount=0)
+        return cancelled
+
+
 # Create your models here.
 
 class Table(models.Model):
@@ -26,11 +74,16 @@ class Table(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = TableQuerySet.as_manager()
+
     def __str__(self):
         return f'Table {self.number}'
     
-    def generate_qr_code(self):
-        """Generate QR code for table access - only generates if no QR code exists yet"""
+    def generate_qr_code(self, save=True):
+        """
+        Generate QR code for table access - only generates if no QR code exists yet.
+        With save=False the table itself is not saved (e.g. to save many tables at once).
+        """
         # If QR code already exists, don't regenerate it
         if self.qr_code:
             return self.qr_code.url
@@ -61,7 +114,8 @@ class Table(models.Model):
         
         # Save QR code with permanent name
         self.qr_code.save(filename, ContentFile(buffer.getvalue()), save=False)
-        self.save()
+        if save:
+            self.save()
         
         return self.qr_code.url
     
@@ -87,33 +141,22 @@ class Table(models.Model):
         A table is considered occupied only when it has an active order.
         Just having an active session doesn't mean the table is occupied.
         """
-        return self.orders.filter(status__in=['pending', 'confirmed', 'preparing', 'ready']).exists()
+        if hasattr(self, 'open_orders'):
+            return bool(self.open_orders)
+        return self.orders.filter(status__in=OPEN_ORDER_STATUSES).exists()
     
     def free_table(self):
         """
         Free the table by deactivating any active sessions and cancelling all active orders
         """
-        # First deactivate any active session
-        active_session = self.get_active_session()
-        if active_session:
-            active_session.deactivate()
-            
-        # Then cancel all active orders for this table (important for orders in confirmed/preparing/ready status)
-        from orders.models import Order
-        active_orders = Order.objects.filter(
-            table=self,
-            status__in=['pending', 'confirmed', 'preparing', 'ready']
-        )
-        
-        for order in active_orders:
-            order.status = 'cancelled'
-            order.save(update_fields=['status'])
-            print(f"DEBUG: Cancelled order {order.id} for table {self.number}")
+        Table.objects.filter(pk=self.pk).free()
     
     @property
     def current_order(self):
         """Get current order for table"""
-        return self.orders.filter(status__in=['pending', 'confirmed', 'preparing', 'ready']).first()
+        if hasattr(self, 'open_orders'):
+            return self.open_orders[0] if self.open_orders else None
+        return self.orders.filter(status__in=OPEN_ORDER_STATUSES).first()
     
     @property
     def last_order_time(self):
@@ -154,6 +197,10 @@ class TableSession(models.Model):
     class Meta:
         verbose_name = "Table Session"
         verbose_name_plural = "Table Sessions"
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='tablesession_created_id_idx'),
+            models.Index(fields=['expires_at'], name='tablesession_expires_idx'),
+        ]
     
     def __str__(self):
         return f"Table {self.table.number} Session"
@@ -178,45 +225,34 @@ class TableSession(models.Model):
         """Check if session is valid"""
         return self.is_active and not self.is_expired()
     
+    async def ais_valid(self):
+        """Async is_valid"""
+        if not self.is_active:
+            return False
+        if timezone.now() > self.expires_at:
+            # Deactivating cancels the table's pending orders; run it in a worker thread
+            await sync_to_async(self.deactivate)()
+            return False
+        return True
+    
     def update_last_used(self):
         """Update last used timestamp"""
         self.last_used = timezone.now()
         self.save(update_fields=['last_used'])
     
+    async def aupdate_last_used(self):
+        """Async update_last_used, as a single UPDATE"""
+        self.last_used = timezone.now()
+        await TableSession.objects.filter(pk=self.pk).aupdate(last_used=self.last_used)
+    
     def deactivate(self):
         """Deactivate session"""
-        print(f"DEBUG: Deactivating session {self.token} for table {self.table.number}")
+        logger.debug("Deactivating session %s for table %s", self.token, self.table_id)
         self.is_active = False
         self.save(update_fields=['is_active'])
         
-        # Clear any cart items for this table's pending orders
-        from orders.models import Order
-        pending_orders = Order.objects.filter(
-            table=self.table,
-            status='pending'
-        )
-        
-        # Cancel pending orders to properly free the table
-        for order in pending_orders:
-            if order.status == 'pending':
-                order.status = 'cancelled'
-                order.save(update_fields=['status'])
-        
-        if pending_orders.exists():
-            print(f"DEBUG: Cleaning up {pending_orders.count()} pending orders for table {self.table.number}")
-            for order in pending_orders:
-                # Delete all order items
-                item_count = order.items.count()
-                if item_count > 0:
-                    print(f"DEBUG: Deleting {item_count} items from order {order.id}")
-                    order.items.all().delete()
-                # Update order totals
-                order.total_amount = 0
-                order.final_amount = 0
-                order.save(update_fields=['total_amount', 'final_amount'])
-                print(f"DEBUG: Reset order {order.id} totals to 0")
-        else:
-            print(f"DEBUG: No pending orders found for table {self.table.number}")
+        # Cancel pending orders to properly free the table, and clear their cart items
+        Table.objects.filter(pk=self.table_id).cancel_orders(['pending'])
     
     def mark_order_submitted(self):
         """Mark that an order has been submitted for this session"""
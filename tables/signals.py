@@ -0,0 +1,18 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from Dalooneh.cache import tables as tables_cache
+
+from .models import Table, TableSession
+
+
+@receiver(post_save, sender=Table)
+@receiver(post_delete, sender=Table)
+@receiver(post_save, sender=TableSession)
+@receiver(post_delete, sender=TableSession)
+def invalidate_tables_cache(sender, update_fields=None, **kwargs):
+    """Cached token validations are dropped whenever a table or session changes state"""
+    # Every validated request touches last_used; that alone changes nothing cached
+    if update_fields is not None and set(update_fields) <= {'last_used'}:
+        return
+    tables_cache.invalidate()
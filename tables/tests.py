@@ -1,3 +1,156 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from customers.models import Discount
+from menu.models import Category, Product
+from orders.models import Order
+
+from . import benchmark
+from .management.commands import benchmark_ordering
+from .models import Table
+
+
+class TableSessionTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.table = Table.objects.create(number=1)
+        category = Category.objects.create(name='Mains')
+        cls.product = Product.objects.create(category=category, name='Stew', description='Stew', price=Decimal('10.00'))
+
+    def setUp(self):
+        self.table_session = self.table.get_or_create_active_session()
+        session = self.client.session
+        session['table_token'] = str(self.table_session.token)
+        session.save()
+
+
+class CartTests(TableSessionTestCase):
+    """The async cart views keep the order totals and the cart count in step with the items"""
+
+    async def post(self, name, data, **kwargs):
+        self.async_client.cookies = self.client.cookies
+        response = await self.async_client.post(reverse(name, kwargs=kwargs), data)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    async def test_changing_quantities_re_evaluates_the_discount(self):
+        now = timezone.now()
+        await Discount.objects.acreate(code='BIG', discount_type='fixed', fixed_amount=Decimal('15.00'),
+                                       min_order_amount=Decimal('20.00'), valid_from=now - datetime.timedelta(days=1),
+                                       valid_to=now + datetime.timedelta(days=1))
+        order = await Order.objects.acreate(table=self.table, total_amount=0, final_amount=0, discount_code='BIG')
+
+        added = await self.post('tables:add_to_cart', {'product_id': self.product.pk, 'quantity': 3})
+        self.assertEqual((added['cart_count'], added['order_total']), (3, 15.0))
+
+        updated = await self.post('tables:update_cart_item', {'quantity': 1}, item_id=added['item_id'])
+        self.assertEqual((updated['cart_count'], updated['order_total']), (1, 10.0))
+        await order.arefresh_from_db()
+        self.assertEqual((order.discount_amount, order.final_amount), (Decimal('0'), Decimal('10.00')))
+
+        removed = await self.post('tables:remove_cart_item', {}, item_id=added['item_id'])
+        self.assertEqual((removed['cart_count'], removed['order_total'], removed['empty_cart']), (0, 0.0, True))
+
+
+class SubmitOrderTests(TableSessionTestCase):
+    """Submitting a table's order writes the order and its items in one transaction"""
+
+    def submit(self, order_data):
+        return self.client.post(reverse('tables:submit_order'), json.dumps(order_data), content_type='application/json')
+
+    def test_failed_item_does_not_break_the_order(self):
+        with self.assertLogs('tables.views', 'ERROR') as logs:
+            response = self.submit({
+                'total_amount': '10.00',
+                'final_amount': '10.00',
+                'items': [
+                    {'product_id': self.product.pk, 'quantity': 1, 'price': '10.00'},
+                    # A second line for the same product violates the unique item constraint
+                    {'product_id': self.product.pk, 'quantity': 2, 'price': '10.00'},
+                ],
+            })
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(response.status_code, 200, response.content)
+        order = Order.objects.get(pk=response.json()['order_id'])
+        self.assertEqual(order.status, 'confirmed')
+        self.assertEqual(order.items.count(), 1)
+
+    def test_pending_order_is_confirmed(self):
+        order = Order.objects.create(table=self.table, total_amount=0, final_amount=0)
+        with self.assertLogs('tables.views', 'WARNING'):
+            response = self.submit({})
+        self.assertEqual(response.json()['order_id'], order.pk)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'confirmed')
+
+
+class FreeTableTests(TableSessionTestCase):
+    """Freeing tables deactivates their sessions and cancels their open orders in bulk"""
+
+    def test_free_table_cancels_open_orders_and_empties_the_cart(self):
+        cart = Order.objects.create(table=self.table, total_amount=Decimal('10.00'), final_amount=Decimal('10.00'))
+        cart.items.create(product=self.product, quantity=1, price=Decimal('10.00'))
+        Order.objects.filter(pk=cart.pk).update(created_at=timezone.now() - datetime.timedelta(minutes=1))
+        submitted = Order.objects.create(table=self.table, status='confirmed', total_amount=0, final_amount=0)
+
+        self.assertEqual(Table.objects.with_open_orders().get(pk=self.table.pk).current_order, submitted)
+        self.table.free_table()
+
+        self.table_session.refresh_from_db()
+        self.assertFalse(self.table_session.is_active)
+        cart.refresh_from_db()
+        submitted.refresh_from_db()
+        self.assertEqual((cart.status, cart.final_amount, cart.items.count()), ('cancelled', Decimal('0'), 0))
+        self.assertEqual(submitted.status, 'cancelled')
+        self.assertIsNotNone(submitted.cancelled_at)
+        self.assertTrue(submitted.events.filter(old_status='confirmed', new_status='cancelled').exists())
+        self.assertFalse(self.table.is_occupied)
+
+    def test_free_leaves_other_tables_alone(self):
+        other = Table.objects.create(number=2)
+        order = Order.objects.create(table=other, status='preparing', total_amount=0, final_amount=0)
+        Order.objects.create(table=self.table, status='ready', total_amount=0, final_amount=0)
+
+        Table.objects.filter(pk=self.table.pk).free()
+
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'preparing')
+        self.assertEqual([table.is_occupied for table in Table.objects.with_open_orders().order_by('number')], [False, True])
+
+
+class BenchmarkCommandTests(TransactionTestCase):
+    """benchmark_ordering runs the whole ordering flow in-process and leaves nothing behind"""
+
+    def run_command(self, *args, **options):
+        out = io.StringIO()
+        # Run against this test's database instead of creating another one, with the
+        # allowed hosts of a real run rather than the test runner's
+        with mock.patch.object(benchmark_ordering, 'setup_databases'), \
+                mock.patch.object(benchmark_ordering, 'teardown_databases'), \
+                override_settings(ALLOWED_HOSTS=['localhost']):
+            call_command('benchmark_ordering', *args, stdout=out, **options)
+        return out.getvalue()
+
+    def test_in_process_run(self):
+        output = self.run_command(tables=1, items=2, products=2, staff_workers=1, json=True)
+
+        result = json.loads(output[output.index('{'):])
+        self.assertEqual(result['errors'], 0)
+        self.assertEqual(result['endpoints']['tables:submit_order']['requests'], 1)
+        self.assertEqual(result['endpoints']['orders:management_order_update_status']['requests'], 3)
+        self.assertFalse(User.objects.filter(username__startswith=benchmark.BENCHMARK_STAFF_PREFIX).exists())
+
+    def test_server_database_is_only_seeded_when_asked(self):
+        with self.assertRaisesMessage(CommandError, 'pass --seed'):
+            self.run_command(url='http://127.0.0.1:1', tables=1)
+        self.assertFalse(Table.objects.exists())
+        self.assertFalse(User.objects.exists())
@@ -7,7 +7,7 @@ urlpatterns = [
     # Table access and QR code
     path('access/<int:table_number>/', views.table_access, name='table_access'),
     path('validate/<str:token>/', views.validate_token, name='validate_token'),
-    path('check-session/', views.check_session, name='check_session'),
+    path('check-session/', views.session_status, name='check_session'),
     path('generate-qr/<int:table_id>/', views.generate_qr_data, name='generate_qr'),
     path('status/<int:table_id>/', views.table_status, name='table_status'),
     
@@ -1,23 +1,35 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib import messages
 from django.urls import reverse
 from django.http import HttpResponse, Http404, JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
-from django.views.decorators.cache import cache_page
-from django.core.cache import cache
+from django.utils.cache import patch_response_headers
+from Dalooneh.cache import tables as tables_cache
 import qrcode
 from io import BytesIO
 from django.core.files.base import ContentFile
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 import os
 import json
 from django.views.decorators.http import require_POST, require_GET
 import uuid
+import logging
 from Dalooneh.decorators import superuser_required
+from Dalooneh.pagination import paginate_keyset
+from Dalooneh.db import write_transaction
 
-from .models import Table, TableSession
-from staff.models import StaffLog
+from .models import OPEN_ORDER_STATUSES, Table, TableSession
+from staff.audit import audit_log
+from customers.resolver import normalize_phone, resolver
+
+logger = logging.getLogger(__name__)
+
+# Token validation responses are cached for 1 minute, or until a table or session changes
+VALIDATE_TOKEN_CACHE_SECONDS = 60
 
 
 def table_access(request, table_number):
@@ -32,9 +44,10 @@ def table_access(request, table_number):
     old_token = request.session.get('table_token')
     old_table_id = request.session.get('table_id')
     
-    # If there's an old session or the table has changed, clean up before creating a new session
-    if old_token or (old_table_id and old_table_id != table.id):
-        print(f"DEBUG: Table changed or new session - cleaning up old cart data")
+    # If there's an old session at another table, clean up before creating a new session
+    # (freeing the table below already cleans up this table's carts)
+    if old_token and old_table_id != table.id:
+        logger.debug("Table changed or new session, cleaning up old cart data")
         cleanup_cart_data(request, old_token, table.id)
     
     # Free the table if it's occupied (most important part)
@@ -51,11 +64,11 @@ def table_access(request, table_number):
     
     # Set flag to show phone number modal after redirection
     request.session['show_phone_modal'] = True
-    print("DEBUG: Setting show_phone_modal = True")
+    logger.debug("Setting show_phone_modal")
     
     # Log table access
     if request.user.is_authenticated and hasattr(request.user, 'staff'):
-        StaffLog.objects.create(
+        audit_log(
             staff=request.user.staff,
             action='table_access',
             details=f'Table {table.number} accessed via QR code',
@@ -71,54 +84,92 @@ def table_access(request, table_number):
     return redirect('/')
 
 
-@cache_page(60)  # Cache for 1 minute
-def validate_token(request, token):
+async def validate_token(request, token):
     """
     Validate a token directly (used for API validation)
     """
+    cache_key = f'token:{token}'
+    payload = await tables_cache.aget(cache_key)
+    if payload is None:
+        payload = await _validate_token_payload(request, token)
+        await tables_cache.aset(cache_key, payload, VALIDATE_TOKEN_CACHE_SECONDS)
+    
+    response = JsonResponse(payload)
+    patch_response_headers(response, VALIDATE_TOKEN_CACHE_SECONDS)
+    return response
+
+
+async def _validate_token_payload(request, token):
     try:
-        session = TableSession.objects.get(token=token)
+        session = await aget_table_session(request, token)
         
         # Check if session is valid
         if not session.is_active:
-            return JsonResponse({
+            return {
                 'valid': False,
                 'error': 'This session has been deactivated.'
-            })
+            }
         
-        if session.is_expired():
-            # Automatically deactivate expired sessions
-            session.deactivate()
-            return JsonResponse({
+        if not await session.ais_valid():
+            # ais_valid deactivates expired sessions
+            return {
                 'valid': False,
                 'error': 'The time limit for using this session has expired.',
                 'is_expired': True
-            })
+            }
         
         # Update last used time
-        session.update_last_used()
+        await session.aupdate_last_used()
         
         # Get table status
+        from orders.models import Order
+        active_orders = Order.objects.filter(
+            table=session.table,
+            status__in=['pending', 'confirmed', 'preparing', 'ready']
+        )
+        current_order = await active_orders.afirst()
+        last_order = await Order.objects.filter(table=session.table).order_by('-created_at').afirst()
         table_status = {
-            'is_occupied': session.table.is_occupied,
+            'is_occupied': current_order is not None,
             'has_active_order': session.order_submitted,
-            'current_order': session.table.current_order.id if session.table.current_order else None,
-            'last_order_time': session.table.last_order_time.isoformat() if session.table.last_order_time else None
+            'current_order': current_order.id if current_order else None,
+            'last_order_time': last_order.created_at.isoformat() if last_order else None
         }
         
-        return JsonResponse({
+        return {
             'valid': True,
             'table_number': session.table.number,
             'token': token,
             'table_status': table_status,
             'expires_at': session.expires_at.isoformat()
-        })
+        }
         
     except TableSession.DoesNotExist:
-        return JsonResponse({
+        return {
             'valid': False,
             'error': 'Invalid token.'
-        })
+        }
+
+
+def get_table_session(request, token):
+    """
+    The TableSession for ``token``. It is fetched once per request: TableAuthMiddleware
+    and the views all reuse the one kept on the request.
+    """
+    session = getattr(request, 'table_session', None)
+    if session is None or str(session.token) != str(token):
+        session = TableSession.objects.select_related('table').get(token=token)  # Django will automatically convert string to UUID
+        request.table_session = session
+    return session
+
+
+async def aget_table_session(request, token):
+    """Async get_table_session"""
+    session = getattr(request, 'table_session', None)
+    if session is None or str(session.token) != str(token):
+        session = await TableSession.objects.select_related('table').aget(token=token)
+        request.table_session = session
+    return session
 
 
 def check_session(request):
@@ -132,16 +183,16 @@ def check_session(request):
         return False, None
     
     try:
-        session = TableSession.objects.get(token=token)  # Django will automatically convert string to UUID
+        session = get_table_session(request, token)
         
         # This will automatically deactivate and clean cart if expired
         if session.is_expired():
-            print(f"DEBUG: Session {token} has expired in check_session")
+            logger.debug("Session %s has expired in check_session", token)
             cleanup_cart_data(request, token)
             return False, None
             
         if not session.is_active:
-            print(f"DEBUG: Session {token} is not active in check_session")
+            logger.debug("Session %s is not active in check_session", token)
             cleanup_cart_data(request, token)
             return False, None
             
@@ -150,11 +201,50 @@ def check_session(request):
         return True, session.table
         
     except TableSession.DoesNotExist:
-        print(f"DEBUG: Session {token} not found in check_session")
+        logger.debug("Session %s not found in check_session", token)
         clear_session_data(request)
         return False, None
 
 
+async def acheck_session(request):
+    """
+    Async check_session for async views and middleware
+    Returns (is_valid, table_obj)
+    """
+    token = await request.session.aget('table_token')
+    
+    if not token:
+        return False, None
+    
+    try:
+        session = await aget_table_session(request, token)
+        
+        # This will automatically deactivate an expired session
+        if not await session.ais_valid():
+            logger.debug("Session %s has expired or is not active", token)
+            await sync_to_async(cleanup_cart_data)(request, token)
+            return False, None
+            
+        # Session is valid, update last_used timestamp
+        await session.aupdate_last_used()
+        return True, session.table
+        
+    except TableSession.DoesNotExist:
+        logger.debug("Session %s not found", token)
+        await aclear_session_data(request)
+        return False, None
+
+
+@require_GET
+def session_status(request):
+    """Whether the request has a valid table session, as JSON"""
+    is_valid, table = check_session(request)
+    return JsonResponse({
+        'valid': is_valid,
+        'table_number': table.number if table else None
+    })
+
+
 def clear_session_data(request):
     """Remove session data related to table"""
     keys = ['table_token', 'table_number', 'table_id']
@@ -163,6 +253,12 @@ def clear_session_data(request):
             del request.session[key]
 
 
+async def aclear_session_data(request):
+    """Async clear_session_data"""
+    for key in ['table_token', 'table_number', 'table_id']:
+        await request.session.apop(key, None)
+
+
 @login_required
 def generate_qr_data(request, table_id):
     """Generate a QR code data for a table"""
@@ -177,13 +273,14 @@ def generate_qr_data(request, table_id):
     qr_url = f"http://{host}{table.get_access_url()}"
     
     # Log QR code generation
-    StaffLog.objects.create(
-        staff=request.user.staff,
-        action='qr_generate',
-        details=f'QR code generated for table {table.number}',
-        ip_address=request.META.get('REMOTE_ADDR'),
-        user_agent=request.META.get('HTTP_USER_AGENT', '')
-    )
+    if hasattr(request.user, 'staff'):
+        audit_log(
+            staff=request.user.staff,
+            action='qr_generate',
+            details=f'QR code generated for table {table.number}',
+            ip_address=request.META.get('REMOTE_ADDR'),
+            user_agent=request.META.get('HTTP_USER_AGENT', '')
+        )
     
     return HttpResponse(qr_url, content_type='text/plain')
 
@@ -191,17 +288,18 @@ def generate_qr_data(request, table_id):
 @login_required
 def table_status(request, table_id):
     """Get current status of a table"""
-    table = get_object_or_404(Table, id=table_id)
+    table = get_object_or_404(Table.objects.with_open_orders(), id=table_id)
     
     # Get active session if exists
     active_session = table.get_active_session()
+    last_order_time = table.last_order_time
     
     status = {
         'number': table.number,
         'is_active': table.is_active,
         'is_occupied': table.is_occupied,
         'current_order': table.current_order.id if table.current_order else None,
-        'last_order_time': table.last_order_time.isoformat() if table.last_order_time else None,
+        'last_order_time': last_order_time.isoformat() if last_order_time else None,
         'active_session': {
             'token': active_session.token,
             'created_at': active_session.created_at.isoformat(),
@@ -256,7 +354,7 @@ def create_test_qr(request):
     
     # Log test QR creation
     if request.user.is_authenticated and hasattr(request.user, 'staff'):
-        StaffLog.objects.create(
+        audit_log(
             staff=request.user.staff,
             action='test_qr_create',
             details=f'Test QR code created for table {table.number}',
@@ -276,6 +374,106 @@ def create_test_qr(request):
     return render(request, 'tables/test_qr.html', context)
 
 
+@write_transaction
+def _confirm_existing_order(order_id):
+    """Confirm the order the diner submitted; returns None if it does not exist"""
+    from orders.models import Order
+    
+    try:
+        # The confirmation notification reads the table and the customer's name
+        order = Order.objects.select_related('table', 'customer__user').get(id=order_id)
+    except Order.DoesNotExist:
+        logger.debug("Order %s not found", order_id)
+        return None
+    logger.debug("Found existing order %s", order.id)
+    
+    # Clean up duplicates before confirming the order
+    cleanup_duplicates(order)
+    
+    # Change status from pending to confirmed
+    if order.status == 'pending':
+        order.status = 'confirmed'
+        order.save(update_fields=['status'])
+        logger.debug("Confirmed order %s", order.id)
+    else:
+        logger.debug("Order %s already has status %r, not changing", order.id, order.status)
+    return order
+
+
+@write_transaction
+def _confirm_table_order(session, customer, order_data):
+    """Confirm the table's pending order, or create a confirmed one from the submitted items"""
+    from orders.models import Order, OrderItem
+    from menu.models import Product
+    
+    # Find the existing pending order for this table
+    existing_order = Order.objects.filter(
+        table=session.table,
+        status='pending'
+    ).first()
+    
+    if existing_order:
+        # Use the existing order and update its status
+        new_order = existing_order
+        logger.debug("Using existing pending order %s", new_order.id)
+        
+        # Attach the customer if the diner identified themselves after the order was started
+        if customer and new_order.customer_id != customer.id:
+            logger.debug("Updating order %s customer from %s to %s", new_order.id, new_order.customer_id, customer.id)
+            new_order.customer = customer
+            # Re-evaluate the discount for the customer before the order is confirmed
+            new_order.recalculate_totals(save=False)
+        
+        # Set status to confirmed
+        if new_order.status == 'pending':
+            new_order.status = 'confirmed'
+        
+        new_order.save()
+        logger.debug("Confirmed existing order %s", new_order.id)
+        
+        # Make sure order items are present and correct
+        if new_order.items.count() == 0:
+            logger.warning("Order %s has no items, but should have items in cart", new_order.id)
+        return new_order
+    
+    # Create a new order from scratch
+    logger.debug("Creating new order for table %s", session.table.number)
+    new_order = Order.objects.create(
+        customer=customer,
+        table=session.table,
+        status='confirmed',  # Set status directly to confirmed
+        total_amount=order_data.get('total_amount', 0),
+        discount_amount=order_data.get('discount_amount', 0),
+        final_amount=order_data.get('final_amount', 0),
+        notes=order_data.get('notes', '')
+    )
+    logger.debug("Created new order %s for customer %s", new_order.id, customer.id if customer else 'guest')
+    
+    if 'items' in order_data:
+        logger.debug("Creating %s items for new order %s", len(order_data['items']), new_order.id)
+        
+        # Create order items; each in its own savepoint, so a failed item does not break the transaction
+        for item_data in order_data.get('items', []):
+            try:
+                product = Product.objects.get(id=item_data['product_id'])
+                with transaction.atomic():
+                    OrderItem.objects.create(
+                        order=new_order,
+                        product=product,
+                        quantity=item_data['quantity'],
+                        price=item_data['price'],
+                        notes=item_data.get('notes', '')
+                    )
+                logger.debug("Added item product=%s, qty=%s", product.id, item_data['quantity'])
+            except Product.DoesNotExist:
+                logger.error("Product %s not found", item_data['product_id'])
+            except Exception:
+                logger.exception("Could not create order item for product %s", item_data.get('product_id'))
+    else:
+        logger.warning("No items in the submitted order data")
+    return new_order
+
+
 def submit_order(request):
     """
     Handle order submission from a table session
@@ -289,8 +487,8 @@ def submit_order(request):
         return JsonResponse({'success': False, 'error': 'Invalid session'}, status=400)
     
     try:
-        session = TableSession.objects.get(token=token)
-        print(f"DEBUG: Processing submit_order for session {session.token}, table {session.table.number}")
+        session = get_table_session(request, token)
+        logger.debug("Processing submit_order for session %s, table %s", session.token, session.table.number)
         
         # Check if session is valid
         if not session.is_valid():
@@ -302,178 +500,38 @@ def submit_order(request):
         # Get order data from request
         try:
             order_data = json.loads(request.body)
-            print(f"DEBUG: Received order data: {order_data}")
         except json.JSONDecodeError as e:
-            print(f"ERROR: Invalid JSON in submit_order: {str(e)}")
+            logger.warning("Invalid JSON in submit_order: %s", e)
             return JsonResponse({'success': False, 'error': 'Invalid data'}, status=400)
         
-        # Import here to avoid circular imports
-        from orders.models import Order, OrderItem
-        from menu.models import Product
-        
-        # Example order creation (assuming order_data contains items and necessary info)
+        # Order and item writes run in one write transaction (see Dalooneh.db)
         new_order = None
         if 'order_id' in order_data and order_data['order_id']:
             # Update existing order
-            try:
-                new_order = Order.objects.get(id=order_data['order_id'])
-                print(f"DEBUG: Found existing order with ID {new_order.id}")
-                
-                # Clean up duplicates before confirming the order
-                cleanup_duplicates(new_order)
-                
-                # Change status from pending to confirmed
-                if new_order.status == 'pending':
-                    new_order.status = 'confirmed'
-                    new_order.save(update_fields=['status'])
-                    print(f"DEBUG: Updated order {new_order.id} status to 'confirmed'")
-                else:
-                    print(f"DEBUG: Order {new_order.id} already has status '{new_order.status}', not changing")
-            except Order.DoesNotExist:
-                print(f"DEBUG: Order with ID {order_data['order_id']} not found")
-                new_order = None
+            new_order = _confirm_existing_order(order_data['order_id'])
         
         if not new_order:
             # Create new order
-            from customers.models import Customer
-            from django.contrib.auth.models import User
-            
-            # Try to get customer from various sources
-            customer = None
-            
-            # First, check if we have a customer_id in the session (from phone modal)
-            customer_id = request.session.get('customer_id')
-            if customer_id:
-                try:
-                    customer = Customer.objects.get(id=customer_id)
-                    print(f"DEBUG: Using customer from session with ID: {customer_id} for submit_order")
-                except Customer.DoesNotExist:
-                    print(f"DEBUG: Customer with ID {customer_id} not found")
-                    customer = None
+            # Customer from the phone modal, the logged-in user or the remembered phone number
+            customer = resolver.from_request(request)
+            if customer:
+                logger.debug("Using customer %s for submit_order", customer.id)
             
-            # Then check if user is authenticated
-            if not customer and request.user.is_authenticated and hasattr(request.user, 'customer'):
-                customer = request.user.customer
-                print(f"DEBUG: Using authenticated customer: {customer.id} for submit_order")
-            
-            # If still no customer, check if there's a phone number in session
-            if not customer and request.session.get('customer_phone'):
-                phone_number = request.session.get('customer_phone')
-                customer = Customer.objects.filter(phone_number=phone_number).first()
-                if customer:
-                    print(f"DEBUG: Found customer by phone number: {phone_number} for submit_order")
-            
-            # If still no customer, create a new one with a generic phone number if we don't have one
+            # If still no customer, use the phone number from the order data; otherwise this is a guest order
             if not customer:
-                print("DEBUG: No customer found, creating a temporary one")
-                
-                # See if we can get the phone number from the order data
                 phone_number = order_data.get('phone_number', '')
-                
-                if not phone_number:
-                    # Generate random username if we don't have a phone number
-                    username = f"temp_{uuid.uuid4().hex[:8]}"
-                    phone_number = f"temp_{uuid.uuid4().hex[:8]}"
+                if phone_number and normalize_phone(phone_number):
+                    customer, created = resolver.get_or_create(phone_number)
+                    resolver.remember(request, customer)
+                    logger.debug("Using customer %s from the submitted phone number", customer.id)
                 else:
-                    # Use phone number as username base
-                    username = f"user_{phone_number}"
-                
-                # Create a new user without password
-                user = User.objects.create(
-                    username=username,
-                    email="",
-                    is_active=True
-                )
-                # Set a non-usable password
-                user.set_unusable_password()
-                user.save()
-                
-                # Create a new customer
-                customer = Customer.objects.create(
-                    user=user,
-                    phone_number=phone_number,
-                    national_code=None,
-                    membership_level="regular", 
-                    total_points=0
-                )
-                
-                # Store in session for future use
-                request.session['customer_id'] = customer.id
-                request.session['customer_phone'] = phone_number
-                
-                print(f"DEBUG: Created new customer with ID: {customer.id} and phone: {phone_number}")
+                    logger.debug("No customer found, placing a guest order")
             
-            # Find the existing pending order for this table
-            existing_order = Order.objects.filter(
-                table=session.table,
-                status='pending'
-            ).first()
-            
-            if existing_order:
-                # Use the existing order and update its status
-                new_order = existing_order
-                print(f"DEBUG: Using existing pending order {new_order.id}")
-                
-                # Update customer if needed
-                if new_order.customer != customer:
-                    print(f"DEBUG: Updating order customer from {new_order.customer.id} to {customer.id}")
-                    new_order.customer = customer
-                
-                # Set status to confirmed
-                if new_order.status == 'pending':
-                    new_order.status = 'confirmed'
-                    print(f"DEBUG: Setting order status to 'confirmed'")
-                
-                new_order.save()
-                print(f"DEBUG: Updated existing order {new_order.id} status to 'confirmed'")
-                
-                # Make sure order items are present and correct
-                if new_order.items.count() == 0:
-                    print(f"WARNING: Order {new_order.id} has no items, but should have items in cart")
-            else:
-                # Create a new order from scratch
-                try:
-                    print(f"DEBUG: Creating new order for table {session.table.number}")
-                    new_order = Order.objects.create(
-                        customer=customer,
-                        table=session.table,
-                        status='confirmed',  # Set status directly to confirmed
-                        total_amount=order_data.get('total_amount', 0),
-                        discount_amount=order_data.get('discount_amount', 0),
-                        final_amount=order_data.get('final_amount', 0),
-                        notes=order_data.get('notes', '')
-                    )
-                    print(f"DEBUG: Created new order {new_order.id} for customer {customer.id}")
-                    
-                    # Log the items from order_data for debugging
-                    if 'items' in order_data:
-                        print(f"DEBUG: Creating {len(order_data['items'])} items for new order")
-                        
-                        # Create order items
-                        for item_data in order_data.get('items', []):
-                            try:
-                                product = Product.objects.get(id=item_data['product_id'])
-                                OrderItem.objects.create(
-                                    order=new_order,
-                                    product=product,
-                                    quantity=item_data['quantity'],
-                                    price=item_data['price'],
-                                    notes=item_data.get('notes', '')
-                                )
-                                print(f"DEBUG: Added item product={product.id}, qty={item_data['quantity']}")
-                            except Product.DoesNotExist:
-                                print(f"ERROR: Product with ID {item_data['product_id']} not found")
-                            except Exception as e:
-                                print(f"ERROR: Could not create order item: {str(e)}")
-                    else:
-                        print("WARNING: No items found in order_data")
-                except Exception as e:
-                    print(f"ERROR: Could not create order: {str(e)}")
-                    raise
+            new_order = _confirm_table_order(session, customer, order_data)
         
         # Mark session as having submitted an order
         session.mark_order_submitted()
-        print(f"DEBUG: Marked session {session.token} as having submitted an order")
+        logger.debug("Marked session %s as having submitted an order", session.token)
         
         # Return success with redirect URL to order summary
         return JsonResponse({
@@ -484,12 +542,10 @@ def submit_order(request):
         })
         
     except TableSession.DoesNotExist:
-        print(f"ERROR: Invalid session token: {token}")
+        logger.warning("Invalid session token: %s", token)
         return JsonResponse({'success': False, 'error': 'Invalid session'}, status=400)
     except Exception as e:
-        print(f"ERROR in submit_order: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("submit_order failed")
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
 def complete_order(request, order_id):
@@ -531,7 +587,7 @@ def order_summary(request, order_id=None):
     
     # Case 1: Viewing a specific order (passed in URL)
     if order_id:
-        order = get_object_or_404(Order, id=order_id)
+        order = get_object_or_404(Order.objects.select_related('table'), id=order_id)
     else:
         # Case 2: Check if there's a valid table session
         token = request.session.get('table_token')
@@ -541,7 +597,7 @@ def order_summary(request, order_id=None):
             return redirect('/')
         
         try:
-            session = TableSession.objects.get(token=token)
+            session = get_table_session(request, token)
             # Check if session is valid
             if not session.is_valid():
                 if not request.user.is_staff and not request.user.is_superuser:
@@ -564,7 +620,7 @@ def order_summary(request, order_id=None):
         'order': order,
         'table_number': order.table.number,
         'order_time': order.created_at,
-        'items': order.items.all(),
+        'items': order.items.select_related('product'),
         'total_amount': order.final_amount,
     }
     
@@ -602,11 +658,16 @@ def cleanup_duplicates(order):
             # Delete the rest
             items.exclude(id=item_to_keep.id).delete()
             
-            print(f"DEBUG: Cleaned up duplicates for product {product_id} in order {order.id}")
+            logger.debug("Cleaned up duplicates for product %s in order %s", product_id, order.id)
+
+
+def cart_item_count(items):
+    """Number of units in a cart, for the cart badge"""
+    return sum(item.quantity for item in items)
 
 
 @require_POST
-def add_to_cart(request):
+async def add_to_cart(request):
     """
     Add a product to the cart based on the table session
     This does not require login as it works with table sessions
@@ -616,7 +677,7 @@ def add_to_cart(request):
         quantity = int(request.POST.get('quantity', 1))
         
         # Validate the table session
-        token = request.session.get('table_token')
+        token = await request.session.aget('table_token')
         if not token:
             return JsonResponse({
                 'success': False,
@@ -624,10 +685,10 @@ def add_to_cart(request):
             }, status=400)
         
         try:
-            session = TableSession.objects.get(token=token)
+            session = await aget_table_session(request, token)
             
             # Check if session is valid
-            if not session.is_valid():
+            if not await session.ais_valid():
                 return JsonResponse({
                     'success': False,
                     'message': 'Your session has expired. Please scan the table QR code again.'
@@ -635,69 +696,24 @@ def add_to_cart(request):
             
             # Get product
             from menu.models import Product
-            product = get_object_or_404(Product, id=product_id, is_active=True)
+            product = await aget_object_or_404(Product, id=product_id, is_active=True)
             
             # Import Order models
             from orders.models import Order, OrderItem
             
             # Check if there's an existing pending order for this table
-            order = Order.objects.filter(
+            order = await Order.objects.filter(
                 table=session.table,
                 status='pending'
-            ).first()
+            ).afirst()
             
             # If no pending order exists, create a new one
             if not order:
-                # Use customer from session or create a new one
-                from customers.models import Customer
-                from django.contrib.auth.models import User
-                
-                customer = None
-                
-                # First, check if we have a customer_id in the session (from phone modal)
-                customer_id = request.session.get('customer_id')
-                if customer_id:
-                    try:
-                        customer = Customer.objects.get(id=customer_id)
-                        print(f"DEBUG: Using customer from session with ID: {customer_id}")
-                    except Customer.DoesNotExist:
-                        print(f"DEBUG: Customer with ID {customer_id} not found")
-                        customer = None
-                
-                # Then check if user is authenticated
-                if not customer and request.user.is_authenticated and hasattr(request.user, 'customer'):
-                    customer = request.user.customer
-                    print(f"DEBUG: Using authenticated customer: {customer.id}")
-                
-                # If still no customer, check if there's a phone number in session
-                if not customer and request.session.get('customer_phone'):
-                    phone_number = request.session.get('customer_phone')
-                    customer = Customer.objects.filter(phone_number=phone_number).first()
-                    if customer:
-                        print(f"DEBUG: Found customer by phone number: {phone_number}")
-                
-                # If still no customer, create an anonymous one
-                if not customer:
-                    print("DEBUG: Creating anonymous customer")
-                    anonymous_user, created = User.objects.get_or_create(
-                        username='anonymous',
-                        defaults={
-                            'first_name': 'Anonymous',
-                            'last_name': 'Customer',
-                            'is_active': True
-                        }
-                    )
-                    
-                    customer, created = Customer.objects.get_or_create(
-                        user=anonymous_user,
-                        defaults={
-                            'phone_number': '00000000000',
-                            'national_code': '0000000000'
-                        }
-                    )
-                
+                # Customer from the phone modal, the logged-in user or the remembered phone number;
+                # without one the order is a guest order
+                customer = await resolver.afrom_request(request)
                 # Create new order
-                order = Order.objects.create(
+                order = await Order.objects.acreate(
                     customer=customer,
                     table=session.table,
                     status='pending',
@@ -706,10 +722,10 @@ def add_to_cart(request):
                     discount_amount=0,
                     final_amount=0
                 )
-                print(f"DEBUG: Created new order {order.id} for customer {customer.id}")
+                logger.debug("Created cart order %s for customer %s", order.id, customer.id if customer else 'guest')
             
             # Clean up any existing duplicates first
-            cleanup_duplicates(order)
+            await sync_to_async(cleanup_duplicates)(order)
             
             # Check for duplicate items first and remove them
             duplicate_items = OrderItem.objects.filter(
@@ -717,19 +733,19 @@ def add_to_cart(request):
                 product=product
             )
             
-            if duplicate_items.count() > 1:
+            if await duplicate_items.acount() > 1:
                 # Keep only one and delete others
-                item_to_keep = duplicate_items.first()
-                duplicate_items.exclude(id=item_to_keep.id).delete()
+                item_to_keep = await duplicate_items.afirst()
+                await duplicate_items.exclude(id=item_to_keep.id).adelete()
                 
                 # Update the remaining item
                 item_to_keep.quantity = quantity
-                item_to_keep.save()
+                await item_to_keep.asave()
                 order_item = item_to_keep
                 created = False
             else:
                 # Add or update order item
-                order_item, created = OrderItem.objects.get_or_create(
+                order_item, created = await OrderItem.objects.aget_or_create(
                     order=order,
                     product=product,
                     defaults={
@@ -741,21 +757,18 @@ def add_to_cart(request):
                 if not created:
                     # If item already exists in cart, replace quantity with new value
                     order_item.quantity = quantity
-                    order_item.save()
+                    await order_item.asave()
             
-            # Update order totals
-            # Calculate totals based on items
-            total = sum(item.quantity * item.price for item in order.items.all())
-            order.total_amount = total
-            order.final_amount = total - order.discount_amount
-            order.save()
+            # Update order totals; the discount is re-evaluated against the new subtotal
+            items = await order.arecalculate_totals()
             
             # Get total items count in cart
-            cart_count = sum(item.quantity for item in order.items.all())
+            cart_count = cart_item_count(items)
             
             return JsonResponse({
                 'success': True,
                 'message': 'Item added to cart',
+                'item_id': order_item.id,
                 'cart_count': cart_count,
                 'order_total': float(order.final_amount)
             })
@@ -767,7 +780,7 @@ def add_to_cart(request):
             }, status=400)
             
     except Exception as e:
-        print(f"ERROR in add_to_cart: {str(e)}")
+        logger.exception("Could not add to cart")
         return JsonResponse({
             'success': False,
             'message': f'Error: {str(e)}'
@@ -786,7 +799,7 @@ def view_cart(request):
         return redirect('/')
     
     try:
-        session = TableSession.objects.get(token=token)
+        session = get_table_session(request, token)
         
         # Check if session is valid
         if not session.is_valid():
@@ -801,7 +814,7 @@ def view_cart(request):
         order = Order.objects.filter(
             table=session.table,
             status='pending'
-        ).first()
+        ).select_related('customer').first()
         
         if not order or order.items.count() == 0:
             if not request.user.is_staff and not request.user.is_superuser:
@@ -811,18 +824,14 @@ def view_cart(request):
         # Clean up any duplicates before showing the cart
         cleanup_duplicates(order)
         
-        # Update order totals (ensure they're accurate)
-        total = sum(item.quantity * item.price for item in order.items.all())
-        if total != order.total_amount or (total - order.discount_amount) != order.final_amount:
-            order.total_amount = total
-            order.final_amount = total - order.discount_amount
-            order.save(update_fields=['total_amount', 'final_amount'])
-            print(f"DEBUG: Updated order totals in view_cart: total={total}, final={order.final_amount}")
+        # Update order totals (ensure they're accurate), applying the best discount for the customer
+        items = order.recalculate_totals()
+        prefetch_related_objects(items, 'product')
         
         # Prepare context
         context = {
             'order': order,
-            'items': order.items.all().prefetch_related('product'),
+            'items': items,
             'table': session.table,
             'session': session
         }
@@ -836,7 +845,7 @@ def view_cart(request):
 
 
 @require_POST
-def update_cart_item(request, item_id):
+async def update_cart_item(request, item_id):
     """
     Update quantity of a cart item
     """
@@ -844,7 +853,7 @@ def update_cart_item(request, item_id):
         new_quantity = int(request.POST.get('quantity', 1))
         
         # Check for valid session
-        token = request.session.get('table_token')
+        token = await request.session.aget('table_token')
         if not token:
             return JsonResponse({
                 'success': False,
@@ -852,10 +861,10 @@ def update_cart_item(request, item_id):
             }, status=400)
         
         try:
-            session = TableSession.objects.get(token=token)
+            session = await aget_table_session(request, token)
             
             # Check if session is valid
-            if not session.is_valid():
+            if not await session.ais_valid():
                 return JsonResponse({
                     'success': False,
                     'message': 'Session expired.'
@@ -865,10 +874,10 @@ def update_cart_item(request, item_id):
             from orders.models import OrderItem
             
             # Get the order item
-            order_item = get_object_or_404(OrderItem, id=item_id)
+            order_item = await aget_object_or_404(OrderItem.objects.select_related('order'), id=item_id)
             
             # Make sure the item belongs to an order for this table
-            if order_item.order.table != session.table:
+            if order_item.order.table_id != session.table_id:
                 return JsonResponse({
                     'success': False,
                     'message': 'Unauthorized.'
@@ -876,17 +885,14 @@ def update_cart_item(request, item_id):
             
             # Update order item quantity
             order_item.quantity = new_quantity
-            order_item.save()
+            await order_item.asave()
             
-            # Calculate new totals
+            # Calculate new totals; the discount is re-evaluated against the new subtotal
             order = order_item.order
-            total = sum(item.quantity * item.price for item in order.items.all())
-            order.total_amount = total
-            order.final_amount = total - order.discount_amount
-            order.save()
+            items = await order.arecalculate_totals()
             
             # Get total items count in cart
-            cart_count = sum(item.quantity for item in order.items.all())
+            cart_count = cart_item_count(items)
             
             return JsonResponse({
                 'success': True,
@@ -912,13 +918,13 @@ def update_cart_item(request, item_id):
 
 
 @require_POST
-def remove_cart_item(request, item_id):
+async def remove_cart_item(request, item_id):
     """
     Remove an item from the cart
     """
     try:
         # Check for valid session
-        token = request.session.get('table_token')
+        token = await request.session.aget('table_token')
         if not token:
             return JsonResponse({
                 'success': False,
@@ -926,10 +932,10 @@ def remove_cart_item(request, item_id):
             }, status=400)
         
         try:
-            session = TableSession.objects.get(token=token)
+            session = await aget_table_session(request, token)
             
             # Check if session is valid
-            if not session.is_valid():
+            if not await session.ais_valid():
                 return JsonResponse({
                     'success': False,
                     'message': 'Session expired.'
@@ -939,10 +945,10 @@ def remove_cart_item(request, item_id):
             from orders.models import OrderItem
             
             # Get the order item
-            order_item = get_object_or_404(OrderItem, id=item_id)
+            order_item = await aget_object_or_404(OrderItem.objects.select_related('order'), id=item_id)
             
             # Make sure the item belongs to an order for this table
-            if order_item.order.table != session.table:
+            if order_item.order.table_id != session.table_id:
                 return JsonResponse({
                     'success': False,
                     'message': 'Unauthorized.'
@@ -952,30 +958,19 @@ def remove_cart_item(request, item_id):
             order = order_item.order
             
             # Remove the item
-            order_item.delete()
+            await order_item.adelete()
             
-            # Calculate new totals
-            remaining_items = order.items.all()
-            if remaining_items:
-                total = sum(item.quantity * item.price for item in remaining_items)
-                order.total_amount = total
-                order.final_amount = total - order.discount_amount
-                order.save()
-                
-                # Get total items count in cart
-                cart_count = sum(item.quantity for item in remaining_items)
-            else:
-                # If no items left, set totals to zero
-                order.total_amount = 0
-                order.final_amount = 0
-                order.save()
-                cart_count = 0
+            # Calculate new totals; the discount is re-evaluated against the new subtotal
+            remaining_items = await order.arecalculate_totals()
+            
+            # Get total items count in cart
+            cart_count = cart_item_count(remaining_items)
             
             return JsonResponse({
                 'success': True,
                 'message': 'Item removed from cart',
                 'order_total': float(order.final_amount),
-                'empty_cart': not remaining_items.exists(),
+                'empty_cart': not remaining_items,
                 'cart_count': cart_count
             })
             
@@ -993,36 +988,36 @@ def remove_cart_item(request, item_id):
 
 
 @require_GET
-def get_cart_count_ajax(request):
+async def get_cart_count_ajax(request):
     """
     AJAX endpoint to get the current cart count
     """
     # Check if user has a valid session
-    token = request.session.get('table_token')
+    token = await request.session.aget('table_token')
     if not token:
         return JsonResponse({'cart_count': 0})
     
     try:
-        session = TableSession.objects.get(token=token)
+        session = await aget_table_session(request, token)
         
         # Check if session is valid
-        if not session.is_valid():
+        if not await session.ais_valid():
             return JsonResponse({'cart_count': 0})
         
         # Import Order models
         from orders.models import Order
         
         # Get pending order for this table
-        order = Order.objects.filter(
-            table=session.table,
+        order = await Order.objects.filter(
+            table_id=session.table_id,
             status='pending'
-        ).first()
+        ).afirst()
         
-        if not order or order.items.count() == 0:
+        if not order:
             return JsonResponse({'cart_count': 0})
         
         # Get total items count in cart
-        cart_count = sum(item.quantity for item in order.items.all())
+        cart_count = cart_item_count([item async for item in order.items.all()])
         
         return JsonResponse({'cart_count': cart_count})
         
@@ -1039,7 +1034,7 @@ def cleanup_cart_data(request, token=None, new_table_id=None):
         token: The session token to clean up (if None, uses token from request)
         new_table_id: The ID of the new table being accessed (if applicable)
     """
-    from orders.models import Order
+    from orders.models import Order, OrderItem
     
     try:
         # If no token provided, get from request
@@ -1051,9 +1046,9 @@ def cleanup_cart_data(request, token=None, new_table_id=None):
         # Find the session
         session = None
         try:
-            session = TableSession.objects.get(token=token)
+            session = get_table_session(request, token)
         except TableSession.DoesNotExist:
-            print(f"DEBUG: Session with token {token} not found for cleanup")
+            logger.debug("Session %s not found for cleanup", token)
             clear_session_data(request)
             return
         
@@ -1062,7 +1057,7 @@ def cleanup_cart_data(request, token=None, new_table_id=None):
         
         # If this is a table change, ensure we clean the old table's pending orders
         if new_table_id and table.id != new_table_id:
-            print(f"DEBUG: Table changed from {table.id} to {new_table_id}, cleaning up old table's orders")
+            logger.debug("Table changed from %s to %s, cleaning up the old table's orders", table.id, new_table_id)
         
         # Find and clean up any pending orders
         pending_orders = Order.objects.filter(
@@ -1070,34 +1065,24 @@ def cleanup_cart_data(request, token=None, new_table_id=None):
             status='pending'
         )
         
-        if pending_orders.exists():
-            print(f"DEBUG: Found {pending_orders.count()} pending orders to clean up")
-            for order in pending_orders:
-                # Delete all order items
-                item_count = order.items.count()
-                if item_count > 0:
-                    print(f"DEBUG: Deleting {item_count} items from order {order.id}")
-                    order.items.all().delete()
-                
-                # Update order totals
-                order.total_amount = 0
-                order.final_amount = 0
-                order.save(update_fields=['total_amount', 'final_amount'])
-                print(f"DEBUG: Reset order {order.id} totals to 0")
+        pending_ids = list(pending_orders.values_list('id', flat=True))
+        if pending_ids:
+            logger.debug("Found %s pending orders to clean up", len(pending_ids))
+            # Delete all their items and reset the totals
+            OrderItem.objects.filter(order_id__in=pending_ids).delete()
+            Order.objects.filter(id__in=pending_ids).update(total_amount=0, final_amount=0)
         
         # If session is active but expired, deactivate it
         if session.is_active and session.is_expired():
-            print(f"DEBUG: Deactivating expired session {session.token}")
+            logger.debug("Deactivating expired session %s", session.token)
             session.deactivate()
         
         # If we're changing tables or sessions, clear session data
         if new_table_id or (session.is_expired() or not session.is_active):
             clear_session_data(request)
             
-    except Exception as e:
-        print(f"ERROR in cleanup_cart_data: {str(e)}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("cleanup_cart_data failed")
 
 # Management panel views
 @superuser_required
@@ -1109,7 +1094,7 @@ def management_dashboard(request):
         return redirect('/')
     
     # Get all tables
-    tables = Table.objects.all()
+    tables = Table.objects.with_open_orders()
     
     # Get count statistics
     table_count = tables.count()
@@ -1158,23 +1143,15 @@ def management_table_list(request):
     if search:
         tables_queryset = tables_queryset.filter(number__icontains=search)
     
-    # Sort tables by number
-    tables = list(tables_queryset.order_by('number'))
-    
-    # Force refresh of table occupation status by checking related orders
-    from orders.models import Order
-    
-    # Get active orders for all tables to refresh their occupied status
-    active_order_tables = Order.objects.filter(
-        status__in=['pending', 'confirmed', 'preparing', 'ready']
-    ).values_list('table_id', flat=True)
+    # Sort tables by number; their open orders are prefetched for the occupation status
+    tables = list(tables_queryset.with_open_orders().order_by('number'))
     
     # After queryset filtering, filter for occupied/available status
     # This needs to be done in Python since is_occupied is a property
     if status == 'occupied':
-        tables = [table for table in tables if table.id in active_order_tables]
+        tables = [table for table in tables if table.is_occupied]
     elif status == 'available':
-        tables = [table for table in tables if table.id not in active_order_tables]
+        tables = [table for table in tables if not table.is_occupied]
     
     # Get unique seat options for filter dropdown
     seat_options = Table.objects.values_list('seats', flat=True).distinct().order_by('seats')
@@ -1197,14 +1174,14 @@ def management_table_detail(request, table_id):
         messages.error(request, 'You do not have permission to view this page.')
         return redirect('/')
     
-    table = get_object_or_404(Table, id=table_id)
+    table = get_object_or_404(Table.objects.with_open_orders(), id=table_id)
     
     # Get table sessions ordered by creation date
     sessions = TableSession.objects.filter(table=table).order_by('-created_at')[:20]
     
     # Get orders for this table
     from orders.models import Order
-    orders = Order.objects.filter(table=table).order_by('-created_at')[:10]
+    orders = Order.objects.filter(table=table).select_related('customer__user').order_by('-created_at')[:10]
     
     context = {
         'table': table,
@@ -1231,7 +1208,7 @@ def management_table_add(request):
             
             # Log table creation - only if user has staff profile
             if hasattr(request.user, 'staff'):
-                StaffLog.objects.create(
+                audit_log(
                     staff=request.user.staff,
                     action='table_create',
                     details=f'Table #{table.number} created',
@@ -1272,7 +1249,7 @@ def management_table_edit(request, table_id):
             
             # Log table update - only if user has staff profile
             if hasattr(request.user, 'staff'):
-                StaffLog.objects.create(
+                audit_log(
                     staff=request.user.staff,
                     action='table_update',
                     details=f'Table #{table.number} updated',
@@ -1318,7 +1295,7 @@ def management_table_delete(request, table_id):
         # Log table deletion - only if user has staff profile
         table_number = table.number
         if hasattr(request.user, 'staff'):
-            StaffLog.objects.create(
+            audit_log(
                 staff=request.user.staff,
                 action='table_delete',
                 details=f'Table #{table_number} deleted',
@@ -1351,7 +1328,7 @@ def management_table_toggle_status(request, table_id):
     
     # Log status change - only if user has staff profile
     if hasattr(request.user, 'staff'):
-        StaffLog.objects.create(
+        audit_log(
             staff=request.user.staff,
             action='table_status_change',
             details=f'Table #{table.number} status changed to {"active" if table.is_active else "inactive"}',
@@ -1384,7 +1361,7 @@ def management_table_free(request, table_id):
     
     # Log table freed - only if user has staff profile
     if hasattr(request.user, 'staff'):
-        StaffLog.objects.create(
+        audit_log(
             staff=request.user.staff,
             action='table_free',
             details=f'Table #{table.number} freed',
@@ -1405,20 +1382,18 @@ def management_free_all_tables(request):
         return redirect('/')
     
     # Get all occupied tables
-    tables = Table.objects.all()
-    
-    # Counter for freed tables
-    freed_count = 0
+    occupied_ids = list(
+        Table.objects.filter(orders__status__in=OPEN_ORDER_STATUSES).values_list('id', flat=True).distinct()
+    )
+    freed_count = len(occupied_ids)
     
-    # Free each occupied table
-    for table in tables:
-        if table.is_occupied:
-            table.free_table()
-            freed_count += 1
+    # Free them all at once
+    if occupied_ids:
+        Table.objects.filter(id__in=occupied_ids).free()
     
     # Log action - only if user has staff profile
     if hasattr(request.user, 'staff'):
-        StaffLog.objects.create(
+        audit_log(
             staff=request.user.staff,
             action='free_all_tables',
             details=f'Freed {freed_count} occupied tables',
@@ -1458,7 +1433,7 @@ def management_generate_qr(request):
         
         # Log QR code generation - only if user has staff profile
         if hasattr(request.user, 'staff'):
-            StaffLog.objects.create(
+            audit_log(
                 staff=request.user.staff,
                 action='qr_generate',
                 details=f'QR code generated for table #{table.number}',
@@ -1479,16 +1454,22 @@ def management_generate_all_qr(request):
         return redirect('/')
     
     # Get all active tables without QR codes
-    tables = Table.objects.filter(is_active=True, qr_code='')
+    tables = list(Table.objects.filter(is_active=True, qr_code=''))
     
-    count = 0
+    now = timezone.now()
     for table in tables:
-        table.generate_qr_code()
-        count += 1
+        table.generate_qr_code(save=False)
+        table.updated_at = now
+    count = len(tables)
+    
+    # Save them with one UPDATE; bulk_update() skips post_save, which drops the cached token validations
+    if tables:
+        Table.objects.bulk_update(tables, ['qr_code', 'updated_at'])
+        tables_cache.invalidate()
     
     # Log QR code generation - only if user has staff profile
     if hasattr(request.user, 'staff'):
-        StaffLog.objects.create(
+        audit_log(
             staff=request.user.staff,
             action='qr_generate_all',
             details=f'QR codes generated for {count} tables that did not have codes',
@@ -1525,6 +1506,8 @@ def management_session_list(request):
         sessions_queryset = sessions_queryset.filter(is_active=True)
     elif status == 'inactive':
         sessions_queryset = sessions_queryset.filter(is_active=False)
+    elif status == 'expired':
+        sessions_queryset = sessions_queryset.filter(expires_at__lt=timezone.now())
     
     if table_id:
         sessions_queryset = sessions_queryset.filter(table_id=table_id)
@@ -1535,19 +1518,15 @@ def management_session_list(request):
     if date_to:
         sessions_queryset = sessions_queryset.filter(created_at__lte=f"{date_to} 23:59:59")
     
-    # Sort sessions by creation date (newest first)
-    sessions = sessions_queryset.order_by('-created_at')
+    # Newest first, one page at a time
+    page_obj = paginate_keyset(request, sessions_queryset)
     
     # Get all tables for filter dropdown
     all_tables = Table.objects.all().order_by('number')
     
-    # Filter for expired status
-    if status == 'expired':
-        # Not efficient, but we need to check is_expired() which is a Python method
-        sessions = [session for session in sessions if session.is_expired()]
-    
     context = {
-        'sessions': sessions,
+        'sessions': page_obj.object_list,
+        'page_obj': page_obj,
         'status': status,
         'table_id': table_id,
         'date_from': date_from,
@@ -1565,37 +1544,27 @@ def management_session_detail(request, session_id):
         messages.error(request, 'You do not have permission to view this page.')
         return redirect('/')
     
-    session = get_object_or_404(TableSession, id=session_id)
-    
-    # Get pending cart items for this session
-    from orders.models import Order, OrderItem
-    
-    # Get active order
-    active_order = None
-    order_items = []
-    pending_cart_items = []
+    # The table comes with its open orders, for the occupation status and the orders below
+    session = get_object_or_404(
+        TableSession.objects.prefetch_related(Prefetch('table', queryset=Table.objects.with_open_orders())),
+        id=session_id
+    )
+    open_orders = session.table.open_orders
     
-    try:
-        active_order = Order.objects.filter(
-            table=session.table,
-            status__in=['pending', 'confirmed', 'preparing', 'ready']
-        ).latest('created_at')
-        
-        if active_order:
-            order_items = active_order.items.all()
-    except Order.DoesNotExist:
-        pass
+    # Get active order (the latest open one)
+    active_order = open_orders[0] if open_orders else None
     
-    # If we have an active token but no submitted order, check for cart items
+    # If we have an active token but no submitted order, check for cart items in the latest pending order
+    pending_order = None
     if session.is_active and not session.order_submitted:
-        # Get the latest pending order
-        pending_order = Order.objects.filter(
-            table=session.table,
-            status='pending'
-        ).first()
-        
-        if pending_order:
-            pending_cart_items = pending_order.items.all()
+        pending_order = next((order for order in open_orders if order.status == 'pending'), None)
+    
+    # Items of both orders with one query
+    from orders.models import OrderItem
+    orders = [order for order in (active_order, pending_order) if order]
+    prefetch_related_objects(orders, Prefetch('items', queryset=OrderItem.objects.select_related('product')))
+    order_items = active_order.items.all() if active_order else []
+    pending_cart_items = pending_order.items.all() if pending_order else []
     
     context = {
         'session': session,
@@ -1631,7 +1600,7 @@ def management_session_deactivate(request):
         
         # Log session deactivation - only if user has staff profile
         if hasattr(request.user, 'staff'):
-            StaffLog.objects.create(
+            audit_log(
                 staff=request.user.staff,
                 action='session_deactivate',
                 details=f'Session {session_id} deactivated for table #{session.table.number}',